@@ -37,9 +37,12 @@ from alnair.package import (
     ); Package; Setup; Command  # pyflakes
 from alnair.distribution import Distribution; Distribution  # pyflakes
 from alnair.exception import (
+    DeadlineExceededError,
+    InventoryError,
     NoSuchDirectoryError,
     NoSuchFileError,
     UndefinedPackageError,
-    ); NoSuchDirectoryError; NoSuchFileError; UndefinedPackageError  # pyflakes
+    ); (DeadlineExceededError, InventoryError, NoSuchDirectoryError,
+        NoSuchFileError, UndefinedPackageError)  # pyflakes
 
 setup = Setup(_Host())  # for system wide settings
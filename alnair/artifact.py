@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+from alnair import transfer
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+DEFAULT_ARTIFACT_DIR = os.path.join('~', '.cache', 'alnair', 'artifacts')
+
+MANIFEST = 'manifest.json'
+
+# seconds to keep the downloaded package files, so that the updated
+# packages of the mirror are installed
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def download(names, download_command, directory):
+    """Download the package files on the current host into the directory
+
+    :param names: list of package names
+    :param download_command: command to download the package files of names
+        into the current directory (e.g. 'apt-get download')
+    :param directory: local directory to get the files into
+    :returns: sorted list of file names
+    """
+    staging = transfer.remote_staging_dir()
+    try:
+        with fa.cd(staging):
+            fa.sudo('%s %s' % (download_command, ' '.join(names)))
+        paths = fa.get('%s/*' % staging, directory, use_sudo=True)
+    finally:
+        with fa.settings(fa.hide('everything'), warn_only=True):
+            fa.sudo('rm -rf -- %s' % staging)
+    return sorted(os.path.basename(path) for path in paths)
+
+
+class ArtifactCache(object):
+    def __init__(self, directory=None, ttl=DEFAULT_TTL):
+        """Constructor of ArtifactCache class
+
+        The package files are downloaded once on the first host which needs
+        those, and kept in the directory of each distribution on the
+        controller, so that the other hosts are given the files instead of
+        downloading those from the mirror.
+
+        :param directory: directory of the cache. If None,
+            :data:`DEFAULT_ARTIFACT_DIR`.
+        :param ttl: seconds to use the downloaded files of a package. Those
+            are downloaded again after that.
+        """
+        self.directory = os.path.expanduser(directory or DEFAULT_ARTIFACT_DIR)
+        self.ttl = ttl
+
+    def path(self, distname):
+        return os.path.join(self.directory, distname)
+
+    def load(self, distname):
+        """Load the manifest of the distribution
+
+        :param distname: distribution name
+        :returns: dict of package name key and dict value which has `files`
+            list of file names and `downloaded` time
+        """
+        try:
+            with open(os.path.join(self.path(distname), MANIFEST)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self, distname, manifest):
+        path = os.path.join(self.path(distname), MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.rename(path + '.tmp', path)
+
+    @contextlib.contextmanager
+    def lock(self, distname):
+        """Lock the cache of the distribution against the other processes
+
+        :param distname: distribution name
+        """
+        directory = self.path(distname)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0o700)
+            except OSError:
+                # created by the other process
+                if not os.path.isdir(directory):
+                    raise
+        with open(os.path.join(directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def cached(self, distname, entry):
+        """Whether the files of the manifest entry can be used
+
+        :param distname: distribution name
+        :param entry: value of the manifest, see also :meth:`load`
+        :returns: True if the files are not expired and exist
+        """
+        if not isinstance(entry, dict) or \
+                time.time() - entry['downloaded'] > self.ttl:
+            return False
+        return all(os.path.isfile(os.path.join(self.path(distname), f))
+                for f in entry['files'])
+
+    def fetch(self, distname, names, download_command):
+        """Get the local paths of the package files
+
+        The package files which are not cached yet or have expired are
+        downloaded on the current host, one package at a time so that the
+        files are recorded for the package which they belong to.
+
+        :param distname: distribution name
+        :param names: list of package names
+        :param download_command: see also :func:`download`
+        :returns: sorted list of local paths
+        """
+        directory = self.path(distname)
+        with self.lock(distname):
+            manifest = self.load(distname)
+            for name in names:
+                if self.cached(distname, manifest.get(name)):
+                    continue
+                old = manifest.pop(name, None)
+                files = download([name], download_command, directory)
+                if not files:
+                    fa.abort(u"no package files of `%s` have been downloaded"
+                            % name)
+                manifest[name] = dict(files=files, downloaded=time.time())
+                self.save(distname, manifest)
+                if isinstance(old, dict):
+                    self.remove_unused(distname, manifest, old['files'])
+        return sorted(set(os.path.join(directory, f) for name in names
+            for f in manifest[name]['files']))
+
+    def remove_unused(self, distname, manifest, files):
+        """Remove the files which no package of the manifest uses
+
+        :param distname: distribution name
+        :param manifest: dict of manifest, see also :meth:`load`
+        :param files: list of file names to remove
+        """
+        used = set(f for entry in manifest.itervalues()
+                if isinstance(entry, dict) for f in entry['files'])
+        for f in files:
+            if f not in used:
+                try:
+                    os.remove(os.path.join(self.path(distname), f))
+                except OSError:
+                    pass
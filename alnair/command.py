@@ -30,11 +30,16 @@ __author__ = "Naoya Inada <naoina@kuune.org>"
 import argparse
 import os
 import sys
+import time
+
+import alnair
 
 from contextlib import nested
 from glob import glob
 
-from alnair import __version__, Distribution
+from alnair import __version__, DeadlineExceededError, Distribution
+from alnair.deadline import deadline
+from alnair.transfer import DEFAULT_COMPRESS_THRESHOLD
 
 dry_run = False
 
@@ -53,6 +58,72 @@ def create_from_template(filename, outputpath, **kwargs):
             wf.write(rf.read() % kwargs)
 
 
+def print_summary(lines):
+    for line in lines:
+        print line
+
+
+def timeout_type(value):
+    kind, sep, seconds = value.partition('=')
+    if kind not in Distribution.TIMEOUTS + ('host', 'run'):
+        raise argparse.ArgumentTypeError(u"unknown timeout kind `%s`" % kind)
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(u"invalid timeout seconds `%s`" %
+                seconds)
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(u"timeout seconds must be positive")
+    return kind, seconds
+
+
+def size_type(value):
+    from alnair.runner import parse_size
+    try:
+        parse_size(value, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(u"invalid size `%s`, must be N or"
+                u" P%%" % value)
+    return value
+
+
+def address_type(value):
+    host, sep, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(u"invalid address `%s`, must be"
+                u" HOST:PORT" % value)
+    return host or 'localhost', port
+
+
+def shard_type(value):
+    from alnair.shard import parse
+    try:
+        parse(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(unicode(exc))
+    return value
+
+
+def limit_type(value):
+    from alnair.resource import parse
+    try:
+        return parse(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(unicode(exc))
+
+
+def positive_type(value):
+    try:
+        value = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(u"invalid number `%s`" % value)
+    if value < 1:
+        raise argparse.ArgumentTypeError(u"number must be positive")
+    return value
+
+
 class subcommand(object):
     def __init__(self, subparsers):
         cls = self.__class__
@@ -152,6 +223,40 @@ class generate(subcommand):
                             package=package)
 
 
+# arguments to select the target hosts
+HOST_ARGS = [
+    (['--host'], dict(
+        dest='hosts',
+        metavar='HOST',
+        help=u"server hostname. If you want to target more than one host,"
+             u" please hostnames separated by commas. With --inventory,"
+             u" ranges (e.g. web[001-300]) and glob patterns (e.g. web*)"
+             u" are also allowed",
+        )),
+    (['-i', '--inventory'], dict(
+        dest='inventory',
+        metavar='FILE',
+        help=u"inventory file of hosts. If neither --host nor --group is"
+             u" given, all hosts in the inventory are targeted",
+        )),
+    (['--group'], dict(
+        dest='groups',
+        metavar='GROUP',
+        help=u"group name of hosts in the inventory. Glob patterns are"
+             u" allowed and more than one group can be separated by"
+             u" commas",
+        )),
+    (['--shard'], dict(
+        dest='shard',
+        metavar='I/N',
+        type=shard_type,
+        help=u"target only the hosts of the I-th of N shards. Hosts are"
+             u" assigned to shards by their names, so that N controllers"
+             u" target the disjoint subsets of the same hosts",
+        )),
+    ]
+
+
 @subcommand.define
 class setup(subcommand):
     """install and setup package(s) to server from recipe(s) (alias "s")"""
@@ -167,24 +272,143 @@ class setup(subcommand):
             nargs='+',
             help=u"name of package(s) to installation",
             )),
-        (['--host'], dict(
-            dest='hosts',
-            metavar='HOST',
-            help=u"server hostname. If you want to target more than one host,"
-                 u" please hostnames separated by commas",
+        ] + HOST_ARGS + [
+        (['--compress'], dict(
+            dest='compress',
+            action='store_const',
+            const=DEFAULT_COMPRESS_THRESHOLD,
+            help=u"compress the upload stream of config files larger than"
+                 u" %(const)s bytes",
+            )),
+        (['--compress-min-size'], dict(
+            dest='compress',
+            metavar='BYTES',
+            type=int,
+            help=u"same as --compress, but compress config files larger"
+                 u" than BYTES",
+            )),
+        (['--batch-size'], dict(
+            dest='batch_size',
+            metavar='N|P%',
+            type=size_type,
+            help=u"apply to N hosts (or P percent of hosts) in parallel at a"
+                 u" time. If not given, hosts are applied one by one",
+            )),
+        (['--max-failures'], dict(
+            dest='max_failures',
+            metavar='N|P%',
+            type=size_type,
+            help=u"stop after the batch in which more than N hosts (or P"
+                 u" percent of hosts) failed (default: 0). Hosts are applied"
+                 u" one by one in their own process if --batch-size is not"
+                 u" given",
+            )),
+        (['--facts-ttl'], dict(
+            dest='facts_ttl',
+            metavar='SECONDS',
+            type=float,
+            help=u"gather the facts of hosts (OS, architecture, installed"
+                 u" packages and hashes of config files) in one round trip"
+                 u" and skip the installed packages and the unchanged config"
+                 u" files. The facts are cached for SECONDS",
+            )),
+        (['--artifacts'], dict(
+            dest='artifacts',
+            action='store_const',
+            const='',
+            help=u"download the package files once on the first host by"
+                 u" `download_command` of common.py into the cache on the"
+                 u" controller, and install those on each host by"
+                 u" `local_install_command` instead of `install_command`",
+            )),
+        (['--artifact-dir'], dict(
+            dest='artifacts',
+            metavar='DIR',
+            help=u"same as --artifacts, but the cache is in DIR (default:"
+                 u" ~/.cache/alnair/artifacts)",
+            )),
+        (['--artifact-ttl'], dict(
+            dest='artifact_ttl',
+            metavar='SECONDS',
+            type=float,
+            help=u"download the package files of the artifact cache again"
+                 u" after SECONDS to install the updated packages (default:"
+                 u" 86400). 0 downloads those on each run",
+            )),
+        (['--metrics-file'], dict(
+            dest='metrics_file',
+            metavar='PATH',
+            help=u"write the metrics of the run (time of each phase, bytes,"
+                 u" round trips, skipped and applied items of each host) to"
+                 u" PATH in the Prometheus text format, e.g. for the textfile"
+                 u" collector of node_exporter",
+            )),
+        (['--statsd'], dict(
+            dest='statsd',
+            metavar='HOST:PORT',
+            type=address_type,
+            help=u"send the metrics of the run to statsd on HOST:PORT over"
+                 u" UDP",
+            )),
+        (['--events'], dict(
+            dest='events',
+            metavar='PATH',
+            help=u"append an event of each step (host, package, operation,"
+                 u" filename or command, seconds, outcome and bytes) to PATH"
+                 u" as a JSON object per line, or write those to the file"
+                 u" descriptor N if PATH is `fd:N`",
+            )),
+        (['--results'], dict(
+            dest='results_file',
+            metavar='PATH',
+            help=u"write the result of each host and the stats to PATH, to"
+                 u" be combined by `alnair merge`",
+            )),
+        (['--resume'], dict(
+            dest='resume',
+            metavar='RUN_ID',
+            help=u"skip the steps of hosts which have been completed in the"
+                 u" run of RUN_ID. The run ID is printed at the beginning of"
+                 u" each run",
+            )),
+        (['--load-jobs'], dict(
+            dest='load_jobs',
+            metavar='N',
+            type=positive_type,
+            help=u"evaluate the recipes in N worker processes in parallel",
+            )),
+        (['--timeout'], dict(
+            dest='timeouts',
+            metavar='KIND=SECONDS',
+            type=timeout_type,
+            action='append',
+            help=u"give up the host when the operation of KIND takes longer"
+                 u" than SECONDS. KIND is one of %s, `host` for all"
+                 u" operations to a host or `run` for whole run. Hosts are"
+                 u" applied in their own process if given. This option can"
+                 u" be used multiple times" % ', '.join(
+                     '`%s`' % k for k in Distribution.TIMEOUTS),
+            )),
+        (['--limit'], dict(
+            dest='limits',
+            metavar='RESOURCE=N',
+            type=limit_type,
+            action='append',
+            help=u"operate on RESOURCE from at most N hosts at once when"
+                 u" hosts are applied in parallel. RESOURCE is one of"
+                 u" `install`, `upload`, `commands` or the name given by"
+                 u" `Command.resource()` in recipes. This option can be used"
+                 u" multiple times",
             )),
         ]
 
     @classmethod
-    def execute(cls, distname, packages, hosts):
-        with Distribution(distname) as dist:
-            if hosts is None:
-                dist.setup(packages, dry_run=dry_run)
-            else:
-                from fabric.api import env
-                for host in (h.strip() for h in hosts.split(',')):
-                    env.host_string = host
-                    dist.setup(packages, dry_run=dry_run)
+    def execute(cls, distname, packages, hosts, inventory, groups, shard,
+            **options):
+        hosts = select_hosts(hosts, inventory, groups, shard)
+        apply_packages('setup', distname, packages, hosts,
+                select_distributions(hosts, inventory), shard=shard,
+                **options)
 
 
 @subcommand.define
@@ -195,15 +419,511 @@ class config(subcommand):
     args = setup.args
 
     @classmethod
-    def execute(cls, distname, packages, hosts):
-        with Distribution(distname) as dist:
+    def execute(cls, distname, packages, hosts, inventory, groups, shard,
+            **options):
+        hosts = select_hosts(hosts, inventory, groups, shard)
+        apply_packages('config', distname, packages, hosts,
+                select_distributions(hosts, inventory), shard=shard,
+                **options)
+
+
+@subcommand.define
+class merge(subcommand):
+    """combine the results files of `--results` into one report"""
+
+    args = [
+        (['paths'], dict(
+            metavar='PATH',
+            nargs='+',
+            help=u"results file written by `--results`",
+            )),
+        ]
+
+    @classmethod
+    def execute(cls, paths):
+        from alnair.runner import FAILED, format_report
+        from alnair.shard import merge
+        try:
+            results, stats, missing = merge(paths)
+        except IOError as exc:
+            fail(u"cannot read the results `%s`: %s" % (exc.filename,
+                exc.strerror))
+        except (ValueError, KeyError, TypeError):
+            fail(u"invalid results file, must be written by --results")
+        print_summary(format_report(results))
+        print_summary(stats.summary())
+        failed = [r.host for r in results if r.status == FAILED]
+        if missing:
+            fail(u"missing shard(s): %s" % ', '.join(missing))
+        if failed:
+            fail(u"%d host(s) failed: %s" % (len(failed), ', '.join(failed)))
+
+
+@subcommand.define
+class daemon(subcommand):
+    """serve setup and config requests from `alnair --daemon SOCKET` with
+    warm recipes and connections"""
+
+    args = [
+        (['socket'], dict(
+            metavar='SOCKET',
+            help=u"path of the Unix socket to listen",
+            )),
+        ]
+
+    @classmethod
+    def execute(cls, socket):
+        from alnair.daemon import serve
+        print u"listening on %s" % socket
+        try:
+            serve(socket)
+        except EnvironmentError as exc:
+            fail(unicode(exc))
+
+
+@subcommand.define
+class watch(subcommand):
+    """watch the recipe(s) and configure the changed configs of package(s)
+    whenever saved"""
+
+    args = [
+        (['distname'], dict(
+            metavar='DISTNAME',
+            help=u"name of the distribution (e.g. archlinux)",
+            )),
+        (['packages'], dict(
+            metavar='PACKAGE',
+            nargs='+',
+            help=u"name of package(s) to watch",
+            )),
+        ] + HOST_ARGS + [
+        (['--interval'], dict(
+            dest='interval',
+            metavar='SECONDS',
+            type=float,
+            default=1.0,
+            help=u"polling interval if inotify is not available"
+                 u" (default: %(default)s)",
+            )),
+        ]
+
+    @classmethod
+    def execute(cls, distname, packages, hosts, inventory, groups, shard,
+            interval):
+        from alnair.watch import Watch
+        hosts = select_hosts(hosts, inventory, groups, shard)
+        w = Watch(distname, packages, hosts, dry_run)
+        w.start()
+        print u"watching %s" % w.directory
+        try:
+            w.run(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+@subcommand.define
+class export(subcommand):
+    """render a shell script which applies package(s) on the host by
+    itself"""
+
+    args = [
+        (['distname'], dict(
+            metavar='DISTNAME',
+            help=u"name of the distribution (e.g. archlinux)",
+            )),
+        (['packages'], dict(
+            metavar='PACKAGE',
+            nargs='+',
+            help=u"name of package(s) to installation",
+            )),
+        (['--host'], dict(
+            dest='host',
+            metavar='HOST',
+            required=True,
+            help=u"server hostname which the script is rendered for",
+            )),
+        (['--user'], dict(
+            dest='user',
+            metavar='USER',
+            help=u"user to execute the commands which recipes run on the"
+                 u" user privileges by `run()`. Required if there are any,"
+                 u" since the script is run as root",
+            )),
+        (['-o', '--output'], dict(
+            dest='output',
+            metavar='FILE',
+            help=u"write the script to FILE instead of stdout",
+            )),
+        ]
+
+    @classmethod
+    def execute(cls, distname, packages, host, user, output):
+        from fabric.api import env
+        from alnair.export import plan, render
+        env.host_string = host
+        dist = Distribution(distname)
+        actions = plan(dist, dist.get_packages(packages), host, user)
+        script = render(actions, host, packages)
+        if output is None:
+            sys.stdout.write(script)
+            return
+        print u"creating file: %s" % output
+        if not dry_run:
+            with open(output, 'w') as f:
+                f.write(script)
+            os.chmod(output, 0o755)
+
+
+@subcommand.define
+class diff(subcommand):
+    """report the differences of config files and the missing packages on
+    the host(s) without changing anything"""
+
+    args = [
+        (['distname'], dict(
+            metavar='DISTNAME',
+            help=u"name of the distribution (e.g. archlinux)",
+            )),
+        (['packages'], dict(
+            metavar='PACKAGE',
+            nargs='+',
+            help=u"name of package(s) to compare",
+            )),
+        ] + HOST_ARGS + [
+        (['--batch-size'], dict(
+            dest='batch_size',
+            metavar='N|P%',
+            type=size_type,
+            default='100%',
+            help=u"compare N hosts (or P percent of hosts) in parallel at a"
+                 u" time (default: %(default)s)",
+            )),
+        ]
+
+    @classmethod
+    def execute(cls, distname, packages, hosts, inventory, groups, shard,
+            batch_size):
+        from alnair.diff import compare, format_diff
+        hosts = select_hosts(hosts, inventory, groups, shard)
+        dist = Distribution(distname)
+        pkgs = dist.get_packages(packages)
+        if hosts is None:
+            from fabric.api import env
+            print_summary(format_diff(env.host_string, compare(pkgs)))
+            return
+        from alnair.runner import FAILED, Runner, format_report
+        results = Runner(hosts, batch_size, '100%').run(
+                lambda host: compare(pkgs))
+        for result in results:
+            if result.value is not None:
+                print_summary(format_diff(result.host, result.value))
+        print_summary(format_report(results))
+        failed = [r.host for r in results if r.status == FAILED]
+        if failed:
+            fail(u"%d host(s) failed: %s" % (len(failed), ', '.join(failed)))
+
+
+def select_hosts(hosts, inventory=None, groups=None, shard=None):
+    if hosts is not None:
+        hosts = [h.strip() for h in hosts.split(',')]
+    if groups is not None:
+        groups = [g.strip() for g in groups.split(',')]
+    if inventory is None:
+        if groups is not None:
+            fail(u"--group requires --inventory")
+        if shard is not None:
             if hosts is None:
-                dist.config(packages, dry_run=dry_run)
-            else:
-                from fabric.api import env
-                for host in (h.strip() for h in hosts.split(',')):
-                    env.host_string = host
-                    dist.config(packages, dry_run=dry_run)
+                fail(u"--shard requires --host or --inventory")
+            return select_shard(hosts, shard)
+        return hosts
+    from alnair.exception import InventoryError
+    from alnair.inventory import Inventory
+    try:
+        inv = Inventory.load(inventory)
+        missing = [] if hosts is None else list(inv.missing(hosts))
+        selected = list(inv.select(hosts, groups))
+    except (IOError, InventoryError) as exc:
+        fail(unicode(exc))
+    if missing:
+        fail(u"no such host(s) in the inventory `%s`: %s" % (inventory,
+            ', '.join(missing)))
+    if not selected:
+        fail(u"no hosts matched in the inventory `%s`" % inventory)
+    if shard is not None:
+        return select_shard(selected, shard)
+    return selected
+
+
+def select_shard(hosts, shard):
+    from alnair.shard import parse, select
+    index, count = parse(shard)
+    selected = select(hosts, index, count)
+    print u"shard %s: %d of %d host(s)" % (shard, len(selected), len(hosts))
+    return selected
+
+
+def select_distributions(hosts, inventory=None):
+    if inventory is None or hosts is None:
+        return None
+    from alnair.inventory import Inventory
+    # the inventory has been loaded successfully by `select_hosts`
+    inv = Inventory.load(inventory)
+    result = {}
+    for host in hosts:
+        name = inv.vars(host).get('distribution')
+        if name:
+            result[host] = name
+    return result
+
+
+def configure(dist, compress=None, timeouts=None, facts_ttl=None,
+        load_jobs=None, journal=None, artifacts=None, artifact_ttl=None,
+        events=None, limits=None):
+    if journal is not None:
+        dist.journal = journal
+    if limits is not None:
+        dist.limits = limits
+    if events is not None:
+        dist.events = events
+    if artifacts is not None:
+        from alnair.artifact import DEFAULT_TTL, ArtifactCache
+        dist.artifacts = ArtifactCache(artifacts or None,
+                DEFAULT_TTL if artifact_ttl is None else artifact_ttl)
+    if load_jobs is not None:
+        dist.processes = load_jobs
+    if compress is not None:
+        dist.compress = compress
+    if facts_ttl is not None:
+        from alnair.facts import FactsCache
+        dist.facts_cache = FactsCache(ttl=facts_ttl)
+    if timeouts:
+        dist.timeouts = dict((k, v) for k, v in timeouts
+                if k in Distribution.TIMEOUTS)
+
+
+def open_journal(run_id=None):
+    from alnair.journal import Journal
+    try:
+        journal = Journal(run_id, resume=run_id is not None)
+    except IOError as exc:
+        fail(u"cannot resume the run `%s`: %s" % (run_id, exc.strerror))
+    print u"run id: %s" % journal.run_id
+    return journal
+
+
+def group_hosts(distname, hosts, distributions=None):
+    groups = {}
+    names = []
+    for host in hosts:
+        name = (distributions or {}).get(host, distname)
+        if name not in groups:
+            names.append(name)
+        groups.setdefault(name, []).append(host)
+    return [(name, groups[name]) for name in names]
+
+
+def open_events(target):
+    from alnair.events import EventStream
+    try:
+        return EventStream.open(target)
+    except (OSError, ValueError) as exc:
+        fail(u"cannot open the event stream `%s`: %s" % (target,
+            getattr(exc, 'strerror', None) or exc))
+
+
+def report_metrics(stats, started, hosts, failed_hosts, metrics_file=None,
+        statsd=None):
+    from alnair import metrics
+    run = metrics.run_metrics(started, hosts, failed_hosts)
+    if metrics_file is not None:
+        try:
+            metrics.write_textfile(metrics_file, metrics.prometheus(stats,
+                run))
+        except IOError as exc:
+            fail(u"cannot write the metrics to `%s`: %s" % (metrics_file,
+                exc.strerror))
+    if statsd is not None:
+        metrics.send_statsd(statsd, metrics.statsd(stats, run))
+
+
+def apply_packages(method, distname, packages, hosts, distributions=None,
+        events=None, **options):
+    if events is None:
+        return run_packages(method, distname, packages, hosts,
+                distributions, **options)
+    stream = options['events'] = open_events(events)
+    outcome = 'failed'
+    try:
+        run_packages(method, distname, packages, hosts, distributions,
+                **options)
+        outcome = 'dry_run' if dry_run else 'applied'
+    finally:
+        stream.emit(dict(operation='run', method=method, outcome=outcome))
+        stream.close()
+
+
+def run_packages(method, distname, packages, hosts, distributions=None,
+        batch_size=None, max_failures=None, resume=None, metrics_file=None,
+        statsd=None, shard=None, results_file=None, **options):
+    started = time.time()
+    if not dry_run:
+        options['journal'] = open_journal(resume)
+    if options.get('limits'):
+        from alnair.resource import Limits
+        # created before the processes of hosts are forked
+        options['limits'] = Limits(options['limits'])
+    timeouts = dict(options.get('timeouts') or [])
+    if timeouts and batch_size is None:
+        # isolate each host so that the timed out host does not stop others
+        batch_size = '1'
+        if max_failures is None:
+            max_failures = '100%'
+    if max_failures is not None and batch_size is None:
+        # count the failed hosts instead of stopping at the first one
+        batch_size = '1'
+    if hosts is None or batch_size is None:
+        # the whole run is for a single host if hosts is None
+        limits = sorted((v, k) for k, v in timeouts.iteritems()
+                if k in ('host', 'run'))
+        seconds, what = limits[0] if limits else (None, None)
+        dists = []
+        done = set()
+        current = None
+        completed = False
+        try:
+            with deadline(seconds, what):
+                if hosts is None:
+                    groups = [(distname, None)]
+                else:
+                    groups = group_hosts(distname, hosts, distributions)
+                for i, (name, group) in enumerate(groups):
+                    if i:
+                        # the system wide settings of the other distribution
+                        alnair.setup = alnair.Setup(alnair._Host())
+                    current = None if group is None else group[0]
+                    # after_setup runs when the distribution exits, so the
+                    # hosts are done only after that
+                    applied = []
+                    with Distribution(name) as dist:
+                        dists.append(dist)
+                        configure(dist, **options)
+                        if group is None:
+                            getattr(dist, method)(packages, dry_run=dry_run)
+                            applied.append(None)
+                        else:
+                            from fabric.api import env
+                            for host in group:
+                                current = env.host_string = host
+                                getattr(dist, method)(packages,
+                                        dry_run=dry_run)
+                                applied.append(host)
+                    done.update(applied)
+            completed = True
+        except DeadlineExceededError as exc:
+            fail(unicode(exc))
+        finally:
+            if metrics_file is not None or statsd is not None or \
+                    results_file is not None:
+                from alnair.stats import Stats
+                stats = Stats()
+                for dist in dists:
+                    stats.merge(dist.stats)
+                # the run stops at the first failed host
+                if metrics_file is not None or statsd is not None:
+                    report_metrics(stats, started, len(hosts or [None]),
+                            0 if completed else 1, metrics_file, statsd)
+                if results_file is not None:
+                    save_results(results_file, serial_results(hosts, done,
+                        None if completed else current), stats, shard)
+        if len(dists) == 1:
+            print_summary(dists[0].summary())
+        else:
+            from alnair.stats import Stats
+            stats = Stats()
+            for dist in dists:
+                stats.merge(dist.stats)
+            print_summary(stats.summary())
+        return
+
+    def apply(host):
+        # each host is applied in its own process, so the recipes of the
+        # other distributions are not mixed
+        try:
+            with Distribution((distributions or {}).get(host, distname)) as \
+                    dist:
+                configure(dist, **options)
+                getattr(dist, method)(packages, dry_run=dry_run)
+        finally:
+            if options.get('events') is not None:
+                # written by this process before exit
+                options['events'].flush()
+        return dist.stats
+
+    from alnair.runner import FAILED, Runner, format_report
+    from alnair.stats import Stats
+    runner = Runner(hosts, batch_size, max_failures, timeouts.get('host'),
+            timeouts.get('run'))
+    code_cache = Distribution.code_cache
+    if code_cache is None:
+        Distribution.code_cache = {}
+    try:
+        for name, _ in group_hosts(distname, hosts, distributions):
+            Distribution.compile_recipes(name, packages)
+        results = runner.run(apply)
+    finally:
+        Distribution.code_cache = code_cache
+    print_summary(format_report(results))
+    stats = Stats()
+    for result in results:
+        if result.value is not None:
+            stats.merge(result.value)
+    print_summary(stats.summary())
+    failed = [r.host for r in results if r.status == FAILED]
+    if metrics_file is not None or statsd is not None:
+        report_metrics(stats, started, len(hosts), len(failed), metrics_file,
+                statsd)
+    if results_file is not None:
+        save_results(results_file, results, stats, shard)
+    if failed:
+        fail(u"%d host(s) failed: %s" % (len(failed), ', '.join(failed)))
+
+
+def serial_results(hosts, done, stopped=None):
+    from alnair.runner import FAILED, OK, SKIPPED, HostResult
+    results = []
+    for host in hosts or [None]:
+        if host in done:
+            results.append(HostResult(host, OK))
+        elif host == stopped:
+            results.append(HostResult(host, FAILED,
+                error=u"the run stopped at this host"))
+        else:
+            results.append(HostResult(host, SKIPPED,
+                error=u"not applied since the run stopped"))
+    return results
+
+
+def save_results(path, results, stats, shard=None):
+    from alnair.shard import write_results
+    try:
+        write_results(path, results, stats, shard)
+    except (IOError, OSError) as exc:
+        fail(u"cannot write the results to `%s`: %s" % (path, exc.strerror))
+
+
+def request_daemon(path, command, args):
+    import socket
+    from alnair.daemon import COMMANDS, request
+    name = getattr(getattr(command, 'im_self', None), '__name__', None)
+    if name not in COMMANDS:
+        # nothing to be warm
+        return command(**args)
+    try:
+        code = request(path, name, args, dry_run)
+    except socket.error as exc:
+        fail(u"cannot request to the daemon on `%s`: %s" % (path, exc))
+    if code:
+        sys.exit(code)
 
 
 def main():
@@ -212,6 +932,9 @@ def main():
             version='%(prog)s ' + __version__)
     parser.add_argument('--dry-run', action='store_true',
             help=u"testing for running commands")
+    parser.add_argument('--daemon', metavar='SOCKET',
+            help=u"send setup and config commands to the daemon listening"
+                 u" on SOCKET. see also `alnair daemon`")
     subparsers = parser.add_subparsers(title=u"commands")
     for cls in (c for c in globals().values() if hasattr(c, '_subcommand') and
             issubclass(c, subcommand)):
@@ -219,5 +942,10 @@ def main():
     args = parser.parse_args().__dict__
     global dry_run
     dry_run = args.pop('dry_run')
+    daemon_socket = args.pop('daemon')
     command = args.pop('command')
-    command(**args)
+    if daemon_socket is not None:
+        request_daemon(daemon_socket, command, args)
+    else:
+        command(**args)
+
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import json
+import os
+import socket
+import sys
+import traceback
+
+from SocketServer import StreamRequestHandler, UnixStreamServer
+
+import alnair
+
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+# commands which can be requested to the daemon
+COMMANDS = ('setup', 'config')
+
+
+class _Stream(object):
+    def __init__(self, wfile, name):
+        """Constructor of _Stream class
+
+        Each write is sent to the client as a JSON line of `{name: data}`.
+
+        :param wfile: file object of the connection
+        :param name: 'stdout' or 'stderr'
+        """
+        self._wfile = wfile
+        self._name = name
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.decode('utf-8', 'replace')
+        send(self._wfile, {self._name: data})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def send(wfile, message):
+    wfile.write(json.dumps(message) + '\n')
+    wfile.flush()
+
+
+class Handler(StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            req = json.loads(line)
+            if req.get('command') not in COMMANDS:
+                raise ValueError(u"unknown command `%s`" % req.get('command'))
+        except ValueError as exc:
+            send(self.wfile, {'stderr': u"alnair: error: %s\n" % exc})
+            send(self.wfile, {'exit': 2})
+            return
+        send(self.wfile, {'exit': self.server.execute(req, self.wfile)})
+
+
+class Server(UnixStreamServer):
+    def __init__(self, path):
+        """Constructor of Server class
+
+        Recipes are compiled once and SSH connections are kept between
+        requests. Requests are processed one by one.
+
+        :param path: path of the Unix socket to listen
+        """
+        UnixStreamServer.__init__(self, path, Handler)
+        self.path = path
+
+    def server_bind(self):
+        # only the owner can connect, since a client can run the recipes of
+        # any directory with the SSH and sudo credentials of the daemon
+        umask = os.umask(0o077)
+        try:
+            UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def execute(self, req, wfile):
+        """Execute the requested command
+
+        :param req: dict of request. see also :func:`request`
+        :param wfile: file object to send the output
+        :returns: int of exit status
+        """
+        from alnair import command
+        from alnair.distribution import Distribution
+        args = dict((str(k), v) for k, v in req['args'].iteritems())
+        orig = (sys.stdout, sys.stderr, os.getcwd(), Distribution.CONFIG_DIR,
+                command.dry_run)
+        sys.stdout = _Stream(wfile, 'stdout')
+        sys.stderr = _Stream(wfile, 'stderr')
+        try:
+            os.chdir(req['cwd'])
+            Distribution.CONFIG_DIR = os.path.abspath('recipes')
+            command.dry_run = req.get('dry_run', False)
+            # recipes are executed again, so start from empty settings
+            alnair.setup = alnair.Setup(alnair._Host())
+            alnair.package.clear_contents()
+            prune_connections()
+            getattr(command, req['command']).execute(**args)
+            return 0
+        except SystemExit as exc:
+            if exc.code is None or isinstance(exc.code, int):
+                return exc.code or 0
+            sys.stderr.write('%s\n' % exc.code)
+            return 1
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            return 1
+        finally:
+            (sys.stdout, sys.stderr, cwd, Distribution.CONFIG_DIR,
+                    command.dry_run) = orig
+            os.chdir(cwd)
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def prune_connections():
+    """Remove the closed connections from the fabric's connection cache
+    """
+    from fabric.state import connections
+    for key, client in connections.items():
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            del connections[key]
+
+
+def serve(path):
+    """Serve the requests on the Unix socket until interrupted
+
+    :param path: path of the Unix socket
+    """
+    from alnair.distribution import Distribution
+    if os.path.exists(path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except socket.error:
+            # left by the daemon which has been killed
+            os.unlink(path)
+        else:
+            raise socket.error(u"daemon is already running on `%s`" % path)
+        finally:
+            sock.close()
+    Distribution.code_cache = {}
+    fa.env.abort_on_prompts = True
+    server = Server(path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        from fabric.network import disconnect_all
+        disconnect_all()
+
+
+def request(path, command, args, dry_run=False):
+    """Request the command to the daemon and print its output
+
+    :param path: path of the Unix socket
+    :param command: name of command, one of :data:`COMMANDS`
+    :param args: dict of arguments of the command
+    :param dry_run: testing for running commands if True
+    :returns: int of exit status
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        f = sock.makefile('rwb')
+        send(f, dict(command=command, args=args, dry_run=dry_run,
+            cwd=os.getcwd()))
+        for line in f:
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            for name in ('stdout', 'stderr'):
+                if name in message:
+                    stream = getattr(sys, name)
+                    stream.write(message[name].encode('utf-8'))
+                    stream.flush()
+    finally:
+        sock.close()
+    raise socket.error(u"connection closed by the daemon")
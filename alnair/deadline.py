@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import signal
+import threading
+import time
+
+from contextlib import contextmanager
+
+from alnair.exception import DeadlineExceededError
+
+
+@contextmanager
+def deadline(seconds, what=u"operation"):
+    """Limit the time of the operation within the context
+
+    :class:`alnair.exception.DeadlineExceededError` is raised in the context
+    when the time is up. The time is not limited if seconds is None or the
+    context is not in the main thread, because it is implemented by
+    SIGALRM.
+
+    :param seconds: number of seconds or None
+    :param what: string of the operation name for the error message
+    """
+    if seconds is None or \
+            threading.current_thread().name != 'MainThread':
+        yield
+        return
+
+    def handler(signum, frame):
+        raise DeadlineExceededError(u"%s timed out after %s seconds" % (what,
+            seconds))
+    remaining = signal.getitimer(signal.ITIMER_REAL)[0]
+    if remaining and remaining <= seconds:
+        # the outer deadline comes first
+        yield
+        return
+    orig_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    started = time.time()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, orig_handler)
+        if remaining:
+            # the outer deadline keeps running
+            signal.setitimer(signal.ITIMER_REAL, max(remaining -
+                (time.time() - started), 0.001))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import base64
+import difflib
+
+from pipes import quote
+
+import alnair
+
+from alnair import facts, transfer
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+# marks in the output of the read script. base64 never contains '['.
+FILE_MARK = '[file] '
+MISSING_MARK = '[missing]'
+
+
+def desired(packages, host):
+    """Get the desired state of the host
+
+    :param packages: list of instance of :class:`alnair.package.Package`
+    :param host: hostname
+    :returns: tuple of list of package names and dict of filename key and
+        string of bytes value
+    """
+    names = [name for pkg in packages for name in pkg.name]
+    files = {}
+    for setup in [alnair.setup] + [pkg.setup for pkg in packages]:
+        for (hostname, filename), config in setup.config_all.iteritems():
+            if hostname is None or hostname == host:
+                files[filename] = transfer.to_bytes(config._contents)
+    return names, files
+
+
+def script(files):
+    """Get a shell script to read files in base64
+
+    :param files: list of remote path of files
+    :returns: string of shell script
+    """
+    lines = ['set -e']
+    for path in files:
+        lines.append("echo %s" % quote(FILE_MARK + path))
+        lines.append("if [ -f %(path)s ]; then base64 < %(path)s;"
+                " else echo '%(missing)s'; fi" % dict(path=quote(path),
+                    missing=MISSING_MARK))
+    return '\n'.join(lines)
+
+
+def parse(output):
+    """Parse the output of the read script
+
+    :param output: string of output
+    :returns: dict of path key and string of contents value. The value is
+        None if the file is missing.
+    """
+    result = {}
+    path = None
+    chunks = []
+    for line in output.splitlines() + [FILE_MARK]:
+        line = line.rstrip('\r')
+        if line.startswith(FILE_MARK):
+            if path is not None:
+                result[path] = None if chunks is None else \
+                        base64.b64decode(''.join(chunks))
+            path = line[len(FILE_MARK):]
+            chunks = []
+        elif line == MISSING_MARK:
+            chunks = None
+        elif chunks is not None:
+            chunks.append(line.strip())
+    return result
+
+
+def read_files(files):
+    """Read the remote files of the current host in one round trip
+
+    :param files: list of remote path of files
+    :returns: dict of path key and string of contents value, see also
+        :func:`parse`
+    """
+    if not files:
+        return {}
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        output = fa.sudo(script(files))
+    if output.failed:
+        # not to report the unread files as missing
+        fa.abort(u"cannot read the config files of the host")
+    return parse(output)
+
+
+def unified_diff(path, current, contents):
+    """Get a unified diff from the remote file to the desired contents
+
+    :param path: path of the file
+    :param current: string of remote contents or None if missing
+    :param contents: string of desired contents
+    :returns: string of unified diff or None if not different
+    """
+    if current == contents:
+        return None
+    fromfile = '/dev/null' if current is None else '%s (remote)' % path
+    lines = difflib.unified_diff((current or '').splitlines(True),
+            contents.splitlines(True), fromfile, path)
+    result = []
+    for line in lines:
+        if not line.endswith('\n'):
+            line += '\n\\ No newline at end of file\n'
+        result.append(line)
+    return ''.join(result)
+
+
+def compare(packages):
+    """Compare the desired state with the current host
+
+    Nothing is changed on the host.
+
+    :param packages: list of instance of :class:`alnair.package.Package`
+    :returns: dict which has `packages` list of missing package names and
+        `files` dict of path key and string of unified diff value
+    """
+    names, files = desired(packages, fa.env.host_string)
+    installed = set(facts.gather()['packages'])
+    current = read_files(sorted(files))
+    diffs = {}
+    for path, contents in files.iteritems():
+        diff = unified_diff(path, current.get(path), contents)
+        if diff is not None:
+            diffs[path] = diff
+    return dict(packages=[name for name in names if name not in installed],
+            files=diffs)
+
+
+def format_diff(host, result):
+    """Get a report of the compared result of the host
+
+    :param host: hostname
+    :param result: dict of compared result, see also :func:`compare`
+    :returns: list of strings
+    """
+    lines = []
+    if result['packages']:
+        lines.append(u"[host:%s] missing package(s): %s" % (host,
+            ' '.join(result['packages'])))
+    for path in sorted(result['files']):
+        lines.append(u"[host:%s] differs: %s" % (host, path))
+        lines.append(result['files'][path].rstrip('\n'))
+    if not lines:
+        lines.append(u"[host:%s] up to date" % host)
+    return lines
@@ -30,38 +30,114 @@ __author__ = "Naoya Inada <naoina@kuune.org>"
 __all__ = [
 ]
 
+import hashlib
 import imp
 import os
+import sys
+import time
 
+from contextlib import contextmanager
 from io import StringIO
-
-import fabric.api as fa
+from pipes import quote
 
 import alnair
 
+from alnair import facts, guard, transfer
+from alnair.deadline import deadline
 from alnair.exception import (
     NoSuchDirectoryError,
     NoSuchFileError,
     UndefinedPackageError,
     )
-from alnair.package import Command, Package
+from alnair.lazy import LazyModule
+from alnair.package import Command, Package, guards_of
+from alnair.resource import RESOURCES
+from alnair.stats import Stats
+
+fa = LazyModule('fabric.api')
+
+
+def compile_source(cache, path):
+    """Compile the recipe file
+
+    :param cache: dict of path key and (mtime, size, code object) value
+    :param path: path of the recipe file
+    :returns: code object. The cached one is returned while the file is not
+        modified.
+    """
+    st = os.stat(path)
+    cached = cache.get(path)
+    if cached is None or cached[:2] != (st.st_mtime, st.st_size):
+        with open(path, 'rU') as f:
+            code = compile(f.read() + '\n', path, 'exec')
+        cache[path] = cached = (st.st_mtime, st.st_size, code)
+    return cached[2]
 
 
 class Distribution(object):
     CONFIG_DIR = os.path.abspath('recipes')
 
-    def __init__(self, name, install_command=None, dry_run=False):
+    # operations which can be limited the time by `timeouts`
+    TIMEOUTS = ('connect', 'install', 'put', 'command')
+
+    # dict of path key and (mtime, size, code object) value to reuse the
+    # compiled recipes, or None to load recipes by `imp.load_source` each
+    # time. see also :mod:`alnair.daemon`
+    code_cache = None
+
+    def __init__(self, name, install_command=None, dry_run=False,
+            compress=None, timeouts=None, facts_cache=None, processes=None,
+            journal=None, artifacts=None, events=None, limits=None):
         """Constructor of Distribution class
 
         :param name: distribution name (e.g. 'archlinux')
         :param install_command: install command (e.g. 'pacman -S')
         :param dry_run: testing for setup process if True
+        :param compress: minimum size in bytes of config contents to
+            compress the upload stream. If None, never compressed.
+        :param timeouts: dict of operation name key and seconds value.
+            see also :data:`TIMEOUTS`
+        :param facts_cache: instance of :class:`alnair.facts.FactsCache` to
+            skip the installed packages and the unchanged config files. If
+            None, those are always installed and put.
+        :param processes: number of worker processes to evaluate the recipes
+            in parallel. If None, recipes are evaluated in this process.
+            see also :func:`alnair.loader.load_packages`
+        :param journal: instance of :class:`alnair.journal.Journal` to record
+            the completed steps and skip the steps completed in the resumed
+            run. If None, not recorded.
+        :param artifacts: instance of :class:`alnair.artifact.ArtifactCache`
+            to install the package files given from the controller. If None,
+            each host downloads those by `install_command`.
+        :param events: instance of :class:`alnair.events.EventStream` to
+            emit an event for each step. If None, not emitted.
+        :param limits: instance of :class:`alnair.resource.Limits` to limit
+            the number of hosts which operate on each resource at once. If
+            None, not limited.
         """
         self.name = name
         self.install_command = install_command
         self._within_context = False
         self._packages = []
         self.dry_run = dry_run
+        self.compress = compress
+        self.stats = Stats()
+        self._codecs = {}
+        self._shared = set()
+        self._staging = {}
+        self._guards = {}
+        self._notified = {}
+        self._checksums = {}
+        self._phase = None
+        self.timeouts = dict(timeouts or {})
+        self.facts_cache = facts_cache
+        self.processes = processes
+        self.journal = journal
+        self.artifacts = artifacts
+        self.events = events
+        self.limits = limits
+        self._event = None
+        self._package = None
 
     def setup(self, pkgs, *args, **kwargs):
         """Setup packages to a remote server
@@ -81,17 +157,39 @@ class Distribution(object):
         :param install_command: string of the one time installation command
         :param dry_run: testing for setup process if True
         """
-        packages = self.get_packages(pkgs, *args)
-        self._packages.extend(packages)
-        install_command = self.get_install_command(
-                kwargs.get('install_command'))
-        pkgs = ' '.join(name for pkg in packages for name in pkg.name)
-        command = '%s %s' % (install_command, pkgs)
-        self.dry_run = kwargs.get('dry_run', False)
-        if self.dry_run:
-            self._dryrun_print('running command: %s' % command)
-        else:
-            fa.sudo(command)
+        with self.timer('host'):
+            with self.timer('load'):
+                packages = self.get_packages(pkgs, *args)
+            self._packages.extend(packages)
+            install_command = self.get_install_command(
+                    kwargs.get('install_command'))
+            names = [name for pkg in packages for name in pkg.name]
+            step = 'install:%s' % ' '.join(names)
+            self.dry_run = kwargs.get('dry_run', False)
+            facts = self.get_facts(packages)
+            if facts is not None:
+                installed = set(facts['packages'])
+                self.count('installed_packages', sum(1 for name in names
+                    if name in installed))
+                names = [name for name in names if name not in installed]
+            command = '%s %s' % (install_command, ' '.join(names))
+            with self.event('install', packages=names):
+                if self.dry_run:
+                    self._dryrun_print('running command: %s' % command)
+                elif names:
+                    with self.journaled(step) as pending:
+                        if pending:
+                            with self.limit('install'):
+                                if self.artifacts is None:
+                                    fa.sudo(command)
+                                else:
+                                    self.install_artifacts(names)
+                            self.count('packages', len(names))
+                    if facts is not None:
+                        self.facts_cache.update(packages=names)
+                else:
+                    # all installed already
+                    self.annotate(outcome='skipped')
         if not self._within_context:
             self.after_setup()
 
@@ -106,45 +204,482 @@ class Distribution(object):
         :param kwargs: other options, see following
         :param dry_run: testing for setup process if True
         """
-        self.dry_run = kwargs.get('dry_run', False)
-        packages = self.get_packages(pkgs, *args)
-        self._exec_configs(alnair.setup)
-        for pkg in packages:
-            self._exec_configs(pkg.setup)
+        with self.timer('host'):
+            self.dry_run = kwargs.get('dry_run', False)
+            with self.timer('load'):
+                packages = self.get_packages(pkgs, *args)
+            self.get_facts(packages)
+            setups = [alnair.setup] + [pkg.setup for pkg in packages]
+            self.find_shared(setups)
+            self.clear_guards()
+            self.evaluate_guards(setups)
+            self.compare_configs(setups)
+            try:
+                for pkg, setup in zip([None] + packages, setups):
+                    self._package = pkg
+                    self._exec_configs(setup)
+            finally:
+                self._package = None
+                self.clear_staging()
+            self.run_handlers(setups)
 
     def _exec_configs(self, setup):
         for (hostname, filename), config in setup.config_all.iteritems():
             if hostname is not None and fa.env.host_string != hostname:
                 continue
-            sio = StringIO(config._contents.decode('utf-8'))
-            if self.dry_run:
-                self._dryrun_print('putting file: %s' % filename)
+            with self.event('put', filename=filename):
+                if self.dry_run:
+                    self._dryrun_print('putting file: %s' % filename)
+                    changed = True
+                else:
+                    changed = self.put_config(config)
+            if changed:
+                # reload or validate only when the file has changed
+                self.notify(config)
+                self.exec_commands(config)
+
+    def put_config(self, config):
+        """Put the contents of config on to a remote server
+
+        :param config: instance of :class:`alnair.package.Config`
+        :returns: True if the file has been put, False if it is up to date.
+            A put completed in the resumed run is also True, so that the
+            commands of config which have not completed yet are executed.
+        """
+        data = transfer.to_bytes(config._contents)
+        checksum = hashlib.md5(data).hexdigest()
+        key = 'put:%s:%s' % (config._filename, checksum)
+        with self.journaled(key) as pending:
+            if not pending:
+                return True
+            return self._put_config(config, data, checksum)
+
+    def _put_config(self, config, data, checksum):
+        if self.facts_cache is not None:
+            remote = self.facts_cache.get([config._filename])['files']
+        else:
+            remote = self._checksums.get(fa.env.host_string, {})
+        if remote.get(config._filename) == checksum:
+            self.count('unchanged')
+            self.annotate(outcome='unchanged')
+            return False
+        changed = True
+        with self.limit('put'):
+            codec = self.get_codec(len(data))
+            if checksum in self._shared and not config._delta:
+                sent = self.put_staged(data, checksum, config._filename,
+                        codec)
+            elif config._delta:
+                block_size = None if config._delta is True else config._delta
+                sent, changed = transfer.put_delta(data, config._filename,
+                        block_size, codec)
+            elif codec:
+                sent = transfer.put(data, config._filename, codec)
             else:
-                fa.put(sio, filename, use_sudo=True)
-            self.exec_commands(config)
+                sio = StringIO(config._contents.decode('utf-8'))
+                fa.put(sio, config._filename, use_sudo=True)
+                sent = len(data)
+        if self.facts_cache is not None:
+            self.facts_cache.update(files={config._filename: checksum})
+        elif config._filename in remote:
+            remote[config._filename] = checksum
+        self.annotate(bytes=sent)
+        if not changed:
+            # the remote file is up to date
+            self.count('unchanged')
+            self.annotate(outcome='unchanged')
+            return False
+        self.count('uploads')
+        self.count('upload_bytes', len(data))
+        self.count('sent_bytes', sent)
+        return True
+
+    def find_shared(self, setups):
+        """Find the contents which are put to more than one file of the
+        current host
+
+        Those are uploaded once to the staging directory on the host, see
+        also :meth:`put_staged`.
+
+        :param setups: list of instance of :class:`alnair.package.Setup`
+        """
+        paths = {}
+        for setup in setups:
+            for (hostname, filename), config in setup.config_all.iteritems():
+                if config._delta or (hostname is not None and
+                        hostname != fa.env.host_string):
+                    continue
+                checksum = hashlib.md5(transfer.to_bytes(
+                    config._contents)).hexdigest()
+                paths.setdefault(checksum, set()).add(filename)
+        self._shared = set(checksum for checksum, filenames
+                in paths.iteritems() if len(filenames) > 1)
+
+    def put_staged(self, data, checksum, path, codec=None):
+        """Put the data to the remote path by copying on the host
+
+        The data is uploaded to the staging directory at the first time for
+        each host.
+
+        :param data: string of bytes
+        :param checksum: md5 hex digest of data
+        :param path: remote path of the file
+        :param codec: codec name to compress the upload stream or None
+        :returns: number of bytes sent
+        """
+        host = fa.env.host_string
+        if host not in self._staging:
+            self._staging[host] = (transfer.remote_staging_dir(), set())
+        directory, staged = self._staging[host]
+        source = '%s/%s' % (directory, checksum)
+        sent = 0
+        if checksum not in staged:
+            sent = transfer.upload(data, source, codec)
+            staged.add(checksum)
+        transfer.copy(source, path)
+        return sent
+
+    def clear_staging(self):
+        """Remove the staging directory of the current host
+        """
+        self._shared = set()
+        staging = self._staging.pop(fa.env.host_string, None)
+        if staging is not None:
+            with fa.settings(fa.hide('everything'), warn_only=True):
+                fa.sudo('rm -rf -- %s' % staging[0])
+
+    def get_facts(self, packages=()):
+        """Get the facts of the current host
+
+        The config files of packages for the current host are hashed in the
+        same round trip.
+
+        :param packages: list of instance of :class:`alnair.package.Package`
+        :returns: dict of facts or None if facts are not used or in dry-run.
+            see also :func:`alnair.facts.parse`
+        """
+        if self.facts_cache is None or self.dry_run:
+            return None
+        files = set()
+        for setup in [alnair.setup] + [pkg.setup for pkg in packages]:
+            for hostname, filename in setup.config_all:
+                if hostname is None or hostname == fa.env.host_string:
+                    files.add(filename)
+        with self.limit('command'):
+            return self.facts_cache.get(sorted(files))
+
+    def get_codec(self, size):
+        """Get a codec to compress the upload stream
+
+        :param size: size of the contents in bytes
+        :returns: codec name or None if the contents should not be compressed
+        """
+        if self.compress is None or size < self.compress:
+            return None
+        host = fa.env.host_string
+        if host not in self._codecs:
+            self._codecs[host] = transfer.remote_codec()
+        return self._codecs[host]
+
+    def summary(self):
+        """Get a summary of the run
+
+        :returns: list of strings
+        """
+        return self.stats.summary()
 
     def after_setup(self):
-        self._exec_configs(alnair.setup)
-        for pkg in self._packages:
-            setup = pkg.setup
-            self.exec_commands(setup)
-            self._exec_configs(setup)
-            if setup.after:
-                self.exec_commands(self.get_after_command(setup.after))
-        if alnair.setup.after:
-            self.exec_commands(self.get_after_command(alnair.setup.after))
+        with self.timer('host'):
+            setups = [alnair.setup] + [pkg.setup for pkg in self._packages]
+            self.find_shared(setups)
+            self.clear_guards()
+            self.evaluate_guards(setups)
+            self.compare_configs(setups)
+            try:
+                self._exec_configs(alnair.setup)
+                for pkg in self._packages:
+                    self._package = pkg
+                    setup = pkg.setup
+                    if self.exec_commands(setup):
+                        self.notify(setup)
+                    self._exec_configs(setup)
+                    if setup.after:
+                        with self.phase('after'):
+                            after = self.get_after_command(setup.after)
+                            if self.exec_commands(after):
+                                self.notify(after)
+            finally:
+                self._package = None
+                self.clear_staging()
+            if alnair.setup.after:
+                with self.phase('after'):
+                    after = self.get_after_command(alnair.setup.after)
+                    if self.exec_commands(after):
+                        self.notify(after)
+            self.run_handlers(setups)
 
     def exec_commands(self, obj):
         """Execute the commands actually
 
         :param obj: instance of :class:`alnair.package.Command` or that
             inherited it
+        :returns: True if any command has been executed
         """
-        for cmd, func in obj._commands:
-            if self.dry_run:
-                self._dryrun_print('running command: %s' % cmd)
-            else:
-                func(cmd)
+        executed = False
+        self.evaluate_guards([], [obj])
+        for command in obj._commands:
+            cmd, func = command
+            with self.event('command', command=cmd):
+                if self.dry_run:
+                    self._dryrun_print('running command: %s' % cmd)
+                    executed = True
+                    continue
+                if self.guarded(guards_of(command)):
+                    self.count('guarded_commands')
+                    self.annotate(outcome='guarded')
+                    continue
+                with self.journaled('command:%s' % cmd) as pending:
+                    if pending:
+                        with self.limit('command', obj._resource):
+                            func(cmd)
+                        self.count('commands')
+                        executed = True
+        return executed
+
+    def notify(self, obj):
+        """Notify the handlers which obj notifies for the current host
+
+        :param obj: instance of :class:`alnair.package.Command`
+        """
+        if not obj._notify:
+            return
+        notified = self._notified.setdefault(fa.env.host_string, [])
+        for name in obj._notify:
+            if name not in notified:
+                notified.append(name)
+
+    def run_handlers(self, setups):
+        """Execute the notified handlers once for the current host
+
+        :param setups: list of instance of :class:`alnair.package.Setup`
+            which define the handlers
+        """
+        notified = self._notified.pop(fa.env.host_string, None)
+        if not notified:
+            return
+        handlers = {}
+        for setup in setups:
+            for name, handler in setup._handlers.iteritems():
+                handlers.setdefault(name, handler)
+        for name in notified:
+            if name not in handlers:
+                fa.abort(u"no such handler `%s`" % name)
+            self.exec_commands(handlers[name])
+
+    def evaluate_guards(self, setups, objs=()):
+        """Evaluate the guards of commands for the current host at once
+
+        The results are reused by :meth:`guarded` , so the guards are
+        evaluated before the commands are executed.
+
+        :param setups: list of instance of :class:`alnair.package.Setup` .
+            the guards of those and their configs for the current host are
+            evaluated.
+        :param objs: list of instance of :class:`alnair.package.Command`
+        """
+        if self.dry_run:
+            return
+        host = fa.env.host_string
+        objs = list(objs)
+        for setup in setups:
+            objs.append(setup)
+            for (hostname, _), config in setup.config_all.iteritems():
+                if hostname is None or hostname == host:
+                    objs.append(config)
+        results = self._guards.setdefault(host, {})
+        pending = []
+        for obj in objs:
+            for command in obj._commands:
+                for g in guards_of(command):
+                    if g not in results and g not in pending:
+                        pending.append(g)
+        if pending:
+            with self.limit('command'):
+                results.update(guard.evaluate(pending))
+
+    def clear_guards(self):
+        """Forget the results of guards of the current host
+
+        The guards are evaluated again on the next pass, since the commands
+        executed since may have changed those.
+        """
+        self._guards.pop(fa.env.host_string, None)
+
+    def compare_configs(self, setups):
+        """Hash the remote files of configs for the current host at once
+
+        Only the files of configs which have commands or notify handlers are
+        hashed, so that those are not put and their commands are not
+        executed if unchanged. The facts have the hashes already if
+        `facts_cache` is given.
+
+        :param setups: list of instance of :class:`alnair.package.Setup`
+        """
+        if self.dry_run or self.facts_cache is not None:
+            return
+        host = fa.env.host_string
+        files = []
+        for setup in setups:
+            for (hostname, filename), config in setup.config_all.iteritems():
+                if hostname is not None and hostname != host:
+                    continue
+                if config._commands or config._notify:
+                    files.append(filename)
+        if files:
+            with self.limit('put'):
+                self._checksums[host] = facts.checksums(files)
+        else:
+            self._checksums.pop(host, None)
+
+    def guarded(self, guards):
+        """Whether any of the guards says the work is already done
+
+        :param guards: tuple of guards, see also :func:`alnair.guard.make`
+        :returns: True if the command should be skipped
+        """
+        if not guards:
+            return False
+        results = self._guards.get(fa.env.host_string, {})
+        return any(results.get(g) for g in guards)
+
+    @contextmanager
+    def journaled(self, name):
+        """Record the step of the current host in the journal
+
+        The step is recorded as completed when the context exits without
+        an error.
+
+        :param name: string of step (e.g. 'command:service nginx reload')
+        :returns: context manager which yields False if the step has been
+            completed in the resumed run, otherwise True
+        """
+        journal = self.journal
+        if journal is None:
+            yield True
+            return
+        host = fa.env.host_string
+        key = journal.step(host, name)
+        if journal.completed(host, key):
+            self.count('completed_steps')
+            self.annotate(outcome='completed')
+            yield False
+            return
+        yield True
+        journal.record(host, key)
+
+    @contextmanager
+    def limit(self, operation, resource=None):
+        """Limit the time of the operation within the context
+
+        The operation is counted as a round trip, and its time is added to
+        the phase of the operation or to the current phase, see also
+        :meth:`phase`. It waits for the resource first, see also
+        :meth:`acquire`.
+
+        :param operation: name of operation, see also :data:`TIMEOUTS`
+        :param resource: resource name. If None, the resource of the
+            operation, see also :data:`alnair.resource.RESOURCES`
+        """
+        connect = self.timeouts.get('connect')
+        self.count('round_trips')
+        with self.acquire(resource or RESOURCES[operation]):
+            with self.timer(self._phase or operation):
+                with deadline(self.timeouts.get(operation), operation):
+                    if connect is None:
+                        yield
+                    else:
+                        with fa.settings(timeout=connect):
+                            yield
+
+    @contextmanager
+    def acquire(self, resource):
+        """Hold the resource within the context
+
+        The time waiting for the resource is added to `wait_seconds`.
+
+        :param resource: resource name (e.g. 'install')
+        """
+        if self.limits is None or resource not in self.limits:
+            yield
+            return
+        start = time.time()
+        with self.limits.acquire(resource):
+            self.count('wait_seconds', time.time() - start)
+            yield
+
+    @contextmanager
+    def event(self, operation, **fields):
+        """Emit an event of the step of the current host after the context
+
+        The outcome of the step is `applied` unless changed by
+        :meth:`annotate` within the context, `dry_run` in dry-run or
+        `failed` if an error is raised.
+
+        :param operation: name of operation (e.g. 'put')
+        :param fields: other fields of the event (e.g. filename)
+        """
+        if self.events is None:
+            yield
+            return
+        fields.update(operation=operation, host=fa.env.host_string,
+                package=self._package and ' '.join(self._package.name),
+                outcome='dry_run' if self.dry_run else 'applied')
+        event, self._event = self._event, fields
+        start = time.time()
+        try:
+            yield
+        except BaseException:
+            fields['outcome'] = 'failed'
+            raise
+        finally:
+            self._event = event
+            fields['seconds'] = time.time() - start
+            self.events.emit(fields)
+
+    def annotate(self, **fields):
+        """Update the fields of the current event
+
+        :param fields: fields of the event (e.g. outcome='unchanged')
+        """
+        if self._event is not None:
+            self._event.update(fields)
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time of operations within the context to the phase
+
+        :param name: name of phase (e.g. 'after')
+        """
+        phase, self._phase = self._phase, name
+        try:
+            yield
+        finally:
+            self._phase = phase
+
+    def count(self, name, value=1):
+        """Add the value to the counter of stats for the current host
+
+        :param name: name of counter
+        :param value: value to add
+        """
+        self.stats.add(name, value, fa.env.host_string)
+
+    def timer(self, name):
+        """Add the time within the context to stats for the current host
+
+        :param name: name of phase
+        """
+        return self.stats.timer(name, fa.env.host_string)
 
     def get_after_command(self, after):
         """Get an command of after an setup
@@ -170,14 +705,49 @@ class Distribution(object):
         """
         install_command = default_install_command or self.install_command
         if not install_command:
-            common_module = imp.load_source('common',
-                    os.path.join(self.CONFIG_DIR, self.name, 'common.py'))
-            try:
-                install_command = getattr(common_module, 'install_command')
-            except AttributeError:
-                fa.abort(u"`install_command` is not provided")
+            install_command = self.get_common('install_command')
         return install_command
 
+    def get_common(self, name):
+        """Get a variable of common.py of the distribution
+
+        :param name: name of variable (e.g. 'install_command')
+        :returns: value of variable
+        """
+        common_module = self.load_source('common',
+                os.path.join(self.CONFIG_DIR, self.name, 'common.py'))
+        try:
+            return getattr(common_module, name)
+        except AttributeError:
+            fa.abort(u"`%s` is not provided" % name)
+
+    def install_artifacts(self, names):
+        """Install the package files from the artifact cache
+
+        The files are downloaded by `download_command` of common.py on the
+        first host which needs those, then uploaded to the current host from
+        the controller and installed by `local_install_command` (e.g.
+        'dpkg -i').
+
+        :param names: list of package names
+        """
+        download_command = self.get_common('download_command')
+        local_install_command = self.get_common('local_install_command')
+        paths = self.artifacts.fetch(self.name, names, download_command)
+        staging = transfer.remote_staging_dir()
+        try:
+            remote_paths = []
+            for path in paths:
+                remote_path = '%s/%s' % (staging, os.path.basename(path))
+                fa.put(path, remote_path, use_sudo=True)
+                self.count('artifacts')
+                self.count('artifact_bytes', os.path.getsize(path))
+                remote_paths.append(quote(remote_path))
+            fa.sudo('%s %s' % (local_install_command, ' '.join(remote_paths)))
+        finally:
+            with fa.settings(fa.hide('everything'), warn_only=True):
+                fa.sudo('rm -rf -- %s' % staging)
+
     def get_packages(self, packages, *args):
         """Get a packages
 
@@ -197,11 +767,20 @@ class Distribution(object):
             args.extend(packages)
         else:
             args.append(packages)
+        loaded = {}
+        names = []
+        for pkg in args:
+            if isinstance(pkg, basestring) and pkg not in names:
+                names.append(pkg)
+        if self.processes is not None and len(names) > 1:
+            from alnair.loader import load_packages
+            loaded = dict(zip(names, load_packages(self, names,
+                self.processes)))
         result = []
         for pkg in args:
             if isinstance(pkg, basestring):
                 try:
-                    result.append(self.get_package(pkg))
+                    result.append(loaded.get(pkg) or self.get_package(pkg))
                 except (NoSuchDirectoryError, NoSuchFileError,
                         UndefinedPackageError, TypeError) as exc:
                     fa.abort(exc.message)
@@ -226,7 +805,7 @@ class Distribution(object):
         if not os.path.isfile(configfile):
             raise NoSuchFileError(u"no such configuration file `%s`" %
                     configfile)
-        module = imp.load_source(pkg, configfile)
+        module = self.load_source(pkg, configfile)
         try:
             pkginst = getattr(module, pkg)
         except AttributeError:
@@ -237,6 +816,45 @@ class Distribution(object):
                     u"but %s" % (pkg, type(pkg)))
         return pkginst
 
+    def load_source(self, name, path):
+        """Load the recipe module from file
+
+        The recipe is executed in a new module every time, but its compiled
+        code is reused while the file is not modified if
+        :data:`code_cache` is enabled.
+
+        :param name: name of module
+        :param path: path of the recipe file
+        :returns: module object
+        """
+        if self.code_cache is None:
+            return imp.load_source(name, path)
+        code = compile_source(self.code_cache, path)
+        module = imp.new_module(name)
+        module.__file__ = path
+        sys.modules[name] = module
+        exec code in module.__dict__
+        return module
+
+    @classmethod
+    def compile_recipes(cls, distname, names):
+        """Compile the recipes of packages ahead into :data:`code_cache`
+
+        e.g. before forking processes for hosts, so that each recipe is
+        compiled once. The recipes which are missing or have a syntax error
+        are skipped, those are reported when loaded.
+
+        :param distname: distribution name (e.g. 'archlinux')
+        :param names: list of package name
+        """
+        directory = os.path.join(cls.CONFIG_DIR, distname)
+        for name in ['common'] + list(names):
+            try:
+                compile_source(cls.code_cache, os.path.join(directory,
+                    '%s.py' % name))
+            except (EnvironmentError, SyntaxError):
+                pass
+
     def __enter__(self):
         self._within_context = True
         return self
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import json
+import os
+import select
+import threading
+import time
+
+from Queue import Queue
+
+# prefix of the target to write the events to a file descriptor
+FD_PREFIX = 'fd:'
+
+# maximum size of a line, which is written to a pipe at once without being
+# interleaved with the lines of the other processes
+MAX_LINE_SIZE = getattr(select, 'PIPE_BUF', 512)
+
+
+def encode(event):
+    """Encode the event as a line of JSON object
+
+    The longest string fields are shortened if the line is longer than
+    :data:`MAX_LINE_SIZE`.
+
+    :param event: dict of the fields of the event
+    :returns: string of line
+    """
+    line = json.dumps(event, separators=(',', ':')) + '\n'
+    while len(line) > MAX_LINE_SIZE:
+        strings = [(len(v), k) for k, v in event.iteritems()
+                if isinstance(v, basestring) and len(v) > 3]
+        if not strings:
+            break
+        size, key = max(strings)
+        excess = len(line) - MAX_LINE_SIZE
+        event = dict(event)
+        event[key] = event[key][:max(0, size - excess - 3)] + '...'
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+    return line
+
+
+class EventStream(object):
+    def __init__(self, fd):
+        """Constructor of EventStream class
+
+        Each event is written as one JSON object per line by a writer
+        thread of each process, so that a slow reader does not block the
+        run. What the reader has not taken yet is kept in memory until
+        written, see also :meth:`flush`. The flags of the file descriptor
+        are not changed, since it may be shared (e.g. stdout).
+
+        :param fd: file descriptor to write the events to
+        """
+        self.fd = fd
+        self._pid = None
+        self._queue = None
+
+    @classmethod
+    def open(cls, target):
+        """Open the event stream
+
+        :param target: path of the file to append the events to, or
+            'fd:N' to write to the file descriptor N (e.g. a pipe to the
+            consumer)
+        :returns: instance of :class:`EventStream`
+        """
+        if target.startswith(FD_PREFIX):
+            return cls(int(target[len(FD_PREFIX):]))
+        return cls(os.open(target, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644))
+
+    def emit(self, event):
+        """Write the event
+
+        :param event: dict of the fields of the event. `time` is added.
+        """
+        self._writer().put(encode(dict(event, time=time.time())))
+
+    def _writer(self):
+        if self._pid != os.getpid():
+            # the thread of the parent does not run in the forked process
+            self._pid = os.getpid()
+            self._queue = Queue()
+            thread = threading.Thread(target=self._write, args=(self._queue,))
+            thread.daemon = True
+            thread.start()
+        return self._queue
+
+    def _write(self, queue):
+        while True:
+            line = queue.get()
+            try:
+                while line:
+                    line = line[os.write(self.fd, line):]
+            finally:
+                queue.task_done()
+
+    def flush(self):
+        """Wait until all the pending events of this process are written
+        """
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """Flush and close the event stream
+        """
+        self.flush()
+        os.close(self.fd)
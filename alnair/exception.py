@@ -38,3 +38,11 @@ class NoSuchFileError(Exception):
 
 class UndefinedPackageError(Exception):
     pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class InventoryError(Exception):
+    pass
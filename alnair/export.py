@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import base64
+import time
+
+from pipes import quote
+
+import alnair
+
+from alnair import guard, transfer
+from alnair.lazy import LazyModule
+from alnair.package import guards_of
+
+fa = LazyModule('fabric.api')
+
+SCRIPT_HEADER = """\
+#!/bin/sh
+# generated by alnair %(version)s for %(host)s at %(date)s
+# run as root on the host to apply: %(packages)s
+set -e
+
+put_file() {
+    base64 -d > "$1"
+}
+
+run_as() {
+    if [ "$(id -un)" = "$1" ]; then
+        sh -c "$2"
+    else
+        su -s /bin/sh -c "$2" "$1"
+    fi
+}
+"""
+
+# line which terminates the embedded contents. base64 never contains it.
+END_OF_FILE = 'ALNAIR_EOF'
+
+
+def plan(dist, packages, host, user=None):
+    """Get the actions to apply packages to the host
+
+    The actions are in the same order as :meth:`Distribution.setup` and
+    :meth:`Distribution.after_setup`. Since the script puts all the configs,
+    every notified handler is executed at the end.
+
+    :param dist: instance of :class:`alnair.distribution.Distribution`
+    :param packages: list of instance of :class:`alnair.package.Package`
+    :param host: hostname
+    :param user: user to run the commands which are set by
+        :meth:`Command.run`. The script is run as root, so those cannot be
+        exported if None.
+    :returns: list of ('command', command string, function name) or ('put',
+        filename, string of bytes)
+    """
+    actions = []
+    notified = []
+
+    def notify(obj):
+        for name in obj._notify:
+            if name not in notified:
+                notified.append(name)
+
+    def add_commands(obj):
+        # the guards are evaluated by the script itself
+        for command in obj._commands:
+            cmd, func = command
+            if func.__name__ == 'run':
+                if user is None:
+                    fa.abort(u"`%s` runs on the user privileges, the user"
+                            u" must be given" % cmd)
+                cmd = 'run_as %s %s' % (quote(user), quote(cmd))
+            actions.append(('command', guard.shell_command(cmd,
+                guards_of(command)), func.__name__))
+
+    def commands(obj):
+        if obj._commands:
+            notify(obj)
+        add_commands(obj)
+
+    def configs(setup):
+        for (hostname, filename), config in sorted(
+                setup.config_all.iteritems(),
+                key=lambda item: (item[0][0] or '', item[0][1])):
+            if hostname is not None and hostname != host:
+                continue
+            actions.append(('put', filename,
+                transfer.to_bytes(config._contents)))
+            notify(config)
+            add_commands(config)
+    names = [name for pkg in packages for name in pkg.name]
+    actions.append(('command', '%s %s' % (dist.get_install_command(),
+        ' '.join(names)), 'sudo'))
+    configs(alnair.setup)
+    for pkg in packages:
+        commands(pkg.setup)
+        configs(pkg.setup)
+        if pkg.setup.after:
+            commands(dist.get_after_command(pkg.setup.after))
+    if alnair.setup.after:
+        commands(dist.get_after_command(alnair.setup.after))
+    handlers = {}
+    for setup in [alnair.setup] + [pkg.setup for pkg in packages]:
+        for name, handler in setup._handlers.iteritems():
+            handlers.setdefault(name, handler)
+    for name in notified:
+        if name not in handlers:
+            fa.abort(u"no such handler `%s`" % name)
+        add_commands(handlers[name])
+    return actions
+
+
+def render(actions, host, packages):
+    """Render the actions as a standalone shell script
+
+    :param actions: list of actions, see also :func:`plan`
+    :param host: hostname
+    :param packages: list of package name
+    :returns: string of shell script
+    """
+    lines = [SCRIPT_HEADER % dict(version=alnair.__version__, host=host,
+        date=time.strftime('%Y-%m-%d %H:%M:%S'),
+        packages=' '.join(packages))]
+    for action, target, value in actions:
+        if action == 'put':
+            lines.append('put_file %s <<\'%s\'' % (quote(target),
+                END_OF_FILE))
+            lines.append(base64.encodestring(value).rstrip('\n'))
+            lines.append(END_OF_FILE)
+        else:
+            lines.append(target)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import json
+import os
+import time
+import urllib
+
+from pipes import quote
+
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'alnair', 'facts')
+
+# seconds to reuse the cached facts
+DEFAULT_TTL = 600
+
+# instance of :class:`FactsCache` for :func:`get`
+_cache = None
+
+# prints `key=value` lines, then the installed packages and the md5 hex
+# digests of files after the section lines
+FACTS_SCRIPT = """\
+echo "os=$(. /etc/os-release 2>/dev/null && echo "$ID")"
+echo "arch=$(uname -m)"
+echo "kernel=$(uname -sr)"
+echo '[packages]'
+if command -v dpkg-query >/dev/null 2>&1; then
+    dpkg-query -W -f '${Status} ${Package}\\n' 2>/dev/null |
+        sed -n 's/^install ok installed //p'
+elif command -v pacman >/dev/null 2>&1; then
+    pacman -Qq 2>/dev/null
+elif command -v rpm >/dev/null 2>&1; then
+    rpm -qa --qf '%{NAME}\\n' 2>/dev/null
+fi
+echo '[files]'
+"""
+
+
+def _hash_script(files):
+    return 'md5sum -- %s 2>/dev/null\ntrue' % ' '.join(quote(f) for f in files)
+
+
+def script(files=()):
+    """Get a shell script to gather the facts
+
+    :param files: list of remote path of files to hash
+    :returns: string of shell script
+    """
+    if not files:
+        return FACTS_SCRIPT
+    return FACTS_SCRIPT + _hash_script(files)
+
+
+def parse(output, files=()):
+    """Parse the output of the facts script
+
+    :param output: string of output
+    :param files: list of remote path of files which have been hashed
+    :returns: dict of facts. `packages` is sorted list of installed package
+        names, `files` is dict of path key and md5 hex digest value and
+        `probed` is sorted list of hashed paths including missing files.
+    """
+    facts = dict(packages=[], files={}, probed=sorted(set(files)))
+    section = None
+    for line in output.splitlines():
+        line = line.rstrip('\r')
+        if line in ('[packages]', '[files]'):
+            section = line[1:-1]
+        elif section is None:
+            key, sep, value = line.partition('=')
+            if sep:
+                facts[key] = value
+        elif section == 'packages':
+            if line.strip():
+                facts['packages'].append(line.strip())
+        elif line.strip():
+            checksum, sep, path = line.partition('  ')
+            if sep:
+                facts['files'][path] = checksum
+    facts['packages'].sort()
+    facts['gathered'] = time.time()
+    return facts
+
+
+def gather(files=()):
+    """Gather the facts of the current host in one round trip
+
+    :param files: list of remote path of files to hash
+    :returns: dict of facts, see also :func:`parse`
+    """
+    files = sorted(set(files))
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        output = fa.sudo(script(files))
+    if output.failed:
+        # not to take the host as having no packages
+        fa.abort(u"cannot gather the facts of the host")
+    return parse(output, files)
+
+
+def checksums(files):
+    """Hash the files of the current host in one round trip
+
+    Unlike :func:`gather`, the other facts are not gathered.
+
+    :param files: list of remote path of files to hash
+    :returns: dict of path key and md5 hex digest value. missing files are
+        not included.
+    """
+    files = sorted(set(files))
+    if not files:
+        return {}
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        output = fa.sudo("echo '[files]'\n" + _hash_script(files))
+    return parse(output, files)['files']
+
+
+class FactsCache(object):
+    def __init__(self, directory=None, ttl=DEFAULT_TTL):
+        """Constructor of FactsCache class
+
+        The facts are kept in memory during the run and saved in directory
+        for the following runs.
+
+        :param directory: directory of cache files. If None,
+            :data:`DEFAULT_CACHE_DIR`.
+        :param ttl: seconds to reuse the saved facts. If 0, the facts are
+            gathered at first in each run.
+        """
+        self.directory = os.path.expanduser(directory or DEFAULT_CACHE_DIR)
+        self.ttl = ttl
+        self._facts = {}
+
+    def path(self, host):
+        return os.path.join(self.directory, '%s.json' % urllib.quote(
+            host or 'default', safe=''))
+
+    def load(self, host):
+        """Load the saved facts of host
+
+        :param host: hostname
+        :returns: dict of facts or None if not saved or expired
+        """
+        try:
+            with open(self.path(host)) as f:
+                facts = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if time.time() - facts.get('gathered', 0) >= self.ttl:
+            return None
+        return facts
+
+    def save(self, host, facts):
+        """Save the facts of host
+
+        :param host: hostname
+        :param facts: dict of facts
+        """
+        self._facts[host] = facts
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        path = self.path(host)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(facts, f)
+        os.rename(path + '.tmp', path)
+
+    def get(self, files=()):
+        """Get the facts of the current host
+
+        The facts are gathered if not cached or any of files has not been
+        hashed yet.
+
+        :param files: list of remote path of files to be hashed
+        :returns: dict of facts, see also :func:`parse`
+        """
+        host = fa.env.host_string
+        facts = self._facts.get(host)
+        if facts is None:
+            facts = self._facts[host] = self.load(host)
+        if facts is None or not set(files) <= set(facts['probed']):
+            probed = facts['probed'] if facts else []
+            facts = gather(set(files) | set(probed))
+            self.save(host, facts)
+        return facts
+
+    def update(self, packages=(), files=None):
+        """Update the facts of the current host after changed
+
+        :param packages: list of installed package names
+        :param files: dict of path key and md5 hex digest value of the put
+            files
+        """
+        host = fa.env.host_string
+        facts = self._facts.get(host)
+        if facts is None:
+            return
+        facts['packages'] = sorted(set(facts['packages']) | set(packages))
+        if files:
+            facts['files'].update(files)
+            facts['probed'] = sorted(set(facts['probed']) | set(files))
+        self.save(host, facts)
+
+
+def get(files=(), ttl=DEFAULT_TTL):
+    """Get the facts of the current host for recipes
+
+    e.g. `alnair.facts.get()['arch'] == 'x86_64'`
+
+    :param files: list of remote path of files to be hashed
+    :param ttl: seconds to reuse the saved facts
+    :returns: dict of facts, see also :func:`parse`
+    """
+    global _cache
+    if _cache is None or _cache.ttl != ttl:
+        _cache = FactsCache(ttl=ttl)
+    return _cache.get(files)
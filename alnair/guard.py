@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+from pipes import quote
+
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+# kinds of guard. each guard says the work of the command is already done
+# if the path exists (`creates`), the check command succeeds (`unless`) or
+# the check command fails (`onlyif`).
+KINDS = ('creates', 'unless', 'onlyif')
+
+
+def make(creates=None, unless=None, onlyif=None):
+    """Make the guards of a command
+
+    :param creates: remote path which the command creates
+    :param unless: check command which succeeds if the work is done
+    :param onlyif: check command which succeeds if the work is needed
+    :returns: tuple of (kind, value) pairs, empty if no guards
+    """
+    values = dict(creates=creates, unless=unless, onlyif=onlyif)
+    return tuple((kind, values[kind]) for kind in KINDS
+            if values[kind] is not None)
+
+
+def condition(guard):
+    """Get a shell condition which is true if the work is done
+
+    :param guard: tuple of (kind, value)
+    :returns: string of shell condition
+    """
+    kind, value = guard
+    if kind == 'creates':
+        return '[ -e %s ]' % quote(value)
+    if kind == 'unless':
+        return '{ %s; } >/dev/null 2>&1' % value
+    if kind == 'onlyif':
+        return '! { %s; } >/dev/null 2>&1' % value
+    raise ValueError(u"unknown guard `%s`" % kind)
+
+
+def shell_command(cmd, guards):
+    """Get a shell command which runs cmd unless any guard says done
+
+    :param cmd: string of command
+    :param guards: tuple of guards, see also :func:`make`
+    :returns: string of shell command
+    """
+    if not guards:
+        return cmd
+    return '%s || { %s; }' % (' || '.join(condition(g) for g in guards),
+            cmd)
+
+
+def script(guards):
+    """Get a shell script to evaluate the guards at once
+
+    :param guards: list of (kind, value)
+    :returns: string of shell script which prints `index 1` for each guard
+        which says done, otherwise `index 0`
+    """
+    return '\n'.join('if %s; then echo "%d 1"; else echo "%d 0"; fi' % (
+        condition(guard), i, i) for i, guard in enumerate(guards))
+
+
+def parse(output, guards):
+    """Parse the output of the guard script
+
+    :param output: string of output
+    :param guards: list of (kind, value) which have been evaluated
+    :returns: dict of (kind, value) key and True value if the guard says
+        done. The guards which have not been reported are False.
+    """
+    result = dict((guard, False) for guard in guards)
+    for line in output.splitlines():
+        index, _, done = line.strip().partition(' ')
+        if index.isdigit() and int(index) < len(guards):
+            result[guards[int(index)]] = done == '1'
+    return result
+
+
+def evaluate(guards):
+    """Evaluate the guards on the current host in one round trip
+
+    The guards are evaluated under the super user privileges.
+
+    :param guards: list of (kind, value)
+    :returns: dict, see also :func:`parse`
+    """
+    guards = list(guards)
+    if not guards:
+        return {}
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        output = fa.sudo(script(guards))
+    return parse(output, guards)
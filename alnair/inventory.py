@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import fnmatch
+import re
+
+from array import array
+from collections import OrderedDict
+
+from alnair.exception import InventoryError
+
+ALL = 'all'
+
+# e.g. 'web[001-300].example.com' or 'rack[a-d]-db'
+RANGE_RE = re.compile(r'\[(?:(\d+)-(\d+)|([a-z])-([a-z]))\]')
+GLOB_CHARS = re.compile(r'[*?]|\[(?!\d+-\d+\]|[a-z]-[a-z]\])')
+
+
+def parse_pattern(pattern):
+    """Parse a host pattern
+
+    :param pattern: string of host pattern (e.g. 'web[001-300].example.com')
+    :returns: tuple of parts. each part is string of literal or tuple of
+        range values.
+    """
+    parts = []
+    pos = 0
+    for m in RANGE_RE.finditer(pattern):
+        if m.start() > pos:
+            parts.append(pattern[pos:m.start()])
+        if m.group(1) is not None:
+            start, end = m.group(1), m.group(2)
+            if (len(start) > 1 and start[0] == '0') or \
+                    (len(end) > 1 and end[0] == '0'):
+                # zero padded (e.g. '[001-300]' or '[1-010]')
+                width = max(len(start), len(end))
+            else:
+                width = 0
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(u"invalid range `%s`" % m.group(0))
+            parts.append((start, end, width))
+        else:
+            start, end = ord(m.group(3)), ord(m.group(4))
+            if start > end:
+                raise ValueError(u"invalid range `%s`" % m.group(0))
+            parts.append(tuple(chr(c) for c in xrange(start, end + 1)))
+        pos = m.end()
+    if pos < len(pattern):
+        parts.append(pattern[pos:])
+    return tuple(parts)
+
+
+def _is_numeric_range(part):
+    return isinstance(part[0], int)
+
+
+def _values(part):
+    if isinstance(part, basestring):
+        return (part,)
+    if _is_numeric_range(part):
+        start, end, width = part
+        return ('%0*d' % (width, i) for i in xrange(start, end + 1))
+    return part
+
+
+def expand(parts):
+    """Expand the parsed host pattern to hostnames lazily
+
+    :param parts: tuple of parts, see also :func:`parse_pattern`
+    :returns: generator of hostname
+    """
+    if not parts:
+        yield ''
+        return
+    for value in _values(parts[0]):
+        for rest in expand(parts[1:]):
+            yield value + rest
+
+
+def literal_prefix(pattern):
+    """Get a literal prefix of the glob or host pattern
+
+    :param pattern: string of pattern
+    :returns: string of prefix
+    """
+    m = re.search(r'[*?\[]', pattern)
+    return pattern if m is None else pattern[:m.start()]
+
+
+def _part_regex(part):
+    if isinstance(part, basestring):
+        return re.escape(part)
+    if _is_numeric_range(part):
+        return r'(\d{%d})' % part[2] if part[2] else r'(\d+)'
+    return '(%s)' % '|'.join(re.escape(p) for p in part)
+
+
+def _part_contains(part, value):
+    if _is_numeric_range(part):
+        start, end, width = part
+        if width == 0 and value != str(int(value)):
+            return False
+        return start <= int(value) <= end
+    return value in part
+
+
+class Inventory(object):
+    def __init__(self):
+        """Constructor of Inventory class
+
+        Hosts which are written as a range pattern are not expanded until
+        those are selected, so that memory stays small for a large
+        inventory.
+        """
+        self._patterns = []
+        self._vars = []
+        self._prefixes = []
+        self._literals = {}
+        self._ranges = {}
+        self._groups = OrderedDict()
+        self._shared_vars = {}
+        self._regexes = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load an inventory file
+
+        The format is following::
+
+            # hosts before any group belong to `all` group only
+            db1.example.com distribution=archlinux
+
+            [web]
+            web[001-300].example.com distribution=debian
+
+        :param path: path of the inventory file
+        :returns: instance of :class:`Inventory`
+        """
+        inventory = cls()
+        with open(path) as f:
+            inventory.parse(f, path)
+        return inventory
+
+    def parse(self, lines, name='<inventory>'):
+        """Parse lines of the inventory
+
+        :param lines: iterable of string
+        :param name: name of the source for the error message
+        """
+        group = None
+        for lineno, line in enumerate(lines, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('[') and line.endswith(']') and \
+                    not re.search(r'[\[\]]', line[1:-1]):
+                group = line[1:-1].strip()
+                if not group:
+                    raise InventoryError(u"%s:%d: empty group name" % (name,
+                        lineno))
+                self._groups.setdefault(group, array('L'))
+                continue
+            tokens = line.split()
+            variables = {}
+            for token in tokens[1:]:
+                key, sep, value = token.partition('=')
+                if not sep or not key:
+                    raise InventoryError(u"%s:%d: invalid variable `%s`" % (
+                        name, lineno, token))
+                variables[key] = value
+            try:
+                self.add(tokens[0], variables, group)
+            except ValueError as exc:
+                raise InventoryError(u"%s:%d: %s" % (name, lineno,
+                    exc.message))
+
+    def add(self, pattern, variables=None, group=None):
+        """Add the host pattern
+
+        :param pattern: string of host pattern (e.g. 'web[001-300]')
+        :param variables: dict of host variables
+        :param group: name of group or None
+        """
+        parts = parse_pattern(pattern)
+        key = tuple(sorted((variables or {}).iteritems()))
+        variables = self._shared_vars.setdefault(key, dict(key))
+        index = len(self._patterns)
+        self._patterns.append(parts)
+        self._vars.append(variables)
+        prefix = literal_prefix(pattern)
+        self._prefixes.append(prefix)
+        if all(isinstance(part, basestring) for part in parts):
+            self._literals.setdefault(prefix, array('L')).append(index)
+        else:
+            self._ranges.setdefault(prefix, array('L')).append(index)
+        self._groups.setdefault(ALL, array('L')).append(index)
+        if group is not None and group != ALL:
+            self._groups.setdefault(group, array('L')).append(index)
+
+    @property
+    def groups(self):
+        return list(self._groups)
+
+    def _match(self, index, name):
+        parts = self._patterns[index]
+        regex = self._regexes.get(index)
+        if regex is None:
+            regex = self._regexes[index] = re.compile(''.join(
+                _part_regex(part) for part in parts) + '$')
+        m = regex.match(name)
+        if m is None:
+            return False
+        ranges = [part for part in parts if not isinstance(part, basestring)]
+        return all(_part_contains(part, value)
+                for part, value in zip(ranges, m.groups()))
+
+    def _find(self, name):
+        indexes = list(self._literals.get(name, []))
+        for i in xrange(len(name) + 1):
+            for index in self._ranges.get(name[:i], []):
+                if self._match(index, name):
+                    indexes.append(index)
+        return sorted(indexes)
+
+    def __contains__(self, name):
+        return bool(self._find(name))
+
+    def vars(self, name):
+        """Get the variables of the host
+
+        :param name: hostname
+        :returns: dict of variables. Later definitions take precedence.
+        """
+        result = {}
+        for index in self._find(name):
+            result.update(self._vars[index])
+        return result
+
+    def missing(self, hosts):
+        """Get the hostnames which are not in the inventory
+
+        :param hosts: list of hostname or host pattern. glob patterns are
+            ignored.
+        :returns: generator of hostname
+        """
+        for pattern in hosts:
+            if GLOB_CHARS.search(pattern):
+                continue
+            for name in expand(parse_pattern(pattern)):
+                if name not in self:
+                    yield name
+
+    def select(self, hosts=None, groups=None):
+        """Select the hostnames
+
+        :param hosts: list of hostname, host pattern or glob pattern (e.g.
+            'web0*'). If None, all hosts in the groups.
+        :param groups: list of group name or glob pattern. If None, all
+            groups.
+        :returns: generator of hostname in order of definitions
+        """
+        if groups is None:
+            indexes = self._groups.get(ALL, [])
+        else:
+            selected = set()
+            for pattern in groups:
+                for group, members in self._groups.iteritems():
+                    if fnmatch.fnmatchcase(group, pattern):
+                        selected.update(members)
+            indexes = sorted(selected)
+        if hosts is not None and not any(GLOB_CHARS.search(pattern)
+                for pattern in hosts):
+            for name in self._select_names(hosts, groups, indexes):
+                yield name
+            return
+        if hosts is None:
+            matchers = None
+        else:
+            matchers = [self._matcher(pattern) for pattern in hosts]
+        seen = set()
+        for index in indexes:
+            prefix = self._prefixes[index]
+            candidates = [m for m in matchers or [] if m[0].startswith(prefix)
+                    or prefix.startswith(m[0])]
+            if matchers is not None and not candidates:
+                continue
+            for name in expand(self._patterns[index]):
+                if name in seen:
+                    continue
+                if matchers is None or any(match(name)
+                        for _, match in candidates):
+                    seen.add(name)
+                    yield name
+
+    def _select_names(self, hosts, groups, indexes):
+        # look up the index for each name instead of expanding all hosts
+        if groups is not None:
+            indexes = set(indexes)
+        seen = set()
+        for pattern in hosts:
+            for name in expand(parse_pattern(pattern)):
+                if name in seen:
+                    continue
+                found = self._find(name)
+                if groups is not None:
+                    found = [i for i in found if i in indexes]
+                if found:
+                    seen.add(name)
+                    yield name
+
+    def _matcher(self, pattern):
+        if GLOB_CHARS.search(pattern):
+            return (literal_prefix(pattern),
+                    lambda name: fnmatch.fnmatchcase(name, pattern))
+        names = frozenset(expand(parse_pattern(pattern)))
+        return (literal_prefix(pattern), names.__contains__)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import binascii
+import json
+import os
+import time
+
+DEFAULT_JOURNAL_DIR = os.path.join('~', '.cache', 'alnair', 'runs')
+
+
+def new_run_id():
+    """Get a new unique run ID
+
+    :returns: string of run ID (e.g. '20121231-235959-1a2b3c4d')
+    """
+    return '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'),
+            binascii.hexlify(os.urandom(4)))
+
+
+class Journal(object):
+    def __init__(self, run_id=None, directory=None, resume=False):
+        """Constructor of Journal class
+
+        The completed steps of each host are appended to the journal file,
+        one JSON object per line, so that the processes for hosts can share
+        the file and a killed run loses nothing but its current step.
+
+        :param run_id: run ID. If None, a new run ID.
+        :param directory: directory of journal files. If None,
+            :data:`DEFAULT_JOURNAL_DIR`.
+        :param resume: load the completed steps of the run to skip those if
+            True. IOError is raised if the run has no journal.
+        """
+        self.run_id = run_id or new_run_id()
+        self.directory = os.path.expanduser(directory or DEFAULT_JOURNAL_DIR)
+        self._completed = set()
+        self._counts = {}
+        if resume:
+            self.load()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '%s.jsonl' % self.run_id)
+
+    def load(self):
+        """Load the completed steps from the journal file
+        """
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a partial line written by a killed process
+                    continue
+                self._completed.add((entry['host'], entry['step']))
+
+    def step(self, host, name):
+        """Get a key of the step
+
+        The same step of the host is numbered in order of appearance, so
+        that repeated commands are distinguished.
+
+        :param host: hostname
+        :param name: string of step (e.g. 'put:/etc/hosts')
+        :returns: string of key
+        """
+        count = self._counts.get((host, name), 0) + 1
+        self._counts[(host, name)] = count
+        return name if count == 1 else '%s#%d' % (name, count)
+
+    def completed(self, host, key):
+        """Whether the step has been completed in the run
+
+        :param host: hostname
+        :param key: key of step, see also :meth:`step`
+        :returns: True if completed
+        """
+        return (host, key) in self._completed
+
+    def record(self, host, key):
+        """Record the step as completed
+
+        :param host: hostname
+        :param key: key of step, see also :meth:`step`
+        """
+        self._completed.add((host, key))
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o700)
+            except OSError:
+                # created by the other process
+                if not os.path.isdir(self.directory):
+                    raise
+        line = json.dumps(dict(host=host, step=key)) + '\n'
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import multiprocessing
+import os
+
+import alnair
+
+from alnair.lazy import LazyModule
+from alnair.package import Command, Config, Host, Package, Setup, guards_of
+
+fa = LazyModule('fabric.api')
+
+# `after` of setup which cannot be described, e.g. a function of the recipe
+CALLABLE = 'callable'
+
+
+def describe_commands(obj):
+    """Get a picklable description of the commands
+
+    :param obj: instance of :class:`alnair.package.Command`
+    :returns: list of (command string, function name, tuple of guards)
+    """
+    return [(command[0], command[1].__name__, guards_of(command))
+            for command in obj._commands]
+
+
+def restore_commands(obj, desc):
+    """Add the described commands to obj
+
+    :param obj: instance of :class:`alnair.package.Command`
+    :param desc: description, see also :func:`describe_commands`
+    """
+    for cmd, name, guards in desc:
+        obj._commands.append(obj._make_command(cmd, getattr(fa, name),
+            guards))
+
+
+def describe_setup(setup):
+    """Get a picklable description of the setup
+
+    :param setup: instance of :class:`alnair.package.Setup`
+    :returns: dict of description
+    """
+    configs = []
+    for (hostname, filename), config in setup.config_all.iteritems():
+        configs.append((hostname, filename, config._contents, config._delta,
+            describe_commands(config), config._notify, config._resource))
+    handlers = [(name, describe_commands(handler), handler._notify,
+        handler._resource) for name, handler in setup._handlers.iteritems()]
+    after_notify = ()
+    after_resource = None
+    if setup.after is None:
+        after = None
+    elif isinstance(setup.after, Command):
+        after = describe_commands(setup.after)
+        after_notify = setup.after._notify
+        after_resource = setup.after._resource
+    else:
+        after = CALLABLE
+    return dict(commands=describe_commands(setup), configs=configs,
+            after=after, notify=setup._notify, resource=setup._resource,
+            handlers=handlers, after_notify=after_notify,
+            after_resource=after_resource)
+
+
+def restore_setup(setup, desc):
+    """Merge the described setup into setup
+
+    :param setup: instance of :class:`alnair.package.Setup`
+    :param desc: description, see also :func:`describe_setup`
+    """
+    restore_commands(setup, desc['commands'])
+    setup.notify(*desc['notify'])
+    if desc['resource'] is not None:
+        setup.resource(desc['resource'])
+    for name, commands, notify, resource in desc['handlers']:
+        handler = setup.handler(name)
+        restore_commands(handler, commands)
+        handler.notify(*notify)
+        if resource is not None:
+            handler.resource(resource)
+    for hostname, filename, contents, delta, commands, notify, resource in \
+            desc['configs']:
+        key = (hostname, filename)
+        config = setup._config.get(key)
+        if config is None:
+            config = setup._config[key] = Config(filename)
+        config.contents(contents)
+        config._delta = delta
+        restore_commands(config, commands)
+        config.notify(*notify)
+        if resource is not None:
+            config.resource(resource)
+    if desc['after'] is not None:
+        setup.after = Command()
+        restore_commands(setup.after, desc['after'])
+        setup.after.notify(*desc['after_notify'])
+        if desc['after_resource'] is not None:
+            setup.after.resource(desc['after_resource'])
+
+
+def evaluate(args):
+    """Evaluate the recipe in a worker process
+
+    :param args: tuple of (configuration directory, distribution name,
+        package name)
+    :returns: tuple of description of the package and of the system wide
+        settings, or None if the recipe should be evaluated by the controller
+    """
+    from alnair.distribution import Distribution
+    config_dir, distname, name = args
+    # the settings of the recipe only are described
+    alnair.setup = Setup(Host())
+    dist = Distribution(distname)
+    dist.CONFIG_DIR = config_dir
+    try:
+        pkg = dist.get_package(name)
+    except Exception:
+        # raised again by the controller
+        return None
+    desc = describe_setup(pkg.setup)
+    global_desc = describe_setup(alnair.setup)
+    if CALLABLE in (desc['after'], global_desc['after']):
+        return None
+    return dict(name=pkg.name, setup=desc), global_desc
+
+
+def load_packages(dist, names, processes=None):
+    """Evaluate the recipes in parallel worker processes
+
+    A recipe which has failed or has a callable `after` is left to be
+    evaluated by :meth:`alnair.distribution.Distribution.get_package` in the
+    controller, so that its errors and callables work as usual.
+
+    :param dist: instance of :class:`alnair.distribution.Distribution`
+    :param names: list of package name
+    :param processes: number of worker processes. If None, the number of
+        CPUs.
+    :returns: list of instance of :class:`alnair.package.Package` or None
+        in order of names
+    """
+    config_dir = os.path.abspath(dist.CONFIG_DIR)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(evaluate, [(config_dir, dist.name, name)
+            for name in names])
+    finally:
+        pool.close()
+        pool.join()
+    packages = []
+    for name, result in zip(names, results):
+        if result is None:
+            packages.append(None)
+            continue
+        desc, global_desc = result
+        pkg = Package(*desc['name'])
+        restore_setup(pkg.setup, desc['setup'])
+        restore_setup(alnair.setup, global_desc)
+        packages.append(pkg)
+    return packages
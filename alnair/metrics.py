@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import os
+import socket
+import time
+
+# suffix of the counters of phase time, see also
+# :meth:`alnair.stats.Stats.timer`
+SECONDS = '_seconds'
+
+# maximum size of a statsd UDP packet which is not fragmented
+MAX_PACKET_SIZE = 512
+
+
+def run_metrics(started, hosts, failed_hosts):
+    """Get the metrics of the whole run
+
+    :param started: time when the run started
+    :param hosts: number of hosts
+    :param failed_hosts: number of failed hosts
+    :returns: dict of name key and value
+    """
+    now = time.time()
+    return dict(seconds=now - started, hosts=hosts,
+            failed_hosts=failed_hosts, timestamp_seconds=now)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+            '\\n')
+
+
+def _families(counters, labels):
+    for name, value in counters:
+        if name.endswith(SECONDS):
+            yield ('alnair_phase_seconds', 'counter',
+                    labels + [('phase', name[:-len(SECONDS)])], value)
+        else:
+            yield 'alnair_%s_total' % name, 'counter', labels, value
+
+
+def prometheus(stats, run):
+    """Render the metrics in the Prometheus text format
+
+    The counters of each host are labeled by `host`, and the time of each
+    phase is `alnair_phase_seconds` labeled by `phase`.
+
+    :param stats: instance of :class:`alnair.stats.Stats`
+    :param run: dict of the metrics of the run, see also :func:`run_metrics`
+    :returns: string of metrics
+    """
+    samples = {}
+    types = {}
+    names = []
+    if stats.hosts:
+        series = [(stats.host(host), [('host', host)])
+                for host in stats.hosts]
+    else:
+        series = [(list(stats), [])]
+    for counters, labels in series:
+        for name, kind, sample_labels, value in _families(counters, labels):
+            if name not in types:
+                types[name] = kind
+                names.append(name)
+            samples.setdefault(name, []).append((sample_labels, value))
+    lines = []
+    for name, value in sorted(run.iteritems()):
+        lines.append('# TYPE alnair_run_%s gauge' % name)
+        lines.append('alnair_run_%s %s' % (name, value))
+    for name in sorted(names):
+        lines.append('# TYPE %s %s' % (name, types[name]))
+        for labels, value in samples[name]:
+            label = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+            lines.append('%s%s %s' % (name, '{%s}' % label if label else '',
+                value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, text):
+    """Write the metrics for the textfile collector of node_exporter
+
+    The file is replaced at once, so that the collector never reads a
+    partial file.
+
+    :param path: path of the file (e.g. '/var/lib/node_exporter/alnair.prom')
+    :param text: string of metrics, see also :func:`prometheus`
+    """
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.rename(path + '.tmp', path)
+
+
+def statsd(stats, run, prefix='alnair'):
+    """Get the metrics in the statsd format
+
+    :param stats: instance of :class:`alnair.stats.Stats`
+    :param run: dict of the metrics of the run, see also :func:`run_metrics`
+    :param prefix: prefix of metric names
+    :returns: list of string of metric
+    """
+    lines = []
+    for name, value in sorted(run.iteritems()):
+        if name == 'timestamp_seconds':
+            continue
+        if name == 'seconds':
+            lines.append('%s.run.ms:%d|ms' % (prefix, value * 1000))
+        else:
+            lines.append('%s.run.%s:%d|g' % (prefix, name, value))
+    series = [('%s.host.%s' % (prefix, host.replace('.', '_')),
+        stats.host(host)) for host in stats.hosts]
+    series.append((prefix, list(stats)))
+    for name_prefix, counters in series:
+        for name, value in counters:
+            if name.endswith(SECONDS):
+                lines.append('%s.%s.ms:%d|ms' % (name_prefix,
+                    name[:-len(SECONDS)], value * 1000))
+            else:
+                lines.append('%s.%s:%d|c' % (name_prefix, name, value))
+    return lines
+
+
+def send_statsd(address, lines):
+    """Send the metrics to statsd over UDP
+
+    The metrics are packed into packets as few as possible. Errors are
+    ignored, so that an unavailable collector does not fail the run.
+
+    :param address: tuple of (host, port)
+    :param lines: list of string of metric, see also :func:`statsd`
+    """
+    # a list if given through the daemon
+    host, port = address
+    address = (str(host), int(port))
+    packets = []
+    for line in lines:
+        if packets and len(packets[-1]) + len(line) + 1 <= MAX_PACKET_SIZE:
+            packets[-1] += '\n' + line
+        else:
+            packets.append(line)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        for packet in packets:
+            try:
+                sock.sendto(packet, address)
+            except socket.error:
+                pass
+    finally:
+        sock.close()
@@ -32,50 +32,154 @@ __all__ = [
 
 import inspect
 import os
+import threading
 
-import fabric.api as fa
+from alnair import guard
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+
+def _intern(value):
+    # the same filenames and commands appear in many recipes and hosts. only
+    # byte strings can be interned in Python 2.
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+# identical contents of configs (e.g. certificates shared by packages and
+# hosts) are held once. see also :func:`clear_contents`
+_contents = {}
+
+
+def _share(contents):
+    if contents is None:
+        return None
+    return _contents.setdefault((type(contents), contents), contents)
+
+
+def clear_contents():
+    """Forget the shared contents of configs before the recipes are loaded
+    again
+    """
+    _contents.clear()
 
 
 class Command(object):
+    # recipes of a large fleet create many instances, so those have no
+    # instance dict
+    __slots__ = ('_commands', '_arg', '_notify', '_resource')
+
     def __init__(self, arg=''):
         """Constructor of Command class
 
         :param arg: last argument of command
         """
         self._commands = []
-        self._arg = arg
+        self._arg = _intern(arg)
+        self._notify = ()
+        self._resource = None
 
-    def run(self, cmd):
+    def run(self, cmd, creates=None, unless=None, onlyif=None):
         """Set a run command on the user privileges
 
+        The command is skipped if any of the guards says its work is already
+        done. The guards are evaluated under the super user privileges
+        before the commands of the host are executed.
+
         :param cmd: string of command
+        :param creates: remote path which the command creates
+        :param unless: check command which succeeds if the work is done
+        :param onlyif: check command which succeeds if the work is needed
         :returns: self
         """
-        self._commands.append(self._make_command(cmd, fa.run))
+        self._commands.append(self._make_command(cmd, fa.run,
+            guard.make(creates, unless, onlyif)))
         return self
 
-    def sudo(self, cmd):
+    def sudo(self, cmd, creates=None, unless=None, onlyif=None):
         """Set a run command on the super user privileges
 
         :param cmd: string of command
+        :param creates: remote path which the command creates
+        :param unless: check command which succeeds if the work is done
+        :param onlyif: check command which succeeds if the work is needed
+        :returns: self. see also :meth:`run`
+        """
+        self._commands.append(self._make_command(cmd, fa.sudo,
+            guard.make(creates, unless, onlyif)))
+        return self
+
+    def notify(self, *names):
+        """Notify the handlers when this has changed something
+
+        A config notifies when its file has been put, the others notify when
+        any of their commands has been executed. see also
+        :meth:`Setup.handler`
+
+        :param names: names of handler
         :returns: self
         """
-        self._commands.append(self._make_command(cmd, fa.sudo))
+        self._notify += tuple(_intern(name) for name in names)
         return self
 
-    def _make_command(self, cmd, func):
-        return (cmd, func)
+    def resource(self, name):
+        """Draw the commands from the concurrency limit of the resource
+
+        The commands are executed while fewer hosts than the limit given by
+        `--limit NAME=N` are executing the commands of the same resource,
+        instead of the limit of `commands`.
+
+        :param name: resource name (e.g. 'database')
+        :returns: self
+        """
+        self._resource = _intern(name)
+        return self
+
+    def _make_command(self, cmd, func, guards=()):
+        if guards:
+            return GuardedCommand(_intern(cmd), func, guards)
+        return (_intern(cmd), func)
+
+
+class GuardedCommand(tuple):
+    def __new__(cls, cmd, func, guards):
+        """Constructor of GuardedCommand class
+
+        This is a (command string, function) pair as same as the commands
+        without guards, and has `guards` attribute.
+
+        :param cmd: string of command
+        :param func: function to execute the command
+        :param guards: tuple of guards, see also :func:`alnair.guard.make`
+        """
+        self = tuple.__new__(cls, (cmd, func))
+        self.guards = guards
+        return self
+
+
+def guards_of(command):
+    """Get the guards of the command
+
+    :param command: (command string, function) pair
+    :returns: tuple of guards, empty if the command has no guards
+    """
+    return getattr(command, 'guards', ())
 
 
 class Config(Command):
+    __slots__ = ('_filename', '_contents', '_delta')
+
     def __init__(self, filename):
         """Constructor of Config class
 
         :param filename: filename of config file (e.g. '/etc/nginx/nginx.conf')
         """
         super(Config, self).__init__(filename)
-        self._filename = filename
+        self._filename = self._arg
         self._contents = None
+        self._delta = None
 
     def contents(self, contents):
         """Set the contents of this config
@@ -83,11 +187,23 @@ class Config(Command):
         :param contents: string of contents
         :returns: self
         """
-        self._contents = contents
+        self._contents = _share(contents)
+        return self
+
+    def delta(self, block_size=None):
+        """Send the changed blocks only when the remote file exists
+
+        :param block_size: block size in bytes. If not given or None, block
+            size is chosen from the size of contents.
+        :returns: self
+        """
+        self._delta = block_size or True
         return self
 
 
 class Setup(Command):
+    __slots__ = ('_host', 'after', '_config', '_handlers')
+
     def __init__(self, host):
         """Constructor of Setup class
 
@@ -97,6 +213,7 @@ class Setup(Command):
         self._host = host
         self.after = None
         self._config = {}
+        self._handlers = {}
 
     def config(self, filename):
         """Get an instance of :class:`Config`
@@ -104,13 +221,33 @@ class Setup(Command):
         :param filename: filename of config file (e.g. '/etc/nginx/nginx.conf')
         :returns: instance of :class:`Config`
         """
-        key = (self._host.name, filename)
+        key = (self._host.name, _intern(filename))
         try:
             config = self._config[key]
         except KeyError:
-            self._config[key] = config = Config(filename)
+            # the other thread may have just added it
+            config = self._config.setdefault(key, Config(filename))
         return config
 
+    def handler(self, name):
+        """Get a handler
+
+        The commands of handler are executed at most once for each host at
+        the end of the run, only if notified. Handlers of the same name in
+        packages are the same, the first one is executed.
+        e.g. `pkg.setup.handler('restart nginx').sudo('systemctl restart
+        nginx')` and `pkg.setup.config(filename).notify('restart nginx')`
+
+        :param name: name of handler
+        :returns: instance of :class:`Command`
+        """
+        name = _intern(name)
+        try:
+            handler = self._handlers[name]
+        except KeyError:
+            handler = self._handlers.setdefault(name, Command())
+        return handler
+
     @property
     def config_all(self):
         """Get an all instance of :class:`Config`
@@ -120,21 +257,52 @@ class Setup(Command):
         return self._config
 
 
+class _HostState(threading.local):
+    def __init__(self):
+        self.stack = []
+        self.current_hostname = None
+
+
 class Host(object):
+    __slots__ = ('_state',)
+
     def __init__(self):
         """Constructor of Host class
+
+        The hostname is kept for each thread, and the contexts can be nested.
         """
-        self.name = None
-        self.current_hostname = None
+        self._state = _HostState()
+
+    @property
+    def name(self):
+        stack = self._state.stack
+        return stack[-1] if stack else None
+
+    @name.setter
+    def name(self, value):
+        self._state.stack = [] if value is None else [value]
+
+    @property
+    def current_hostname(self):
+        return self._state.current_hostname
+
+    @current_hostname.setter
+    def current_hostname(self, value):
+        self._state.current_hostname = value
 
     def __enter__(self):
-        self.name = self.current_hostname
+        state = self._state
+        state.stack.append(state.current_hostname)
+        state.current_hostname = None
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.name = None
+        self._state.stack.pop()
 
 
 class Package(object):
+    __slots__ = ('name', '_host', 'setup')
+
     def __init__(self, name=None, *args):
         """Constructor of Package class
 
@@ -154,8 +322,11 @@ class Package(object):
     def host(self, hostname):
         """Set the one time hostname for context manager
 
+        The hostname is set for the current thread only, and can be nested
+        (e.g. `with pkg.host('web1'): with pkg.host('web2'): ...`).
+
         :param hostname: string of target host or IP address
         :returns: instance of :class:`Host`
         """
-        self._host.current_hostname = hostname
+        self._host.current_hostname = _intern(hostname)
         return self._host
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import multiprocessing
+import re
+
+from contextlib import contextmanager
+
+# resource of each operation of :class:`alnair.distribution.Distribution`
+RESOURCES = dict(install='install', put='upload', command='commands')
+
+NAME_RE = re.compile(r'^[\w.-]+$')
+
+
+def parse(value):
+    """Parse a limit of resource
+
+    :param value: string of 'RESOURCE=N' (e.g. 'install=20')
+    :returns: tuple of (resource name, N)
+    """
+    name, sep, count = value.partition('=')
+    if not sep or not NAME_RE.match(name):
+        raise ValueError(u"invalid limit `%s`, must be RESOURCE=N" % value)
+    try:
+        count = int(count)
+    except ValueError:
+        raise ValueError(u"invalid number `%s`" % count)
+    if count < 1:
+        raise ValueError(u"limit of `%s` must be positive" % name)
+    return name, count
+
+
+class Limits(object):
+    def __init__(self, limits):
+        """Constructor of Limits class
+
+        A semaphore is created for each resource, and shared by the
+        processes forked after this. So an instance must be created before
+        the hosts are applied in parallel.
+
+        :param limits: dict of resource name key and maximum number of
+            concurrent operations value
+        """
+        self._limits = dict(limits)
+        self._semaphores = dict((name, multiprocessing.BoundedSemaphore(count))
+                for name, count in self._limits.iteritems())
+
+    def __contains__(self, name):
+        return name in self._semaphores
+
+    def __getitem__(self, name):
+        return self._limits[name]
+
+    @contextmanager
+    def acquire(self, name):
+        """Hold the resource within the context
+
+        Waits until fewer than its limit are held by all processes. A
+        resource without limit is not waited for.
+
+        :param name: resource name (e.g. 'install')
+        """
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
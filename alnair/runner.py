@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import multiprocessing
+import select
+import signal
+import time
+import traceback
+
+from alnair.lazy import LazyModule
+
+fa = LazyModule('fabric.api')
+
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def _terminated(signum, frame):
+    # unwind the stack of the terminated host, so that the resources held
+    # by it (e.g. the semaphores of :mod:`alnair.resource`) are released
+    raise SystemExit(-signum)
+
+
+def parse_size(value, total):
+    """Parse a size as count or percentage of total
+
+    :param value: string of count (e.g. '10') or percentage (e.g. '25%')
+    :param total: number of all items
+    :returns: int of size
+    """
+    value = str(value).strip()
+    if value.endswith('%'):
+        percent = float(value[:-1])
+        if not 0 <= percent <= 100:
+            raise ValueError(u"percentage must be within 0 to 100, but %s" %
+                    value)
+        return int(total * percent / 100)
+    size = int(value)
+    if size < 0:
+        raise ValueError(u"size must not be negative, but %s" % value)
+    return size
+
+
+class HostResult(object):
+    def __init__(self, host, status, value=None, error=None):
+        """Constructor of HostResult class
+
+        :param host: string of hostname
+        :param status: one of :data:`OK`, :data:`FAILED` or :data:`SKIPPED`
+        :param value: return value of the function applied to host
+        :param error: string of error message if failed
+        """
+        self.host = host
+        self.status = status
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+    def __repr__(self):
+        return '<HostResult %s: %s>' % (self.host, self.status)
+
+
+class Runner(object):
+    # seconds to wait for a child process which has sent its result
+    JOIN_TIMEOUT = 5
+
+    def __init__(self, hosts, batch_size=None, max_failures=None,
+            host_timeout=None, run_timeout=None):
+        """Constructor of Runner class
+
+        :param hosts: list of hostname
+        :param batch_size: number (e.g. '10') or percentage (e.g. '25%') of
+            hosts processed in parallel at a time. If None, hosts are
+            processed one by one, in this process unless any timeout is
+            given.
+        :param max_failures: number or percentage of hosts which may fail
+            before stopping. If None, stop after the window which has any
+            failed host.
+        :param host_timeout: seconds to give up the host
+        :param run_timeout: seconds to give up all hosts which have not been
+            finished
+        """
+        self.hosts = list(hosts)
+        self.host_timeout = host_timeout
+        self.run_timeout = run_timeout
+        self.parallel = batch_size is not None or host_timeout is not None \
+                or run_timeout is not None
+        if batch_size is not None:
+            self.batch_size = max(1, parse_size(batch_size, len(self.hosts)))
+        else:
+            self.batch_size = 1
+        if max_failures is None:
+            self.max_failures = 0
+        else:
+            self.max_failures = parse_size(max_failures, len(self.hosts))
+        self._deadline = None
+
+    def windows(self):
+        """Get windows of hosts
+
+        :returns: list of list of hostname
+        """
+        size = self.batch_size
+        return [self.hosts[i:i + size]
+                for i in xrange(0, len(self.hosts), size)]
+
+    def run(self, func):
+        """Apply the function to each host
+
+        In parallel mode, each host is processed in its own process, so that
+        function should return a picklable value.
+
+        :param func: callable which takes a hostname. fabric's
+            `env.host_string` has been set to the hostname when called.
+        :returns: list of :class:`HostResult` in order of hosts
+        """
+        if self.run_timeout is not None:
+            self._deadline = time.time() + self.run_timeout
+        results = {}
+        failures = 0
+        for window in self.windows():
+            if self.parallel and failures > self.max_failures:
+                for host in window:
+                    results[host] = HostResult(host, SKIPPED)
+                continue
+            if self._deadline is not None and time.time() > self._deadline:
+                for host in window:
+                    results[host] = HostResult(host, SKIPPED,
+                            error=self._run_timeout_message())
+                continue
+            if self.parallel:
+                results.update(self.run_window(func, window))
+            else:
+                for host in window:
+                    fa.env.host_string = host
+                    results[host] = HostResult(host, OK, func(host))
+            failures = sum(1 for r in results.itervalues()
+                    if r.status == FAILED)
+        return [results[host] for host in self.hosts]
+
+    def run_window(self, func, window):
+        """Apply the function to hosts in parallel
+
+        A host which exceeds the host timeout or the run timeout is
+        terminated and marked as failed, without waiting for it.
+
+        :param func: callable which takes a hostname
+        :param window: list of hostname
+        :returns: dict of hostname key and :class:`HostResult` value
+        """
+        jobs = {}
+        for host in window:
+            reader, writer = multiprocessing.Pipe(False)
+            proc = multiprocessing.Process(target=self._child,
+                    args=(func, host, writer))
+            proc.start()
+            writer.close()
+            jobs[host] = (proc, reader)
+        started = time.time()
+        results = {}
+        while jobs:
+            ready = select.select([r for _, r in jobs.itervalues()], [], [],
+                    0.1)[0]
+            now = time.time()
+            for host, (proc, reader) in jobs.items():
+                # check whether alive before polling, the result may be sent
+                # just before exit
+                alive = proc.is_alive()
+                if reader in ready or reader.poll():
+                    try:
+                        results[host] = reader.recv()
+                    except EOFError:
+                        pass
+                elif alive:
+                    error = self._timed_out(started, now)
+                    if error is None:
+                        continue
+                    proc.terminate()
+                    results[host] = HostResult(host, FAILED, error=error)
+                proc.join(self.JOIN_TIMEOUT)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join()
+                reader.close()
+                del jobs[host]
+                if host not in results:
+                    results[host] = HostResult(host, FAILED,
+                            error=u"exited with code %s" % proc.exitcode)
+        return results
+
+    def _timed_out(self, started, now):
+        if self.host_timeout is not None and \
+                now - started > self.host_timeout:
+            return u"timed out after %s seconds" % self.host_timeout
+        if self._deadline is not None and now > self._deadline:
+            return self._run_timeout_message()
+        return None
+
+    def _run_timeout_message(self):
+        return u"run timed out after %s seconds" % self.run_timeout
+
+    def _child(self, func, host, writer):
+        from fabric.network import disconnect_all
+        from fabric.state import connections
+        connections.clear()
+        signal.signal(signal.SIGTERM, _terminated)
+        fa.env.host_string = host
+        try:
+            result = HostResult(host, OK, func(host))
+        except SystemExit as exc:
+            result = HostResult(host, FAILED, error=u"aborted with code %s" %
+                    getattr(exc, 'code', exc))
+        except Exception:
+            result = HostResult(host, FAILED, error=traceback.format_exc())
+        try:
+            writer.send(result)
+        finally:
+            disconnect_all()
+            writer.close()
+
+
+def format_report(results):
+    """Get a report of the results
+
+    :param results: list of :class:`HostResult`
+    :returns: list of strings
+    """
+    lines = []
+    for result in results:
+        line = u"[host:%s] %s" % (result.host, result.status)
+        if result.error:
+            line += u": %s" % result.error.strip().splitlines()[-1]
+        lines.append(line)
+    counts = dict((s, 0) for s in (OK, FAILED, SKIPPED))
+    for result in results:
+        counts[result.status] += 1
+    lines.append(u"%d ok, %d failed, %d skipped" % (counts[OK],
+        counts[FAILED], counts[SKIPPED]))
+    return lines
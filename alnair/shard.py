@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import hashlib
+import json
+import os
+
+from alnair.runner import HostResult
+from alnair.stats import Stats
+
+
+def parse(value):
+    """Parse a shard
+
+    :param value: string of shard 'I/N' (e.g. '2/4'), I is 1 to N
+    :returns: tuple of (I, N)
+    """
+    index, sep, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(u"invalid shard `%s`, must be I/N" % value)
+    if not 1 <= index <= count:
+        raise ValueError(u"shard index must be within 1 to %d, but %d" % (
+            count, index))
+    return index, count
+
+
+def owner(host, count):
+    """Get the shard which owns the host
+
+    The shard is chosen by rendezvous hashing, so that a host is owned by
+    the same shard on any controller, and only the hosts of a removed shard
+    move when the number of shards changes.
+
+    :param host: hostname
+    :param count: number of shards
+    :returns: index of shard, 1 to count
+    """
+    return max(xrange(1, count + 1),
+            key=lambda i: hashlib.md5('%d:%s' % (i, host)).digest())
+
+
+def select(hosts, index, count):
+    """Select the hosts of the shard
+
+    :param hosts: list of hostname
+    :param index: index of shard, 1 to count
+    :param count: number of shards
+    :returns: list of hostname in the same order
+    """
+    return [host for host in hosts if owner(host, count) == index]
+
+
+def write_results(path, results, stats, shard=None):
+    """Write the results of the run for :func:`merge`
+
+    :param path: path of the results file
+    :param results: list of :class:`alnair.runner.HostResult`
+    :param stats: instance of :class:`alnair.stats.Stats`
+    :param shard: string of shard (e.g. '2/4') or None
+    """
+    data = dict(shard=shard, stats=stats.as_dict(), results=[
+        dict(host=r.host, status=r.status, error=r.error) for r in results])
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.rename(path + '.tmp', path)
+
+
+def merge(paths):
+    """Merge the results files of shards
+
+    :param paths: list of path of the results files
+    :returns: tuple of (list of :class:`alnair.runner.HostResult`, instance
+        of :class:`alnair.stats.Stats`, list of missing shards)
+    """
+    results = []
+    stats = Stats()
+    shards = set()
+    count = None
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        results.extend(HostResult(r['host'], r['status'], error=r['error'])
+                for r in data['results'])
+        stats.merge(Stats.from_dict(data['stats']))
+        if data['shard'] is not None:
+            index, count = parse(data['shard'])
+            shards.add(index)
+    missing = []
+    if count is not None:
+        missing = ['%d/%d' % (i, count) for i in xrange(1, count + 1)
+                if i not in shards]
+    return results, stats, missing
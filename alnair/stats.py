@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import time
+
+from contextlib import contextmanager
+
+
+class Stats(object):
+    def __init__(self):
+        """Constructor of Stats class
+        """
+        self._counters = {}
+        self._hosts = {}
+
+    def add(self, name, value=1, host=None):
+        """Add the value to the counter
+
+        :param name: name of counter
+        :param value: value to add
+        :param host: hostname to add the value also to the counter of the
+            host, or None
+        """
+        self._counters[name] = self._counters.get(name, 0) + value
+        if host is not None:
+            counters = self._hosts.setdefault(host, {})
+            counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name, host=None):
+        """Add the seconds elapsed within the context to the counter of
+        `<name>_seconds`
+
+        :param name: name of phase (e.g. 'install')
+        :param host: see also :meth:`add`
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add('%s_seconds' % name, time.time() - start, host)
+
+    def merge(self, other):
+        """Add all counters of other to this
+
+        :param other: instance of :class:`Stats`
+        :returns: self
+        """
+        for name, value in other._counters.iteritems():
+            self.add(name, value)
+        for host, counters in other._hosts.iteritems():
+            mine = self._hosts.setdefault(host, {})
+            for name, value in counters.iteritems():
+                mine[name] = mine.get(name, 0) + value
+        return self
+
+    def as_dict(self):
+        """Get the counters as a serializable dict
+
+        :returns: dict of `counters` and `hosts`
+        """
+        return dict(counters=dict(self._counters), hosts=dict(
+            (host, dict(counters)) for host, counters
+            in self._hosts.iteritems()))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restore the counters
+
+        :param data: dict, see also :meth:`as_dict`
+        :returns: instance of :class:`Stats`
+        """
+        stats = cls()
+        stats._counters.update(data['counters'])
+        for host, counters in data['hosts'].iteritems():
+            stats._hosts[host] = dict(counters)
+        return stats
+
+    @property
+    def hosts(self):
+        return sorted(self._hosts)
+
+    def host(self, host):
+        """Get the counters of the host
+
+        :param host: hostname
+        :returns: list of (name, value) sorted by name
+        """
+        return sorted(self._hosts.get(host, {}).iteritems())
+
+    def summary(self):
+        """Get a summary of the counters
+
+        :returns: list of strings
+        """
+        result = []
+        if self['uploads']:
+            result.append(u"uploaded %d file(s): %d bytes sent for %d bytes"
+                    u" (%d bytes saved)" % (self['uploads'],
+                        self['sent_bytes'], self['upload_bytes'],
+                        self['upload_bytes'] - self['sent_bytes']))
+        if self['artifacts']:
+            result.append(u"uploaded %d package file(s) from the artifact"
+                    u" cache: %d bytes" % (self['artifacts'],
+                        self['artifact_bytes']))
+        if self['unchanged']:
+            result.append(u"%d file(s) unchanged" % self['unchanged'])
+        if self['installed_packages']:
+            result.append(u"%d package(s) already installed" %
+                    self['installed_packages'])
+        if self['guarded_commands']:
+            result.append(u"%d command(s) skipped by guards" %
+                    self['guarded_commands'])
+        if self['completed_steps']:
+            result.append(u"%d step(s) already completed in the resumed run"
+                    % self['completed_steps'])
+        return result
+
+    def __getitem__(self, name):
+        return self._counters.get(name, 0)
+
+    def __iter__(self):
+        return iter(sorted(self._counters.iteritems()))
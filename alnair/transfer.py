@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import hashlib
+import os
+import zlib
+
+from io import BytesIO
+from pipes import quote
+
+from alnair.lazy import LazyModule
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+fa = LazyModule('fabric.api')
+
+DEFAULT_BLOCK_SIZE = 4096
+MAX_BLOCKS = 1024
+
+# a delta that carries more than this ratio of the file is not worth the
+# extra round trips, so the whole file is sent instead
+MAX_DELTA_RATIO = 0.5
+
+REMOTE_MISSING = 3
+
+# files smaller than this are sent as is even if compression is enabled
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+CHECKSUM_SCRIPT = """\
+f=%(path)s; b=%(block_size)d
+[ -f "$f" ] || exit %(missing)d
+n=$(( ($(wc -c < "$f") + b - 1) / b )); i=0
+while [ $i -lt $n ]; do
+    dd if="$f" bs=$b skip=$i count=1 2>/dev/null | md5sum
+    i=$((i + 1))
+done"""
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zstd(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+# list of (name, compress function, remote decompress command) in order of
+# preference
+CODECS = [
+    ('zstd', _zstd, 'zstd -dcq'),
+    ('gzip', _gzip, 'gzip -dc'),
+    ]
+
+
+def to_bytes(contents):
+    if isinstance(contents, unicode):
+        return contents.encode('utf-8')
+    return contents
+
+
+def block_size_for(size, block_size=None):
+    """Get a block size for the file of given size
+
+    :param size: size of the file in bytes
+    :param block_size: preferred block size. If None, block size is chosen
+        so that the file is split into at most :data:`MAX_BLOCKS` blocks.
+    :returns: block size in bytes
+    """
+    if block_size:
+        return block_size
+    return max(DEFAULT_BLOCK_SIZE, -(-size // MAX_BLOCKS))
+
+
+def block_checksums(data, block_size):
+    """Get the md5 hex digests of each block of data
+
+    :param data: string of bytes
+    :param block_size: block size in bytes
+    :returns: list of hex digest strings
+    """
+    return [hashlib.md5(data[i:i + block_size]).hexdigest()
+            for i in xrange(0, len(data), block_size)]
+
+
+def compute_delta(data, block_size, remote_checksums):
+    """Compute the changed blocks of data against the remote checksums
+
+    :param data: string of bytes of the new contents
+    :param block_size: block size in bytes
+    :param remote_checksums: list of hex digests of the remote file blocks
+    :returns: tuple of (runs, literal). `runs` is list of (block index,
+        block count) of the changed blocks and `literal` is the string of
+        bytes of those blocks in order.
+    """
+    runs = []
+    literal = []
+    for i, checksum in enumerate(block_checksums(data, block_size)):
+        if i < len(remote_checksums) and remote_checksums[i] == checksum:
+            continue
+        if runs and sum(runs[-1]) == i:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((i, 1))
+        literal.append(data[i * block_size:(i + 1) * block_size])
+    return runs, ''.join(literal)
+
+
+def patch_script(path, literal_path, block_size, runs, size, checksum):
+    """Get a shell script to patch the remote file by the changed blocks
+
+    The file is patched on a copy, and it is replaced only if the md5 hex
+    digest of the copy equals to checksum. The script fails otherwise.
+
+    :param path: remote path of the target file
+    :param literal_path: remote path of the uploaded changed blocks
+    :param block_size: block size in bytes
+    :param runs: list of (block index, block count), see
+        :func:`compute_delta`
+    :param size: size of the new contents in bytes
+    :param checksum: md5 hex digest of the new contents
+    :returns: string of shell script
+    """
+    steps = ['cp -p "$f" "$t"']
+    offset = 0
+    for index, count in runs:
+        steps.append('dd if="$l" of="$t" bs=%d skip=%d seek=%d count=%d'
+                ' conv=notrunc 2>/dev/null' % (block_size, offset, index,
+                    count))
+        offset += count
+    steps.append('dd if=/dev/null of="$t" bs=1 seek=%d 2>/dev/null' % size)
+    steps.append('[ "$(md5sum < "$t" | cut -d " " -f 1)" = %s ]' % checksum)
+    steps.append('mv "$t" "$f"')
+    return '\n'.join([
+        'f=%s; l=%s' % (quote(path), quote(literal_path)),
+        't=$(mktemp "$f.XXXXXXXXXX") || { rm -f "$l"; exit 1; }',
+        ' && '.join(steps),
+        's=$?; rm -f "$l" "$t"; exit $s',
+        ])
+
+
+def remote_checksums(path, block_size):
+    """Get the block checksums of the remote file
+
+    :param path: remote path of the file
+    :param block_size: block size in bytes
+    :returns: list of hex digests or None if the remote file is missing
+    """
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        result = fa.sudo(CHECKSUM_SCRIPT % dict(path=quote(path),
+            block_size=block_size, missing=REMOTE_MISSING))
+    if result.failed:
+        return None
+    return [line.split()[0] for line in result.splitlines() if line.strip()]
+
+
+def remote_tempfile():
+    """Create a temporary file on the remote host
+
+    :returns: remote path of the file
+    """
+    with fa.settings(fa.hide('everything')):
+        return fa.run('mktemp /tmp/alnair.XXXXXXXXXX').strip()
+
+
+def remote_staging_dir():
+    """Create a staging directory on the remote host
+
+    The directory is owned by the super user.
+
+    :returns: remote path of the directory
+    """
+    with fa.settings(fa.hide('everything')):
+        return fa.sudo('mktemp -d /var/tmp/alnair.XXXXXXXXXX').strip()
+
+
+def copy(source, path):
+    """Copy the remote file on the remote host
+
+    :param source: remote path of the source file
+    :param path: remote path of the file
+    """
+    fa.sudo('cp -- %s %s' % (quote(source), quote(path)))
+
+
+def local_codecs():
+    """Get the names of codecs available on the local host
+
+    :returns: list of codec names in order of preference
+    """
+    return [name for name, _, _ in CODECS if name != 'zstd' or zstandard]
+
+
+def remote_codec():
+    """Get a name of the codec which can be decompressed on the remote host
+
+    :returns: codec name or None if no codec is available
+    """
+    names = local_codecs()
+    with fa.settings(fa.hide('everything'), warn_only=True):
+        result = fa.run('command -v %s' % ' '.join(names))
+    available = set(os.path.basename(line.strip())
+            for line in result.splitlines())
+    for name in names:
+        if name in available:
+            return name
+    return None
+
+
+def compress(data, codec):
+    """Compress the data by codec
+
+    :param data: string of bytes
+    :param codec: codec name, see also :data:`CODECS`
+    :returns: string of compressed bytes
+    """
+    for name, func, _ in CODECS:
+        if name == codec:
+            return func(data)
+    raise ValueError(u"unknown codec `%s`" % codec)
+
+
+def upload(data, path, codec=None, use_sudo=True):
+    """Upload the data to the remote path
+
+    If codec is given, the data is compressed and then decompressed on the
+    remote host. The data is sent as is if it is not made smaller.
+
+    :param data: string of bytes
+    :param path: remote path of the file
+    :param codec: codec name or None
+    :param use_sudo: put the file under the super user privileges if True
+    :returns: number of bytes sent
+    """
+    compressed = None if codec is None else compress(data, codec)
+    if compressed is None or len(compressed) >= len(data):
+        fa.put(BytesIO(data), path, use_sudo=use_sudo)
+        return len(data)
+    tmppath = remote_tempfile()
+    fa.put(BytesIO(compressed), tmppath)
+    decompress = dict((name, cmd) for name, _, cmd in CODECS)[codec]
+    (fa.sudo if use_sudo else fa.run)(decompress_script(path, tmppath,
+        decompress))
+    return len(compressed)
+
+
+def decompress_script(path, compressed_path, decompress):
+    """Get a shell script to decompress the uploaded file to the remote path
+
+    The file is decompressed to a temporary file next to the remote path and
+    replaced only if succeeded. The script fails otherwise.
+
+    :param path: remote path of the target file
+    :param compressed_path: remote path of the uploaded compressed file
+    :param decompress: command to decompress the file to stdout
+    :returns: string of shell script
+    """
+    return '\n'.join([
+        'f=%s; z=%s' % (quote(path), quote(compressed_path)),
+        't=$(mktemp "$f.XXXXXXXXXX") || { rm -f "$z"; exit 1; }',
+        # mktemp creates the file with 0600
+        'chmod 644 "$t" && %s "$z" > "$t" && mv "$t" "$f"' % decompress,
+        's=$?; rm -f "$z" "$t"; exit $s',
+        ])
+
+
+def put(contents, path, codec=None):
+    """Put the whole contents to the remote path
+
+    :param contents: string of contents
+    :param path: remote path of the file
+    :param codec: codec name to compress the upload stream or None
+    :returns: number of bytes sent
+    """
+    return upload(to_bytes(contents), path, codec)
+
+
+def put_delta(contents, path, block_size=None, codec=None):
+    """Put the contents to the remote path by sending the changed blocks only
+
+    The whole contents will be sent if the remote file is missing, most of
+    blocks are changed or the patched file does not match the contents.
+
+    :param contents: string of contents
+    :param path: remote path of the file
+    :param block_size: block size in bytes. see also :func:`block_size_for`
+    :param codec: codec name to compress the upload stream or None
+    :returns: tuple of (number of bytes sent, whether the remote file has
+        been changed). No bytes are sent if the file is only truncated.
+    """
+    data = to_bytes(contents)
+    block_size = block_size_for(len(data), block_size)
+    checksums = remote_checksums(path, block_size)
+    if checksums is not None:
+        runs, literal = compute_delta(data, block_size, checksums)
+        if not runs and len(checksums) == -(-len(data) // block_size):
+            return 0, False
+        if len(literal) <= len(data) * MAX_DELTA_RATIO:
+            literal_path = remote_tempfile()
+            sent = upload(literal, literal_path, codec, use_sudo=False)
+            with fa.settings(warn_only=True):
+                result = fa.sudo(patch_script(path, literal_path, block_size,
+                    runs, len(data), hashlib.md5(data).hexdigest()))
+            if not result.failed:
+                return sent, True
+            # the remote file has been changed meanwhile or could not be
+            # patched, send the whole contents instead
+            return sent + upload(data, path, codec), True
+    return upload(data, path, codec), True
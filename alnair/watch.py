@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Naoya Inada <naoina@kuune.org>
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+__author__ = "Naoya Inada <naoina@kuune.org>"
+
+__all__ = [
+]
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+import traceback
+
+import alnair
+
+from alnair.distribution import Distribution
+from alnair.lazy import LazyModule
+from alnair.package import Setup, guards_of
+
+fa = LazyModule('fabric.api')
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# seconds to wait for the following events after the first one, to handle
+# the save of an editor at a time
+SETTLE_TIME = 0.1
+
+
+def _inotify(directory):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO |
+            IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Watcher(object):
+    def __init__(self, directory, interval=1.0, use_inotify=True):
+        """Constructor of Watcher class
+
+        The changes are detected by inotify if available, otherwise by
+        polling the modified time of files.
+
+        :param directory: path of directory to watch
+        :param interval: seconds of the polling interval
+        :param use_inotify: never use inotify if False
+        """
+        self.directory = directory
+        self.interval = interval
+        self._fd = _inotify(directory) if use_inotify else None
+        self._stats = self._scan()
+
+    @property
+    def polling(self):
+        return self._fd is None
+
+    def _scan(self):
+        result = {}
+        for name in os.listdir(self.directory):
+            if name.endswith('.py'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result[path] = (st.st_mtime, st.st_size)
+        return result
+
+    def wait(self, timeout=None):
+        """Wait for the recipe files to be changed
+
+        :param timeout: seconds to wait or None to wait forever
+        :returns: sorted list of path of changed recipe files. Empty if timed
+            out.
+        """
+        if self.polling:
+            return self._poll(timeout)
+        changed = set()
+        while True:
+            try:
+                ready = select.select([self._fd], [], [],
+                        SETTLE_TIME if changed else timeout)[0]
+            except select.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                break
+            changed.update(self._read_events())
+        self._stats = self._scan()
+        return sorted(changed)
+
+    def _read_events(self):
+        data = os.read(self._fd, 64 * 1024)
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+            if name.endswith('.py'):
+                yield os.path.join(self.directory, name)
+
+    def _poll(self, timeout):
+        started = time.time()
+        while True:
+            stats = self._scan()
+            changed = [path for path, stat in stats.iteritems()
+                    if self._stats.get(path) != stat]
+            self._stats = stats
+            if changed:
+                return sorted(changed)
+            if timeout is not None and time.time() - started >= timeout:
+                return []
+            time.sleep(self.interval)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def snapshot(setup):
+    """Get a snapshot of the configs and commands of setup
+
+    :param setup: instance of :class:`alnair.package.Setup`
+    :returns: tuple of (dict of (hostname, filename) key and tuple of
+        contents, commands and delta value, tuple of commands)
+    """
+    def commands(obj):
+        return tuple((command[0], command[1].__name__, guards_of(command))
+                for command in obj._commands)
+    configs = dict((key, (config._contents, commands(config), config._delta))
+            for key, config in setup.config_all.iteritems())
+    return configs, commands(setup)
+
+
+def diff(old, new):
+    """Get the keys of configs which are added or changed
+
+    :param old: snapshot, see also :func:`snapshot`
+    :param new: snapshot
+    :returns: tuple of (sorted list of (hostname, filename), True if the
+        commands of setup are changed)
+    """
+    keys = sorted((key for key, value in new[0].iteritems()
+            if old[0].get(key) != value), key=lambda k: (k[0] or '', k[1]))
+    return keys, old[1] != new[1]
+
+
+class Watch(object):
+    def __init__(self, distname, packages, hosts=None, dry_run=False):
+        """Constructor of Watch class
+
+        :param distname: distribution name (e.g. 'archlinux')
+        :param packages: list of package name to watch
+        :param hosts: list of hostname to apply. If None, fabric's default.
+        :param dry_run: testing for running commands if True
+        """
+        self.dist = Distribution(distname, dry_run=dry_run)
+        self.packages = list(packages)
+        self.hosts = hosts
+        self._snapshots = {}
+
+    @property
+    def directory(self):
+        return os.path.join(self.dist.CONFIG_DIR, self.dist.name)
+
+    def start(self):
+        """Load all packages and take their snapshots
+        """
+        for name in self.packages:
+            self._snapshots[name] = snapshot(
+                    self.dist.get_package(name).setup)
+        self._snapshots[None] = snapshot(alnair.setup)
+
+    def changed(self, paths):
+        """Reload the changed recipes and apply their changes
+
+        :param paths: list of path of changed recipe files
+        :returns: list of (package name, list of (hostname, filename)) which
+            have been applied. The package name is None for the system wide
+            settings.
+        """
+        applied = []
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name not in self.packages:
+                continue
+            try:
+                pkg = self.dist.get_package(name)
+            except Exception:
+                # keep watching until the recipe is fixed
+                print traceback.format_exc().rstrip()
+                continue
+            for key, setup in ((None, alnair.setup), (name, pkg.setup)):
+                new = snapshot(setup)
+                keys, commands = diff(self._snapshots[key], new)
+                if keys or commands:
+                    self.apply(setup, keys, commands)
+                    applied.append((key, keys))
+                # taken after applied, to apply again if it has failed
+                self._snapshots[key] = new
+        return applied
+
+    def apply(self, setup, keys, commands=False):
+        """Put the configs of given keys on to the hosts
+
+        :param setup: instance of :class:`alnair.package.Setup`
+        :param keys: list of (hostname, filename)
+        :param commands: also execute the commands of setup if True
+        """
+        partial = Setup(setup._host)
+        partial._config = dict((key, setup.config_all[key]) for key in keys)
+        for host in self.hosts or [None]:
+            if host is not None:
+                fa.env.host_string = host
+            self.dist.clear_guards()
+            if commands and self.dist.exec_commands(setup):
+                self.dist.notify(setup)
+            self.dist._exec_configs(partial)
+            self.dist.run_handlers([alnair.setup, setup])
+
+    def run(self, interval=1.0):
+        """Watch the recipes and apply the changes until interrupted
+
+        :param interval: seconds of the polling interval if inotify is not
+            available
+        """
+        watcher = Watcher(self.directory, interval)
+        try:
+            while True:
+                paths = watcher.wait()
+                try:
+                    applied = self.changed(paths)
+                except SystemExit:
+                    # aborted by fabric, the error has been printed
+                    continue
+                for name, keys in applied:
+                    print u"applied %s: %d config(s)" % (name or u"system"
+                            u" wide settings", len(keys))
+        finally:
+            watcher.close()
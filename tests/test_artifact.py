@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import json
+import os
+
+import mock
+import pytest
+
+from alnair import artifact
+from alnair.artifact import ArtifactCache
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ArtifactCache(str(tmpdir.join('artifacts')))
+
+
+def fake_get(files):
+    def get(remote_path, local_path, use_sudo=False):
+        paths = []
+        for name in files:
+            path = os.path.join(local_path, name)
+            with open(path, 'wb') as f:
+                f.write(name)
+            paths.append(path)
+        return paths
+    return get
+
+
+def test_download(tmpdir):
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            get=mock.DEFAULT) as mock_fa:
+        mock_fa['sudo'].return_value = '/var/tmp/stage\n'
+        mock_fa['get'].side_effect = fake_get(['b.deb', 'a.deb'])
+        files = artifact.download(['a', 'b'], 'apt-get download',
+                str(tmpdir))
+    assert files == ['a.deb', 'b.deb']
+    assert mock_fa['sudo'].call_args_list == [
+            mock.call('mktemp -d /var/tmp/alnair.XXXXXXXXXX'),
+            mock.call('apt-get download a b'),
+            mock.call('rm -rf -- /var/tmp/stage')]
+    assert mock_fa['get'].call_args == mock.call('/var/tmp/stage/*',
+            str(tmpdir), use_sudo=True)
+
+
+def fake_download(names, command, directory):
+    return fake_get(['%s.deb' % n for n in names] + ['dep.deb'])(None,
+            directory)
+
+
+class TestArtifactCache(object):
+    def test_fetch(self, cache):
+        with mock.patch('alnair.artifact.download',
+                side_effect=fake_download) as mock_download:
+            paths = cache.fetch('debian', ['nginx', 'curl'],
+                    'apt-get download')
+            assert mock_download.call_args_list == [
+                    mock.call(['nginx'], 'apt-get download', mock.ANY),
+                    mock.call(['curl'], 'apt-get download', mock.ANY)]
+            directory = cache.path('debian')
+            assert paths == [os.path.join(directory, name) for name in
+                    ['curl.deb', 'dep.deb', 'nginx.deb']]
+            assert cache.fetch('debian', ['curl'], 'apt-get download') == [
+                    os.path.join(directory, name) for name in
+                    ['curl.deb', 'dep.deb']]
+            assert mock_download.call_count == 2
+            os.remove(os.path.join(directory, 'nginx.deb'))
+            cache.fetch('debian', ['nginx', 'vim'], 'apt-get download')
+        assert [c[0][0] for c in mock_download.call_args_list[2:]] == [
+                ['nginx'], ['vim']]
+        with open(os.path.join(directory, artifact.MANIFEST)) as f:
+            assert sorted(json.load(f)) == ['curl', 'nginx', 'vim']
+
+    def test_fetch_with_expired_files(self, tmpdir):
+        cache = ArtifactCache(str(tmpdir.join('artifacts')), ttl=60)
+        with mock.patch('alnair.artifact.download',
+                side_effect=fake_download) as mock_download:
+            cache.fetch('debian', ['nginx'], 'apt-get download')
+            manifest = cache.load('debian')
+            manifest['nginx']['files'].append('nginx-old.deb')
+            manifest['nginx']['downloaded'] -= 61
+            cache.save('debian', manifest)
+            tmpdir.join('artifacts', 'debian', 'nginx-old.deb').write('')
+            paths = cache.fetch('debian', ['nginx'], 'apt-get download')
+        assert mock_download.call_count == 2
+        assert [os.path.basename(p) for p in paths] == ['dep.deb',
+                'nginx.deb']
+        assert not tmpdir.join('artifacts', 'debian', 'nginx-old.deb').check()
+
+    def test_fetch_without_files(self, cache):
+        with contextlib.nested(
+                mock.patch('alnair.artifact.download', return_value=[]),
+                mock.patch('fabric.api.abort', side_effect=SystemExit(1)),
+                ) as (mock_download, mock_abort):
+            with pytest.raises(SystemExit):
+                cache.fetch('debian', ['nosuch'], 'apt-get download')
+        assert mock_abort.call_args == mock.call(
+                u"no package files of `nosuch` have been downloaded")
+        assert cache.load('debian') == {}
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import contextlib
+import json
 import os
+import subprocess
 import sys
+import time
 
 import mock
 import pytest
@@ -344,3 +348,761 @@ def test_config_with_multiple_host_given(distname, package, hosts):
             assert called_hosts == hosts
         finally:
             _AttributeDict.__setattr__ = orig_setattr
+
+
+@pytest.mark.parametrize(('subcmd', 'opts', 'expected'), [
+    ('setup', [], None),
+    ('setup', ['--compress'], 1024),
+    ('setup', ['--compress-min-size', '10'], 10),
+    ('config', [], None),
+    ('config', ['--compress'], 1024),
+    ('config', ['--compress-min-size', '10'], 10),
+    ])
+def test_compress(subcmd, opts, expected):
+    sys.argv = ['alnair', subcmd] + opts + ['distname', 'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.compress = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+        assert mock_inst.compress == expected
+
+
+@pytest.mark.parametrize(('opts', 'expected'), [
+    ([], None),
+    (['--facts-ttl', '60'], 60),
+    ])
+def test_facts_ttl(opts, expected):
+    sys.argv = ['alnair', 'config'] + opts + ['distname', 'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.facts_cache = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    if expected is None:
+        assert mock_inst.facts_cache is None
+    else:
+        assert mock_inst.facts_cache.ttl == expected
+
+
+def test_resume(tmpdir):
+    from alnair import Distribution
+    from alnair.journal import Journal
+    Journal('run1', str(tmpdir)).record('host1', 'install:package')
+    sys.argv = ['alnair', 'setup', '--host', 'host1', '--resume', 'run1',
+            'distname', 'package']
+    with contextlib.nested(
+            mock.patch('alnair.journal.DEFAULT_JOURNAL_DIR', str(tmpdir)),
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('sys.stdout'),
+            ) as (_, mock_dist, mock_stdout):
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.journal = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    assert mock_inst.journal.run_id == 'run1'
+    assert mock_inst.journal.completed('host1', 'install:package')
+    assert mock.call(u"run id: run1") in mock_stdout.write.call_args_list
+
+
+def test_resume_without_journal(tmpdir):
+    sys.argv = ['alnair', 'setup', '--host', 'host1', '--resume', 'run1',
+            'distname', 'package']
+    with contextlib.nested(
+            mock.patch('alnair.journal.DEFAULT_JOURNAL_DIR', str(tmpdir)),
+            mock.patch('sys.stderr'),
+            ) as (_, mock_stderr):
+        from alnair.command import main
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+    assert exc_info.value.code == 1
+    assert mock_stderr.write.call_args[0][0].startswith(
+            u"alnair: error: cannot resume the run `run1`: ")
+
+
+def test_events(tmpdir):
+    path = tmpdir.join('events.jsonl')
+    sys.argv = ['alnair', 'setup', '--events', str(path), 'distname',
+            'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.events = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    assert mock_inst.events.fd > 2
+    event = json.loads(path.read())
+    assert (event['operation'], event['method'], event['outcome']) == (
+            'run', 'setup', 'applied')
+
+
+def test_events_with_invalid_target():
+    sys.argv = ['alnair', 'setup', '--events', 'fd:x', 'distname', 'package']
+    from alnair.command import main
+    with contextlib.nested(
+            pytest.raises(SystemExit),
+            mock.patch('sys.stderr'),
+            ) as (exc_info, mock_stderr):
+        main()
+    assert exc_info.value.code == 1
+    assert mock_stderr.write.call_args[0][0].startswith(
+            u"alnair: error: cannot open the event stream `fd:x`: ")
+
+
+def test_metrics(tmpdir):
+    path = tmpdir.join('alnair.prom')
+    sys.argv = ['alnair', 'setup', '--host', 'host1', '--metrics-file',
+            str(path), '--statsd', ':8125', 'distname', 'package']
+    from alnair import Distribution
+    from alnair.stats import Stats
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('alnair.metrics.send_statsd'),
+            ) as (mock_dist, mock_send_statsd):
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.stats = Stats()
+        mock_inst.stats.add('uploads', 1, 'host1')
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    text = path.read()
+    assert 'alnair_run_hosts 1\n' in text
+    assert 'alnair_run_failed_hosts 0\n' in text
+    assert 'alnair_uploads_total{host="host1"} 1\n' in text
+    assert mock_send_statsd.call_args[0][0] == ('localhost', 8125)
+    assert 'alnair.host.host1.uploads:1|c' in mock_send_statsd.call_args[0][1]
+
+
+@pytest.mark.parametrize(('value',), [('localhost',), ('host:port',)])
+def test_statsd_with_invalid_address(value):
+    sys.argv = ['alnair', 'setup', '--statsd', value, 'distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+@pytest.mark.parametrize(('opts', 'expected', 'ttl'), [
+    ([], None, None),
+    (['--artifacts'], os.path.expanduser('~/.cache/alnair/artifacts'),
+        86400),
+    (['--artifact-dir', '/tmp/artifacts', '--artifact-ttl', '0'],
+        '/tmp/artifacts', 0),
+    ])
+def test_artifacts(opts, expected, ttl):
+    sys.argv = ['alnair', 'setup'] + opts + ['distname', 'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.artifacts = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    if expected is None:
+        assert mock_inst.artifacts is None
+    else:
+        assert mock_inst.artifacts.directory == expected
+        assert mock_inst.artifacts.ttl == ttl
+
+
+@pytest.mark.parametrize(('opts', 'expected'), [
+    ([], None),
+    (['--load-jobs', '4'], 4),
+    ])
+def test_load_jobs(opts, expected):
+    sys.argv = ['alnair', 'setup'] + opts + ['distname', 'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.processes = None
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    assert mock_inst.processes == expected
+
+
+@pytest.mark.parametrize(('value',), [('0',), ('x',)])
+def test_load_jobs_with_invalid_value(value):
+    sys.argv = ['alnair', 'setup', '--load-jobs', value, 'distname',
+            'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+@pytest.mark.parametrize(('subcmd', 'opts', 'batch_size', 'max_failures'), [
+    ('setup', ['--batch-size', '2'], 2, 0),
+    ('config', ['--batch-size', '50%', '--max-failures', '1'], 1, 1),
+    ('setup', ['--max-failures', '1'], 1, 1),
+    ])
+def test_batch_size(subcmd, opts, batch_size, max_failures):
+    sys.argv = ['alnair', subcmd, '--host', 'host1,host2'] + opts + [
+        'distname', 'package']
+    from alnair import Distribution
+    from alnair.runner import HostResult, OK
+    from alnair.stats import Stats
+    runners = []
+
+    def run(self, func):
+        runners.append(self)
+        return [HostResult(host, OK, func(host)) for host in self.hosts]
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('alnair.runner.Runner.run', run),
+            ) as (mock_dist, _):
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.stats = Stats()
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    assert mock_dist.call_args_list == [mock.call('distname')] * 2
+    assert getattr(mock_inst, subcmd).call_args_list == \
+            [mock.call(['package'], dry_run=False)] * 2
+    assert runners[0].hosts == ['host1', 'host2']
+    assert runners[0].parallel is True
+    assert runners[0].batch_size == batch_size
+    assert runners[0].max_failures == max_failures
+
+
+def test_batch_size_with_failure():
+    sys.argv = ['alnair', 'setup', '--host', 'host1,host2', '--batch-size',
+            '1', 'distname', 'package']
+    from alnair.runner import HostResult, FAILED, OK
+
+    def run(self, func):
+        return [HostResult('host1', OK), HostResult('host2', FAILED)]
+    with mock.patch('alnair.runner.Runner.run', run):
+        from alnair.command import main
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+        assert exc_info.value.code == 1
+
+
+@pytest.mark.parametrize(('opts', 'expected'), [
+    (['--shard', '1/1'], ['host1', 'host2', 'host3', 'host4']),
+    (['--shard', '1/2'], ['host2', 'host3', 'host4']),
+    (['--shard', '2/2'], ['host1']),
+    ])
+def test_shard(opts, expected):
+    sys.argv = ['alnair', 'setup', '--host', 'host1,host2,host3,host4'] + \
+            opts + ['distname', 'package']
+    from alnair import Distribution
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('fabric.api.env'),
+            ) as (mock_dist, mock_env):
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        hosts = []
+        mock_inst.setup.side_effect = lambda *args, **kwargs: hosts.append(
+                mock_env.host_string)
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        main()
+    assert hosts == expected
+
+
+@pytest.mark.parametrize(('opts', 'expected'), [
+    ([], None),
+    (['--limit', 'install=20', '--limit', 'database=1'],
+        dict(install=20, database=1)),
+    ])
+def test_limits(opts, expected):
+    sys.argv = ['alnair', 'setup', '--host', 'host1,host2', '--batch-size',
+            '2'] + opts + ['distname', 'package']
+    from alnair.resource import Limits
+    from alnair.runner import OK, HostResult
+    limits = []
+
+    def run(self, func):
+        from alnair import Distribution
+        with mock.patch('alnair.command.Distribution', spec=Distribution) \
+                as mock_dist:
+            mock_inst = mock.MagicMock(spec=Distribution)
+            mock_inst.__enter__.return_value = mock_inst
+            mock_inst.limits = None
+            mock_inst.stats = None
+            mock_dist.return_value = mock_inst
+            func('host1')
+        limits.append(mock_inst.limits)
+        return [HostResult('host1', OK), HostResult('host2', OK)]
+    with mock.patch('alnair.runner.Runner.run', run):
+        from alnair.command import main
+        main()
+    if expected is None:
+        assert limits == [None]
+    else:
+        assert isinstance(limits[0], Limits)
+        assert dict((name, limits[0][name]) for name in expected) == \
+                expected
+
+
+@pytest.mark.parametrize(('value',), [('install',), ('install=0',),
+    ('install=x',)])
+def test_limits_with_invalid_value(value):
+    sys.argv = ['alnair', 'setup', '--limit', value, 'distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+@pytest.mark.parametrize(('opts',), [
+    (['--shard', '1'],),
+    (['--shard', '0/2'],),
+    (['--shard', '3/2'],),
+    (['--shard', 'a/b'],),
+    ])
+def test_shard_with_invalid_value(opts):
+    sys.argv = ['alnair', 'setup'] + opts + ['distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+def test_shard_without_host():
+    sys.argv = ['alnair', 'setup', '--shard', '1/2', 'distname', 'package']
+    from alnair.command import main
+    with mock.patch('sys.stderr') as mock_stderr:
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+    assert exc_info.value.code == 1
+    assert mock_stderr.write.call_args_list[0] == mock.call(
+            u"alnair: error: --shard requires --host or --inventory\n")
+
+
+def test_results_and_merge(tmpdir, capsys):
+    from alnair import Distribution
+    from alnair.command import main
+    from alnair.stats import Stats
+    paths = []
+    for shard, error in (('1/2', None), ('2/2', Exception('failed'))):
+        path = tmpdir.join(shard.replace('/', '-') + '.json')
+        paths.append(str(path))
+        sys.argv = ['alnair', 'setup', '--host',
+                'host1,host2,host3,host4,host5', '--shard', shard, '--results', str(path), 'distname',
+                'package']
+        with mock.patch('alnair.command.Distribution', spec=Distribution) \
+                as mock_dist:
+            mock_inst = mock.MagicMock(spec=Distribution)
+            mock_inst.__enter__.return_value = mock_inst
+            mock_inst.stats = Stats()
+            mock_inst.stats.add('uploads', 1)
+            mock_inst.setup.side_effect = error
+            mock_dist.return_value = mock_inst
+            try:
+                main()
+            except Exception:
+                pass
+    assert json.loads(tmpdir.join('2-2.json').read())['results'] == [
+            dict(host='host1', status='failed',
+                error=u"the run stopped at this host"),
+            dict(host='host5', status='skipped',
+                error=u"not applied since the run stopped")]
+    capsys.readouterr()
+    sys.argv = ['alnair', 'merge'] + paths
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 1
+    out, err = capsys.readouterr()
+    assert u"3 ok, 1 failed, 1 skipped" in out
+    assert u"uploaded 2 file(s)" in out
+    assert u"1 host(s) failed: host1" in err
+
+
+def test_results_with_failed_after_setup(tmpdir):
+    from alnair import Distribution
+    from alnair.command import main
+    from alnair.stats import Stats
+    path = tmpdir.join('results.json')
+    sys.argv = ['alnair', 'setup', '--host', 'host1,host2', '--results',
+            str(path), 'distname', 'package']
+    with mock.patch('alnair.command.Distribution', spec=Distribution) \
+            as mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        # after_setup of the last host runs when the distribution exits
+        mock_inst.__exit__.side_effect = Exception('failed')
+        mock_inst.stats = Stats()
+        mock_dist.return_value = mock_inst
+        with pytest.raises(Exception):
+            main()
+    assert json.loads(path.read())['results'] == [
+            dict(host='host1', status='skipped',
+                error=u"not applied since the run stopped"),
+            dict(host='host2', status='failed',
+                error=u"the run stopped at this host")]
+
+
+def test_merge_with_missing_shard(tmpdir, capsys):
+    from alnair.runner import OK, HostResult
+    from alnair.shard import write_results
+    from alnair.stats import Stats
+    path = tmpdir.join('1-3.json')
+    write_results(str(path), [HostResult('host2', OK)], Stats(), '1/3')
+    sys.argv = ['alnair', 'merge', str(path)]
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 1
+    assert u"missing shard(s): 2/3, 3/3" in capsys.readouterr()[1]
+
+
+@pytest.mark.parametrize(('opts',), [
+    (['--host', 'host1', '--batch-size', 'x'],),
+    (['--batch-size', 'x'],),
+    (['--batch-size', '101%'],),
+    (['--max-failures', '-1'],),
+    (['--host', 'host1', '--max-failures', 'x%'],),
+    ])
+def test_batch_size_with_invalid_size(opts):
+    sys.argv = ['alnair', 'setup'] + opts + ['distname', 'package']
+    from alnair import Distribution
+    from alnair.command import main
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('sys.stderr')) as (mock_dist, mock_stderr):
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+        assert exc_info.value.code == 2
+        assert mock_dist.call_count == 0
+        message = ''.join(c[0][0] for c in mock_stderr.write.call_args_list)
+        assert 'argument --%s: invalid size' % opts[-2].lstrip('-') in message
+
+
+@pytest.mark.parametrize(('opts', 'expected', 'runner_args'), [
+    (['--timeout', 'install=10'], {'install': 10}, ('1', '100%', None, None)),
+    (['--timeout', 'host=60', '--max-failures', '1'], {},
+        ('1', '1', 60, None)),
+    (['--timeout', 'put=1.5', '--timeout', 'host=60', '--timeout', 'run=600',
+        '--batch-size', '2'], {'put': 1.5}, ('2', None, 60, 600)),
+    ])
+def test_timeout(opts, expected, runner_args):
+    sys.argv = ['alnair', 'setup', '--host', 'host1'] + opts + [
+        'distname', 'package']
+    from alnair import Distribution
+    from alnair.runner import HostResult, OK
+    from alnair.stats import Stats
+    runners = []
+
+    def run(self, func):
+        return [HostResult(host, OK, func(host)) for host in self.hosts]
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('alnair.runner.Runner.__init__', return_value=None),
+            mock.patch('alnair.runner.Runner.run', run),
+            ) as (mock_dist, mock_runner_init, _):
+        mock_dist.TIMEOUTS = Distribution.TIMEOUTS
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.stats = Stats()
+        mock_dist.return_value = mock_inst
+        from alnair.runner import Runner
+        Runner.hosts = ['host1']
+        try:
+            from alnair.command import main
+            main()
+        finally:
+            del Runner.hosts
+    assert mock_inst.timeouts == expected
+    assert mock_runner_init.call_args == mock.call(['host1'], *runner_args)
+
+
+@pytest.mark.parametrize(('opts',), [
+    (['--timeout', 'host=0.05'],),
+    (['--timeout', 'run=0.05', '--timeout', 'host=60'],),
+    ])
+def test_timeout_without_host(opts):
+    sys.argv = ['alnair', 'setup'] + opts + ['distname', 'package']
+    from alnair import Distribution
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('sys.stderr'),
+            ) as (mock_dist, mock_stderr):
+        mock_dist.TIMEOUTS = Distribution.TIMEOUTS
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.setup.side_effect = lambda *args, **kwargs: time.sleep(1)
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+    assert exc_info.value.code == 1
+    assert mock_stderr.write.call_args == mock.call(
+            'alnair: error: %s timed out after 0.05 seconds\n' %
+            opts[1].split('=')[0])
+
+
+def test_timeout_with_deadline_exceeded():
+    sys.argv = ['alnair', 'setup', '--timeout', 'put=1', 'distname',
+            'package']
+    from alnair import DeadlineExceededError, Distribution
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution),
+            mock.patch('sys.stderr'),
+            ) as (mock_dist, mock_stderr):
+        mock_dist.TIMEOUTS = Distribution.TIMEOUTS
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_inst.setup.side_effect = DeadlineExceededError(
+                u"put timed out after 1 seconds")
+        mock_dist.return_value = mock_inst
+        from alnair.command import main
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+    assert exc_info.value.code == 1
+    assert mock_stderr.write.call_args == mock.call(
+            'alnair: error: put timed out after 1 seconds\n')
+
+
+@pytest.mark.parametrize(('value',), [
+    ('unknown=1',), ('put',), ('put=a',), ('put=0',), ('put=-1',),
+    ])
+def test_timeout_with_invalid_value(value):
+    sys.argv = ['alnair', 'setup', '--timeout', value, 'distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+@pytest.mark.parametrize(('opts', 'expected'), [
+    ([], ['db1', 'web01', 'web02', 'web03']),
+    (['--host', 'web0[2-3]'], ['web02', 'web03']),
+    (['--host', 'web*,db1'], ['db1', 'web01', 'web02', 'web03']),
+    (['--group', 'db'], ['db1']),
+    (['--group', 'web', '--host', '*1'], ['web01']),
+    ])
+def test_inventory(tmpdir, opts, expected):
+    path = tmpdir.join('inventory')
+    path.write('[db]\ndb1\n[web]\nweb[01-03]\n')
+    sys.argv = ['alnair', 'config', '-i', str(path)] + opts + ['distname',
+            'package']
+    from alnair import Distribution
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        mock_inst = mock.MagicMock(spec=Distribution)
+        mock_inst.__enter__.return_value = mock_inst
+        mock_dist.return_value = mock_inst
+        from fabric.state import _AttributeDict
+        called_hosts = []
+        orig_setattr = _AttributeDict.__setattr__
+        _AttributeDict.__setattr__ = lambda self, n, v: called_hosts.append(v)
+        from alnair.command import main
+        try:
+            main()
+        finally:
+            _AttributeDict.__setattr__ = orig_setattr
+    assert called_hosts == expected
+
+
+INVENTORY_WITH_DISTRIBUTIONS = """\
+db1 distribution=archlinux
+web1
+web2 distribution=debian
+web3 distribution=archlinux
+"""
+
+
+@pytest.mark.parametrize(('opts',), [([],), (['--batch-size', '2'],)])
+def test_inventory_with_distributions(tmpdir, opts):
+    path = tmpdir.join('inventory')
+    path.write(INVENTORY_WITH_DISTRIBUTIONS)
+    sys.argv = ['alnair', 'setup', '-i', str(path)] + opts + ['distname',
+            'package']
+    from alnair import Distribution
+    from alnair.runner import HostResult, OK
+    from alnair.stats import Stats
+    applied = []
+    insts = {}
+
+    def create(name):
+        inst = insts.get(name)
+        if inst is None:
+            import fabric.api as fa
+            inst = insts[name] = mock.MagicMock(spec=Distribution)
+            inst.__enter__.return_value = inst
+            inst.stats = Stats()
+            inst.stats.add('unchanged')
+            inst.setup.side_effect = lambda *args, **kwargs: applied.append(
+                    (name, fa.env.host_string))
+        return inst
+
+    def run(self, func):
+        import fabric.api as fa
+        results = []
+        for host in self.hosts:
+            fa.env.host_string = host
+            results.append(HostResult(host, OK, func(host)))
+        return results
+    with contextlib.nested(
+            mock.patch('alnair.command.Distribution', spec=Distribution,
+                side_effect=create),
+            mock.patch('alnair.runner.Runner.run', run),
+            mock.patch('sys.stdout'),
+            ) as (mock_dist, _, mock_stdout):
+        from alnair.command import main
+        main()
+    assert sorted(applied) == [('archlinux', 'db1'), ('archlinux', 'web3'),
+            ('debian', 'web2'), ('distname', 'web1')]
+    if not opts:
+        # grouped by distribution in order of appearance
+        assert applied == [('archlinux', 'db1'), ('archlinux', 'web3'),
+                ('distname', 'web1'), ('debian', 'web2')]
+        assert [c[0][0] for c in mock_dist.call_args_list] == [
+                'archlinux', 'distname', 'debian']
+    else:
+        assert sorted(c[0][0] for c in
+                mock_dist.compile_recipes.call_args_list) == [
+                        'archlinux', 'debian', 'distname']
+    output = ''.join(c[0][0] for c in mock_stdout.write.call_args_list)
+    # merged into one summary, from each distribution or from each host
+    assert (u"%d file(s) unchanged" % (4 if opts else 3)) in output
+
+
+@pytest.mark.parametrize(('opts',), [
+    (['--group', 'web'],),
+    (['-i', '/path/to/nosuch/inventory'],),
+    (['-i', '%(inventory)s', '--host', 'nosuchhost'],),
+    (['-i', '%(inventory)s', '--host', 'web1,wbe2'],),
+    ])
+def test_inventory_with_error(tmpdir, opts):
+    path = tmpdir.join('inventory')
+    path.write('web1\n')
+    sys.argv = ['alnair', 'setup'] + [o % dict(inventory=path) for o in opts] \
+            + ['distname', 'package']
+    from alnair import Distribution
+    from alnair.command import main
+    with mock.patch('alnair.command.Distribution', spec=Distribution) as \
+            mock_dist:
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+    assert exc_info.value.code == 1
+    assert mock_dist.call_count == 0
+
+
+@pytest.mark.parametrize(('code',), [(0,), (3,)])
+def test_daemon_client(code):
+    sys.argv = ['alnair', '--daemon', '/path/to/sock', 'config', '--host',
+            'host1', 'distname', 'package']
+    with mock.patch('alnair.daemon.request', return_value=code) as \
+            mock_request:
+        from alnair.command import main
+        if code:
+            with pytest.raises(SystemExit) as exc_info:
+                main()
+            assert exc_info.value.code == code
+        else:
+            main()
+    assert mock_request.call_args == mock.call('/path/to/sock', 'config',
+            dict(distname='distname', packages=['package'], hosts='host1',
+                inventory=None, groups=None, compress=None, batch_size=None,
+                max_failures=None, timeouts=None, facts_ttl=None,
+                load_jobs=None, resume=None, artifacts=None,
+                artifact_ttl=None, metrics_file=None, statsd=None, events=None, shard=None, results_file=None,
+                limits=None), False)
+
+
+def test_daemon_client_with_local_command(tmpdir):
+    sys.argv = ['alnair', '--daemon', '/path/to/sock', '--dry-run',
+            'generate', 'template', 'distname', str(tmpdir)]
+    with mock.patch('alnair.daemon.request') as mock_request:
+        from alnair.command import main
+        main()
+    assert mock_request.call_count == 0
+
+
+def test_daemon_client_without_daemon(tmpdir):
+    sys.argv = ['alnair', '--daemon', str(tmpdir.join('nosuch')), 'config',
+            'distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 1
+
+def test_diff(capsys):
+    sys.argv = ['alnair', 'diff', '--host', 'host1,host2', 'distname',
+            'package']
+    result = dict(packages=['package'], files={})
+    with contextlib.nested(
+            mock.patch('alnair.Distribution.get_packages', return_value=[]),
+            mock.patch('alnair.diff.compare', return_value=result)):
+        from alnair.command import main
+        main()
+    out = capsys.readouterr()[0]
+    assert u"[host:host1] missing package(s): package" in out
+    assert u"[host:host2] missing package(s): package" in out
+    assert u"2 ok, 0 failed, 0 skipped" in out
+
+
+def test_export(tmpdir):
+    output = tmpdir.join('apply.sh')
+    sys.argv = ['alnair', 'export', '--host', 'host1', '-o', str(output),
+            'distname', 'package']
+    with contextlib.nested(
+            mock.patch('alnair.Distribution.get_packages', return_value=[]),
+            mock.patch('alnair.Distribution.get_install_command',
+                return_value='test_install_command')):
+        from alnair.command import main
+        main()
+    assert 'test_install_command \n' in output.read()
+    assert os.stat(str(output)).st_mode & 0o777 == 0o755
+
+
+def test_export_without_host():
+    sys.argv = ['alnair', 'export', 'distname', 'package']
+    from alnair.command import main
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+
+
+STARTUP_SCRIPT = """\
+import sys
+from alnair.command import main
+sys.argv = ['alnair'] + sys.argv[1:]
+try:
+    main()
+except SystemExit:
+    pass
+print(' '.join(sorted(m for m in sys.modules
+    if m.split('.')[0] in ('fabric', 'paramiko'))))
+"""
+
+
+@pytest.mark.parametrize(('args',), [
+    (['--version'],),
+    (['--dry-run', 'generate', 'template', 'distname'],),
+    (['setup', '--help'],),
+    ])
+def test_startup_does_not_import_fabric(tmpdir, args):
+    # the SSH stack costs most of the startup time, it must be imported only
+    # when connecting to hosts
+    proc = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT] + args,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=str(tmpdir),
+            env=dict(os.environ, PYTHONPATH=os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))))
+    stdout, stderr = proc.communicate()
+    assert proc.returncode == 0, stderr
+    assert stdout.splitlines()[-1] == ''
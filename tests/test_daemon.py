@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import stat
+import time
+
+import pytest
+
+from alnair import daemon
+
+RECIPE = """\
+from alnair import Package
+
+pkg1 = Package('pkg1')
+pkg1.setup.config('%s').contents("testdata")
+"""
+
+
+def config_args(**kwargs):
+    args = dict(distname='testdist', packages=['pkg1'], hosts=None,
+            inventory=None, groups=None, shard=None, compress=None,
+            batch_size=None, max_failures=None, timeouts=None)
+    args.update(kwargs)
+    return args
+
+
+@pytest.fixture
+def server(request, tmpdir):
+    recipe = tmpdir.mkdir('recipes').mkdir('testdist').join('pkg1.py')
+    recipe.write(RECIPE % 'test_conffile1')
+    path = str(tmpdir.join('alnair.sock'))
+    proc = multiprocessing.Process(target=daemon.serve, args=(path,))
+    proc.start()
+
+    def fin():
+        proc.terminate()
+        proc.join()
+    request.addfinalizer(fin)
+    for _ in xrange(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    orig_cwd = os.getcwd()
+    tmpdir.chdir()
+    request.addfinalizer(lambda: os.chdir(orig_cwd))
+    return path, recipe
+
+
+def test_socket_mode(server):
+    path, _ = server
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_request(server, capsys):
+    path, recipe = server
+    assert daemon.request(path, 'config', config_args(), dry_run=True) == 0
+    assert capsys.readouterr()[0] == \
+            '[host:None]putting file: test_conffile1\n'
+    # the modified recipe is loaded again
+    recipe.write(RECIPE % 'test_conffile2')
+    os.utime(str(recipe), (time.time() + 10,) * 2)
+    assert daemon.request(path, 'config', config_args(), dry_run=True) == 0
+    assert capsys.readouterr()[0] == \
+            '[host:None]putting file: test_conffile2\n'
+
+
+def test_request_with_error(server, capsys):
+    path, _ = server
+    assert daemon.request(path, 'config', config_args(packages=['nosuch']),
+            dry_run=True) == 1
+    assert 'no such configuration file' in capsys.readouterr()[1]
+    assert daemon.request(path, 'generate', {}) == 2
+    assert capsys.readouterr()[1] == \
+            'alnair: error: unknown command `generate`\n'
+
+
+def test_serve_with_running_daemon(server):
+    path, _ = server
+    with pytest.raises(EnvironmentError):
+        daemon.serve(path)
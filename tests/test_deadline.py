@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import signal
+import threading
+import time
+
+import pytest
+
+import alnair
+
+from alnair.deadline import deadline
+
+
+def test_deadline_with_none():
+    with deadline(None):
+        time.sleep(0.01)
+    assert signal.getitimer(signal.ITIMER_REAL)[0] == 0
+
+
+def test_deadline_within_time():
+    with deadline(1):
+        time.sleep(0.01)
+    assert signal.getitimer(signal.ITIMER_REAL)[0] == 0
+
+
+def test_deadline_exceeded():
+    with pytest.raises(alnair.DeadlineExceededError) as exc_info:
+        with deadline(0.05, u"install"):
+            time.sleep(1)
+    assert exc_info.value.message == u"install timed out after 0.05 seconds"
+    assert signal.getitimer(signal.ITIMER_REAL)[0] == 0
+
+
+def test_deadline_nested():
+    with pytest.raises(alnair.DeadlineExceededError) as exc_info:
+        with deadline(0.2, u"outer"):
+            with deadline(0.05, u"inner"):
+                pass
+            assert 0 < signal.getitimer(signal.ITIMER_REAL)[0] <= 0.2
+            with deadline(1, u"inner"):
+                time.sleep(1)
+    assert exc_info.value.message == u"outer timed out after 0.2 seconds"
+
+
+def test_deadline_in_thread():
+    errors = []
+
+    def func():
+        try:
+            with deadline(0.01):
+                time.sleep(0.05)
+        except Exception as exc:
+            errors.append(exc)
+    thread = threading.Thread(target=func)
+    thread.start()
+    thread.join()
+    assert errors == []
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import subprocess
+
+import mock
+import pytest
+
+import alnair
+
+from alnair import diff
+
+
+class Result(str):
+    def __new__(cls, value, failed=False):
+        self = super(Result, cls).__new__(cls, value)
+        self.failed = failed
+        return self
+
+
+class TestDiff(object):
+    def setup_method(self, method):
+        reload(alnair)  # reset `alnair.setup` global variable
+
+    @pytest.fixture
+    def packages(self):
+        alnair.setup.config('/etc/global').contents("global\n")
+        pkg1 = alnair.Package('pkg1', 'pkg1-extra')
+        pkg1.setup.config('/etc/conf1').contents(u"contents1 あ\n")
+        with pkg1.host('testhost1'):
+            pkg1.setup.config('/etc/host1').contents("host1\n")
+        with pkg1.host('testhost2'):
+            pkg1.setup.config('/etc/host2').contents("host2\n")
+        return [pkg1]
+
+    def test_desired(self, packages):
+        names, files = diff.desired(packages, 'testhost1')
+        assert names == ['pkg1', 'pkg1-extra']
+        assert files == {
+                '/etc/global': "global\n",
+                '/etc/conf1': u"contents1 あ\n".encode('utf-8'),
+                '/etc/host1': "host1\n",
+                }
+
+    def test_script(self, tmpdir):
+        path = tmpdir.join('test file')
+        path.write("line1\nline2 \x00\xff\n", 'wb')
+        empty = tmpdir.join('empty')
+        empty.write('')
+        files = [str(path), str(empty), str(tmpdir.join('missing'))]
+        output = subprocess.check_output(['sh', '-c', diff.script(files)])
+        assert diff.parse(output) == {
+                str(path): "line1\nline2 \x00\xff\n",
+                str(empty): '',
+                str(tmpdir.join('missing')): None,
+                }
+
+    @pytest.mark.parametrize(('current', 'contents', 'expected'), [
+        ("a\nb\n", "a\nb\n", None),
+        ("a\nb\n", "a\nc\n",
+            "--- /etc/a (remote)\n+++ /etc/a\n@@ -1,2 +1,2 @@\n"
+            " a\n-b\n+c\n"),
+        (None, "a\n", "--- /dev/null\n+++ /etc/a\n@@ -0,0 +1 @@\n+a\n"),
+        ("a", "a\n",
+            "--- /etc/a (remote)\n+++ /etc/a\n@@ -1 +1 @@\n"
+            "-a\n\\ No newline at end of file\n+a\n"),
+        ])
+    def test_unified_diff(self, current, contents, expected):
+        assert diff.unified_diff('/etc/a', current, contents) == expected
+
+    def test_compare(self, packages):
+        import fabric.api as fa
+        output = '\n'.join([
+            diff.FILE_MARK + '/etc/conf1',
+            'Y29udGVudHMxIOOBggo=',
+            diff.FILE_MARK + '/etc/global',
+            diff.MISSING_MARK,
+            diff.FILE_MARK + '/etc/host1',
+            'b2xkCg==',
+            ])
+        with mock.patch('alnair.facts.gather',
+                return_value=dict(packages=['pkg1'])):
+            with mock.patch('fabric.api.sudo',
+                    return_value=Result(output)) as sudo:
+                with fa.settings(host_string='testhost1'):
+                    result = diff.compare(packages)
+        sudo.assert_called_once_with(diff.script(['/etc/conf1',
+            '/etc/global', '/etc/host1']))
+        assert result == dict(packages=['pkg1-extra'], files={
+            '/etc/global': "--- /dev/null\n+++ /etc/global\n"
+                "@@ -0,0 +1 @@\n+global\n",
+            '/etc/host1': "--- /etc/host1 (remote)\n+++ /etc/host1\n"
+                "@@ -1 +1 @@\n-old\n+host1\n",
+            })
+
+    def test_read_files_with_failure(self):
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value=Result('',
+                    failed=True)),
+                mock.patch('fabric.api.abort', side_effect=SystemExit(1)),
+                ) as (_, mock_abort):
+            with pytest.raises(SystemExit):
+                diff.read_files(['/etc/a'])
+        assert mock_abort.call_args == mock.call(
+                u"cannot read the config files of the host")
+
+    def test_format_diff(self):
+        assert diff.format_diff('testhost1', dict(packages=[], files={})) == \
+                [u"[host:testhost1] up to date"]
+        result = dict(packages=['a', 'b'], files={'/etc/b': "b diff\n",
+            '/etc/a': "a diff\n"})
+        assert diff.format_diff('testhost1', result) == [
+                u"[host:testhost1] missing package(s): a b",
+                u"[host:testhost1] differs: /etc/a",
+                "a diff",
+                u"[host:testhost1] differs: /etc/b",
+                "b diff",
+                ]
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import contextlib
+import hashlib
 import itertools
 import os
+import time
 
 import mock
 import pytest
@@ -11,6 +13,8 @@ import alnair
 
 from io import StringIO
 
+from fabric.api import settings as fa_settings
+
 class TestDistribution(object):
     TEST_FIXTURE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
         'fixtures'))
@@ -71,6 +75,262 @@ class TestDistribution(object):
         assert mock_fa_sudo.call_args_list == expected
         assert mock_dist['after_setup'].call_count == 1
 
+    def test_setup_with_facts(self, tmpdir):
+        from alnair.facts import FactsCache
+        pkg = alnair.Package('pkg1', 'pkg2', 'pkg3')
+        pkg.setup.config('test_conffile1').contents("testdata1")
+        with pkg.host('testhost2'):
+            pkg.setup.config('test_conffile2').contents("testdata2")
+        def gather(files):
+            return dict(packages=['pkg1', 'pkg3'], files={},
+                    probed=sorted(files), gathered=time.time())
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo'),
+                mock.patch('fabric.api.put'),
+                mock.patch('alnair.facts.gather', side_effect=gather),
+                mock.patch('alnair.Distribution.get_install_command',
+                    return_value='test_install_command'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, mock_gather, _, _):
+            dist = alnair.Distribution('dummy',
+                    facts_cache=FactsCache(str(tmpdir), 60))
+            dist.setup(pkg)
+            assert mock_gather.call_args_list == [
+                    mock.call(set(['test_conffile1']))]
+            assert mock_sudo.call_args_list == [
+                    mock.call('test_install_command pkg2')]
+            assert mock_put.call_count == 1
+            assert dist.facts_cache.get()['packages'] == ['pkg1', 'pkg2',
+                    'pkg3']
+            # everything is up to date
+            dist = alnair.Distribution('dummy',
+                    facts_cache=FactsCache(str(tmpdir), 60))
+            dist.setup(pkg)
+        assert mock_gather.call_count == 1
+        assert mock_sudo.call_count == 1
+        assert mock_put.call_count == 1
+        assert dist.summary() == [u"1 file(s) unchanged",
+                u"3 package(s) already installed"]
+
+    def test_setup_with_metrics(self):
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value=''),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('echo 1')
+            pkg.setup.config('test_conffile1').contents("testdata1")
+            pkg.setup.after = alnair.Command().sudo('echo after')
+            dist = alnair.Distribution('dummy', 'test_install_command')
+            dist.setup(pkg)
+        counters = dict(dist.stats.host('testhost1'))
+        assert sorted(name for name in counters
+                if name.endswith('_seconds')) == ['after_seconds',
+                        'command_seconds', 'host_seconds', 'install_seconds',
+                        'load_seconds', 'put_seconds']
+        assert counters['round_trips'] == 4
+        assert counters['commands'] == 2
+        assert counters['packages'] == 1
+        assert counters['uploads'] == 1
+        assert dist._phase is None
+
+    def test_setup_with_metrics_in_context(self):
+        def sudo(cmd):
+            if cmd == 'echo 1':
+                time.sleep(0.1)
+            return ''
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', side_effect=sudo),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('echo 1')
+            with alnair.Distribution('dummy', 'test_install_command') as dist:
+                dist.setup(pkg)
+        counters = dict(dist.stats.host('testhost1'))
+        assert counters['host_seconds'] >= counters['command_seconds'] >= 0.1
+
+    def test_setup_with_limits(self):
+        from alnair.resource import Limits
+        limits = Limits(dict(install=1, upload=2, database=1))
+        acquired = []
+        acquire = limits.acquire
+
+        def record(name):
+            acquired.append(name)
+            return acquire(name)
+        limits.acquire = record
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value=''),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('echo 1')
+            pkg.setup.config('test_conffile1').contents("testdata1").sudo(
+                    'echo 2').resource('database')
+            dist = alnair.Distribution('dummy', 'test_install_command',
+                    limits=limits)
+            dist.setup(pkg)
+        assert acquired == ['install', 'upload', 'upload', 'database']
+        assert dist.stats.host('testhost1')[-1][0] == 'wait_seconds'
+        for name in ('install', 'upload', 'database'):
+            assert limits._semaphores[name].get_value() == limits[name]
+
+    def test_setup_with_events(self):
+        from alnair.events import EventStream
+        events = mock.Mock(spec=EventStream)
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', side_effect=lambda cmd:
+                    '0 1\n' if cmd.startswith('if ') else ''),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('echo 1', creates='/etc')
+            pkg.setup.config('test_conffile1').contents("testdata1")
+            dist = alnair.Distribution('dummy', 'test_install_command',
+                    events=events)
+            dist.setup(pkg)
+        emitted = [call[0][0] for call in events.emit.call_args_list]
+        assert all(event.pop('seconds') >= 0 for event in emitted)
+        assert emitted == [
+                dict(operation='install', packages=['pkg1'], host='testhost1',
+                    package=None, outcome='applied'),
+                dict(operation='command', command='echo 1', host='testhost1',
+                    package='pkg1', outcome='guarded'),
+                dict(operation='put', filename='test_conffile1',
+                    host='testhost1', package='pkg1', outcome='applied',
+                    bytes=9),
+                ]
+        assert dist._event is None
+
+    def test_setup_with_events_on_failure(self):
+        from alnair.events import EventStream
+        events = mock.Mock(spec=EventStream)
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', side_effect=SystemExit(1)),
+                fa_settings(host_string='testhost1'),
+                ):
+            dist = alnair.Distribution('dummy', 'test_install_command',
+                    events=events)
+            with pytest.raises(SystemExit):
+                dist.setup(alnair.Package('pkg1'))
+        assert events.emit.call_args[0][0]['outcome'] == 'failed'
+
+    def test_setup_with_artifacts(self, tmpdir):
+        from alnair.artifact import ArtifactCache
+        tmpdir.join('testdist', 'common.py').write(
+                "download_command = 'apt-get download'\n"
+                "local_install_command = 'dpkg -i'\n", ensure=True)
+        package_file = tmpdir.join('pkg1_1.0.deb')
+        package_file.write("deb")
+        artifacts = mock.Mock(spec=ArtifactCache)
+        artifacts.fetch.return_value = [str(package_file)]
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value='/var/tmp/stage'),
+                mock.patch('fabric.api.put'),
+                ) as (mock_sudo, mock_put):
+            dist = alnair.Distribution('testdist', 'test_install_command',
+                    artifacts=artifacts)
+            dist.CONFIG_DIR = str(tmpdir)
+            dist.setup(alnair.Package('pkg1'))
+        assert artifacts.fetch.call_args == mock.call('testdist', ['pkg1'],
+                'apt-get download')
+        assert mock_put.call_args == mock.call(str(package_file),
+                '/var/tmp/stage/pkg1_1.0.deb', use_sudo=True)
+        assert mock_sudo.call_args_list == [
+                mock.call('mktemp -d /var/tmp/alnair.XXXXXXXXXX'),
+                mock.call('dpkg -i /var/tmp/stage/pkg1_1.0.deb'),
+                mock.call('rm -rf -- /var/tmp/stage')]
+        assert dist.summary() == [u"uploaded 1 package file(s) from the"
+                u" artifact cache: 3 bytes"]
+
+    def test_setup_with_guards(self):
+        from alnair import guard
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value="0 1\n1 0\n"),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('make install', creates='/usr/bin/pkg1')
+            pkg.setup.sudo('echo 1')
+            pkg.setup.config('test_conffile1').contents("testdata1").sudo(
+                    'migrate', unless='check')
+            with pkg.host('testhost2'):
+                pkg.setup.config('test_conffile2').contents("testdata2") \
+                        .sudo('echo 2', creates='/other')
+            dist = alnair.Distribution('dummy', 'test_install_command')
+            dist.setup(pkg)
+        assert mock_sudo.call_args_list == [
+                mock.call('test_install_command pkg1'),
+                mock.call(guard.script([('creates', '/usr/bin/pkg1'),
+                    ('unless', 'check')])),
+                mock.call("echo '[files]'\nmd5sum -- test_conffile1 "
+                    "2>/dev/null\ntrue"),
+                mock.call('echo 1'),
+                mock.call('migrate'),
+                ]
+        assert dist.summary()[-1] == u"1 command(s) skipped by guards"
+
+    def test_config_evaluates_guards_each_time(self):
+        from alnair import guard
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value="0 1\n"),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.config('test_conffile1').contents("testdata1").sudo(
+                    'migrate', unless='check')
+            dist = alnair.Distribution('dummy')
+            dist.config(pkg)
+            dist.config(pkg)
+        assert mock_sudo.call_args_list.count(mock.call(guard.script([
+            ('unless', 'check')]))) == 2
+
+    def test_setup_with_journal(self, tmpdir):
+        from alnair.journal import Journal
+        failing = [True]
+
+        def sudo(cmd):
+            if cmd == 'echo 2' and failing[0]:
+                raise SystemExit(1)
+            return ''
+        hashed = mock.call("echo '[files]'\nmd5sum -- test_conffile1 "
+                "2>/dev/null\ntrue")
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', side_effect=sudo),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('echo 1').sudo('echo 1')
+            pkg.setup.config('test_conffile1').contents("testdata1").sudo(
+                    'echo 2')
+            dist = alnair.Distribution('dummy', 'test_install_command',
+                    journal=Journal('run1', str(tmpdir)))
+            with pytest.raises(SystemExit):
+                dist.setup(pkg)
+            assert mock_sudo.call_args_list == [
+                    mock.call('test_install_command pkg1'), hashed,
+                    mock.call('echo 1'), mock.call('echo 1'),
+                    mock.call('echo 2')]
+            assert mock_put.call_count == 1
+            failing[0] = False
+            mock_sudo.reset_mock()
+            mock_put.reset_mock()
+            dist = alnair.Distribution('dummy', 'test_install_command',
+                    journal=Journal('run1', str(tmpdir), resume=True))
+            dist.setup(pkg)
+        assert mock_sudo.call_args_list == [hashed, mock.call('echo 2')]
+        assert mock_put.call_count == 0
+        assert dist.summary() == [
+                u"4 step(s) already completed in the resumed run"]
+
     @pytest.mark.randomize(('setup_num', int), min_num=1, max_num=20,
             ncalls=1)
     def test_setup_with_multiple_call_within_context(self, setup_num):
@@ -199,6 +459,139 @@ class TestDistribution(object):
                 assert arg[0][1] == c
                 assert sio.read() == d
 
+    def test_config_with_shared_contents(self):
+        pkg1 = alnair.Package('pkg1')
+        pkg1.setup.config('/etc/pkg1/cert.pem').contents("cert")
+        pkg1.setup.config('/etc/pkg1/own').contents("own")
+        pkg2 = alnair.Package('pkg2')
+        pkg2.setup.config('/etc/pkg2/cert.pem').contents("cert")
+        with pkg2.host('testhost1'):
+            pkg2.setup.config('/etc/pkg2/host.pem').contents("cert")
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value='/var/tmp/stage'),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            dist = alnair.Distribution('dummy')
+            dist.config([pkg1, pkg2])
+        staged = '/var/tmp/stage/%s' % hashlib.md5("cert").hexdigest()
+        assert sorted(call[0][1] for call in mock_put.call_args_list) == [
+                '/etc/pkg1/own', staged]
+        assert mock_sudo.call_args_list[0] == mock.call(
+                'mktemp -d /var/tmp/alnair.XXXXXXXXXX')
+        assert sorted(mock_sudo.call_args_list[1:4]) == [
+                mock.call('cp -- %s /etc/pkg1/cert.pem' % staged),
+                mock.call('cp -- %s /etc/pkg2/cert.pem' % staged),
+                mock.call('cp -- %s /etc/pkg2/host.pem' % staged),
+                ]
+        assert mock_sudo.call_args_list[4:] == [
+                mock.call('rm -rf -- /var/tmp/stage')]
+        assert dist._staging == {}
+        assert dist.summary() == [u"uploaded 4 file(s): 7 bytes sent for 15"
+                u" bytes (8 bytes saved)"]
+
+    def test_config_with_unchanged_file(self):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('/etc/pkg1/a').contents("a")
+        pkg.setup.config('/etc/pkg1/b').contents("b").sudo('reload b')
+        pkg.setup.config('/etc/pkg1/c').contents("c").notify('restart')
+        output = '\n'.join(['[files]',
+            '%s  /etc/pkg1/b' % hashlib.md5("b").hexdigest(),
+            '%s  /etc/pkg1/c' % hashlib.md5("old").hexdigest()])
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value=output),
+                mock.patch('fabric.api.put'),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_sudo, mock_put, _):
+            pkg.setup.handler('restart').sudo('restart')
+            dist = alnair.Distribution('dummy')
+            dist.config([pkg])
+        assert mock_sudo.call_args_list == [
+                mock.call("echo '[files]'\nmd5sum -- /etc/pkg1/b /etc/pkg1/c "
+                    "2>/dev/null\ntrue"),
+                mock.call('restart')]
+        assert sorted(call[0][1] for call in mock_put.call_args_list) == [
+                '/etc/pkg1/a', '/etc/pkg1/c']
+        assert dist._checksums['testhost1']['/etc/pkg1/c'] == \
+                hashlib.md5("c").hexdigest()
+        assert dist.summary()[-1] == u"1 file(s) unchanged"
+
+    def test_config_with_handlers(self):
+        pkg1 = alnair.Package('pkg1')
+        pkg1.setup.config('/etc/pkg1/a').contents("a").notify('restart')
+        pkg1.setup.config('/etc/pkg1/b').contents("b").notify('restart',
+                'reload')
+        pkg1.setup.handler('unused').sudo('echo unused')
+        pkg2 = alnair.Package('pkg2')
+        with contextlib.nested(
+                mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+                    put=mock.DEFAULT),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_fa, _):
+            pkg2.setup.config('/etc/pkg2/c').contents("c").sudo('echo c')
+            pkg1.setup.handler('restart').sudo('echo restart1')
+            pkg2.setup.handler('restart').sudo('echo restart2')
+            pkg2.setup.handler('reload').sudo('echo reload')
+            dist = alnair.Distribution('dummy')
+            dist.config([pkg1, pkg2])
+            assert mock_fa['put'].call_count == 3
+            assert mock_fa['sudo'].call_args_list[1:] == [
+                    mock.call('echo c'), mock.call('echo restart1'),
+                    mock.call('echo reload')]
+            assert dist._notified == {}
+            dist.config([pkg1, pkg2])
+            assert mock_fa['sudo'].call_count == 8
+
+    def test_after_setup_with_handlers(self):
+        pkg = alnair.Package('pkg1')
+        with contextlib.nested(
+                mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+                    put=mock.DEFAULT),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_fa, _):
+            pkg.setup.sudo('echo setup').notify('restart')
+            pkg.setup.handler('restart').sudo('echo restart')
+            pkg.setup.after = alnair.Command().sudo('echo after').notify(
+                    'restart')
+            dist = alnair.Distribution('dummy')
+            dist._packages = [pkg]
+            dist.after_setup()
+            assert mock_fa['sudo'].call_args_list == [
+                    mock.call('echo setup'), mock.call('echo after'),
+                    mock.call('echo restart')]
+
+    def test_handlers_not_notified_without_change(self):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('/etc/pkg1/a').contents("a").notify('restart')
+        facts_cache = mock.Mock()
+        facts_cache.get.return_value = {'files': {
+            '/etc/pkg1/a': hashlib.md5("a").hexdigest()}}
+        with contextlib.nested(
+                mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+                    put=mock.DEFAULT),
+                fa_settings(host_string='testhost1'),
+                ) as (mock_fa, _):
+            pkg.setup.handler('restart').sudo('echo restart')
+            dist = alnair.Distribution('dummy')
+            dist.facts_cache = facts_cache
+            dist.config([pkg])
+        assert mock_fa['put'].call_count == 0
+        assert mock_fa['sudo'].call_count == 0
+
+    def test_handlers_with_undefined_handler(self):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('/etc/pkg1/a').contents("a").notify('nosuch')
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', return_value=''),
+                mock.patch('fabric.api.put'),
+                mock.patch('fabric.api.abort', side_effect=SystemExit(1)),
+                ) as (mock_sudo, mock_put, mock_abort):
+            dist = alnair.Distribution('dummy')
+            with pytest.raises(SystemExit):
+                dist.config([pkg])
+        assert mock_abort.call_args == mock.call(
+                u"no such handler `nosuch`")
+
     def test_config_with_global_setup_config(self):
         with mock.patch('fabric.api.put') as mock_put:
             dist = alnair.Distribution('dummy')
@@ -249,6 +642,109 @@ class TestDistribution(object):
             assert contents == expect[0]
             assert sio.read() == expect[1]
 
+    def test_config_with_delta(self):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('test_conffile1').contents("testdata1").delta(16)
+        with contextlib.nested(
+                mock.patch('fabric.api.put'),
+                mock.patch('alnair.transfer.put_delta',
+                    return_value=(9, True))) as (mock_put, mock_transfer_put):
+            dist = alnair.Distribution('dummy')
+            dist.config(pkg)
+        assert mock_put.call_count == 0
+        assert mock_transfer_put.call_args_list == [
+                mock.call("testdata1", 'test_conffile1', 16, None)]
+
+    @pytest.mark.parametrize(('sent', 'changed', 'expected'), [
+        (0, False, [u"1 file(s) unchanged"]),
+        (4, True, [u"uploaded 1 file(s): 4 bytes sent for 9 bytes (5 bytes"
+            u" saved)"]),
+        (0, True, [u"uploaded 1 file(s): 0 bytes sent for 9 bytes (9 bytes"
+            u" saved)"]),
+        ])
+    def test_config_with_delta_stats(self, sent, changed, expected):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('test_conffile1').contents("testdata1").delta()
+        with mock.patch('alnair.transfer.put_delta',
+                return_value=(sent, changed)):
+            dist = alnair.Distribution('dummy')
+            dist.config(pkg)
+        assert dist.stats['uploads'] == int(changed)
+        assert dist.stats['unchanged'] == int(not changed)
+        assert dist.summary() == expected
+
+    @pytest.mark.parametrize(('compress', 'codec', 'expected'), [
+        (None, 'gzip', None),
+        (0, 'gzip', 'gzip'),
+        (100, 'gzip', None),
+        (0, None, None),
+        ])
+    def test_get_codec(self, compress, codec, expected):
+        dist = alnair.Distribution('dummy', compress=compress)
+        with mock.patch('alnair.transfer.remote_codec') as mock_remote_codec:
+            mock_remote_codec.return_value = codec
+            assert dist.get_codec(10) == expected
+            assert dist.get_codec(10) == expected
+        assert mock_remote_codec.call_count == int(compress == 0)
+
+    def test_config_with_compress(self):
+        pkg = alnair.Package('pkg1')
+        pkg.setup.config('test_conffile1').contents("testdata1")
+        with contextlib.nested(
+                mock.patch('fabric.api.put'),
+                mock.patch('alnair.transfer.remote_codec',
+                    return_value='gzip'),
+                mock.patch('alnair.transfer.put', return_value=5)) as (
+                        mock_put, mock_remote_codec, mock_transfer_put):
+            dist = alnair.Distribution('dummy', compress=0)
+            dist.config(pkg)
+        assert mock_put.call_count == 0
+        assert mock_transfer_put.call_args_list == [
+                mock.call("testdata1", 'test_conffile1', 'gzip')]
+        assert dist.stats['uploads'] == 1
+        assert dist.stats['upload_bytes'] == len("testdata1")
+        assert dist.stats['sent_bytes'] == 5
+        assert dist.summary() == [u"uploaded 1 file(s): 5 bytes sent for 9"
+                u" bytes (4 bytes saved)"]
+
+    @pytest.mark.parametrize(('operation',), [('install',), ('command',)])
+    def test_timeouts(self, operation):
+        def sleep(cmd):
+            time.sleep(1)
+        with contextlib.nested(
+                mock.patch('fabric.api.sudo', side_effect=sleep),
+                mock.patch('alnair.Distribution.get_install_command',
+                    return_value='test_install_command')):
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('testcmd')
+            dist = alnair.Distribution('dummy', timeouts={operation: 0.05})
+            with pytest.raises(alnair.DeadlineExceededError):
+                dist.setup(pkg)
+
+    def test_timeouts_with_put(self):
+        def sleep(*args, **kwargs):
+            time.sleep(1)
+        with mock.patch('fabric.api.put', side_effect=sleep):
+            dist = alnair.Distribution('dummy', timeouts={'put': 0.05})
+            alnair.setup.config('testconfig').contents("testdata")
+            with pytest.raises(alnair.DeadlineExceededError):
+                dist.config([])
+
+    def test_timeouts_with_connect(self):
+        import fabric.api as fa
+        timeouts = []
+        with mock.patch('fabric.api.sudo',
+                side_effect=lambda cmd: timeouts.append(fa.env.timeout)):
+            dist = alnair.Distribution('dummy', timeouts={'connect': 3})
+            pkg = alnair.Package('pkg1')
+            pkg.setup.sudo('testcmd')
+            dist.exec_commands(pkg.setup)
+        assert timeouts == [3]
+        assert fa.env.timeout != 3
+
+    def test_summary_without_uploads(self):
+        assert alnair.Distribution('dummy').summary() == []
+
     @pytest.mark.parametrize(('after',), [
         (mock.Mock(spec=alnair.Command),), (None,)])
     @pytest.mark.randomize(('num', int), min_num=1, max_num=20, ncalls=1)
@@ -257,14 +753,21 @@ class TestDistribution(object):
         setup_calls = []
         conf_calls = []
         after_calls = []
+        if after is not None:
+            after._notify = ()
         for i in range(num):
             pkg = mock.Mock(spec=alnair.Package)
             setup = mock.Mock(spec=alnair.package.Setup)
             config = mock.Mock(spec=alnair.package.Config)
             func = mock.Mock()
+            config._filename = 'name%d' % i
             config._contents = 'testcontents%d' % i
+            config._delta = None
             config._commands = [('confcmd%d' % i, func)]
+            config._notify = ()
             setup._commands = [('setupcmd%d' % i, func)]
+            setup._notify = ()
+            setup._handlers = {}
             pkg.setup = setup
             pkg.setup.config_all = {(None, 'name%d' % i): config}
             pkg.setup.after = after
@@ -365,6 +868,38 @@ class TestDistribution(object):
                 dist.get_install_command()
             assert getattr(exc_info.value, 'code', exc_info.value) == 1
 
+    def test_load_source_with_code_cache(self, tmpdir):
+        recipe = tmpdir.join('pkg.py')
+        recipe.write("value = 1\n")
+        dist = alnair.Distribution('dummy')
+        dist.code_cache = {}
+        with mock.patch('imp.load_source') as mock_load_source:
+            module = dist.load_source('pkg', str(recipe))
+            assert module.value == 1
+            module.value = 2
+            cached = dist.code_cache[str(recipe)]
+            module = dist.load_source('pkg', str(recipe))
+            assert module.value == 1
+            assert dist.code_cache[str(recipe)] is cached
+            recipe.write("value = 10\n")
+            assert dist.load_source('pkg', str(recipe)).value == 10
+        assert mock_load_source.call_count == 0
+
+    def test_compile_recipes(self, tmpdir):
+        tmpdir.join('dummy', 'common.py').write("install_command = 'cmd'\n",
+                ensure=True)
+        tmpdir.join('dummy', 'pkg1.py').write("value = 1\n")
+        tmpdir.join('dummy', 'broken.py').write("value =\n")
+        with contextlib.nested(
+                mock.patch.object(alnair.Distribution, 'code_cache', {}),
+                mock.patch.object(alnair.Distribution, 'CONFIG_DIR',
+                    str(tmpdir))):
+            alnair.Distribution.compile_recipes('dummy', ['pkg1', 'broken',
+                'nosuchpkg'])
+            assert sorted(alnair.Distribution.code_cache) == [
+                    str(tmpdir.join('dummy', 'common.py')),
+                    str(tmpdir.join('dummy', 'pkg1.py'))]
+
     @pytest.mark.randomize(('cmd', str), fixed_length=8, ncalls=5)
     def test_get_install_command_with_default(self, cmd):
         dist = alnair.Distribution('dummy', cmd)
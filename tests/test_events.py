@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import fcntl
+import json
+import os
+import threading
+
+import mock
+import pytest
+
+from alnair.events import MAX_LINE_SIZE, EventStream
+
+
+def test_open_path(tmpdir):
+    path = tmpdir.join('events.jsonl')
+    path.write('{"operation":"old"}\n')
+    stream = EventStream.open(str(path))
+    with mock.patch('time.time', return_value=100.0):
+        stream.emit(dict(operation='put', host='host1', bytes=10))
+    stream.close()
+    lines = path.read().splitlines()
+    assert json.loads(lines[1]) == dict(operation='put', host='host1',
+            bytes=10, time=100.0)
+    assert len(lines) == 2
+
+
+def test_open_fd():
+    reader, writer = os.pipe()
+    try:
+        stream = EventStream.open('fd:%d' % writer)
+        assert stream.fd == writer
+        assert not fcntl.fcntl(writer, fcntl.F_GETFL) & os.O_NONBLOCK
+        stream.emit(dict(operation='command'))
+        assert json.loads(os.read(reader, 1024))['operation'] == 'command'
+    finally:
+        os.close(reader)
+        os.close(writer)
+
+
+@pytest.mark.parametrize(('target',), [('fd:x',), ('/nosuchdir/events',)])
+def test_open_with_invalid_target(target):
+    with pytest.raises((OSError, ValueError)):
+        EventStream.open(target)
+
+
+def test_emit_without_blocking():
+    reader, writer = os.pipe()
+    stream = EventStream(writer)
+    try:
+        # more than the capacity of a pipe, which the reader does not read
+        for i in range(10000):
+            stream.emit(dict(operation='command', command='x' * 100,
+                index=i))
+        assert not stream._queue.empty()
+        chunks = []
+        thread = threading.Thread(target=lambda: chunks.extend(iter(
+            lambda: os.read(reader, 65536), '')))
+        thread.start()
+        stream.close()
+        thread.join()
+    finally:
+        os.close(reader)
+    lines = ''.join(chunks).splitlines()
+    assert [json.loads(line)['index'] for line in lines] == range(10000)
+
+
+def test_emit_long_event():
+    reader, writer = os.pipe()
+    stream = EventStream(writer)
+    try:
+        stream.emit(dict(operation='command', host='host1',
+            command='x' * (MAX_LINE_SIZE * 2)))
+        stream.flush()
+        line = os.read(reader, MAX_LINE_SIZE * 4)
+    finally:
+        os.close(reader)
+        os.close(writer)
+    assert len(line) == MAX_LINE_SIZE
+    event = json.loads(line)
+    assert event['host'] == 'host1'
+    assert event['command'].startswith('xxx')
+    assert event['command'].endswith('...')
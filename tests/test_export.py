@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import getpass
+import subprocess
+
+import mock
+import pytest
+
+import alnair
+
+from alnair import export
+
+
+class TestExport(object):
+    def setup_method(self, method):
+        reload(alnair)  # reset `alnair.setup` global variable
+
+    @pytest.fixture
+    def packages(self, tmpdir):
+        log = tmpdir.join('log')
+        alnair.setup.config(str(tmpdir.join('global'))).contents("global\n")
+        pkg1 = alnair.Package('pkg1', 'pkg1-extra')
+        pkg1.setup.run('echo setup1 >> %s' % log)
+        pkg1.setup.config(str(tmpdir.join('conf1'))).contents(
+                u"contents1 あ\n").sudo('echo conf1 >> %s' % log)
+        with pkg1.host('testhost1'):
+            pkg1.setup.config(str(tmpdir.join('host1'))).contents("host1\n")
+        with pkg1.host('testhost2'):
+            pkg1.setup.config(str(tmpdir.join('host2'))).contents("host2\n")
+        pkg1.setup.after = lambda: alnair.Command().sudo(
+                'echo after1 >> %s' % log)
+        pkg2 = alnair.Package('pkg2')
+        pkg2.setup.config(str(tmpdir.join('conf2'))).contents("")
+        return [pkg1, pkg2]
+
+    def test_plan(self, tmpdir, packages):
+        dist = alnair.Distribution('dummy', 'test_install_command')
+        actions = export.plan(dist, packages, 'testhost1', 'alice')
+        log = tmpdir.join('log')
+        assert actions == [
+            ('command', 'test_install_command pkg1 pkg1-extra pkg2', 'sudo'),
+            ('put', str(tmpdir.join('global')), "global\n"),
+            ('command', "run_as alice 'echo setup1 >> %s'" % log, 'run'),
+            ('put', str(tmpdir.join('conf1')),
+                u"contents1 あ\n".encode('utf-8')),
+            ('command', 'echo conf1 >> %s' % log, 'sudo'),
+            ('put', str(tmpdir.join('host1')), "host1\n"),
+            ('command', 'echo after1 >> %s' % log, 'sudo'),
+            ('put', str(tmpdir.join('conf2')), ""),
+            ]
+
+    def test_plan_without_user(self, packages):
+        dist = alnair.Distribution('dummy', 'test_install_command')
+        with mock.patch('fabric.api.abort', side_effect=SystemExit(1)) as \
+                mock_abort:
+            with pytest.raises(SystemExit):
+                export.plan(dist, packages, 'testhost1')
+        assert 'echo setup1' in mock_abort.call_args[0][0]
+
+    def test_plan_with_handlers(self, packages):
+        dist = alnair.Distribution('dummy', 'test_install_command')
+        packages[1].setup.config('/etc/a').contents("a").notify('restart')
+        packages[1].setup.handler('reload').run('echo reload')
+        packages[1].setup.sudo('echo setup2').notify('reload', 'restart')
+        packages[0].setup.handler('restart').sudo('echo restart')
+        actions = export.plan(dist, packages, 'testhost1', 'alice')
+        assert actions[-2:] == [
+                ('command', "run_as alice 'echo reload'", 'run'),
+                ('command', 'echo restart', 'sudo')]
+        assert [action for action in actions
+                if 'echo re' in action[1]] == actions[-2:]
+
+    def test_render(self, tmpdir, packages):
+        dist = alnair.Distribution('dummy', 'true')
+        actions = export.plan(dist, packages, 'testhost1', getpass.getuser())
+        script = export.render(actions, 'testhost1', ['pkg1', 'pkg2'])
+        assert script.startswith('#!/bin/sh\n')
+        subprocess.check_call(['sh', '-c', script])
+        assert tmpdir.join('global').read() == "global\n"
+        assert tmpdir.join('conf1').read('rb') == \
+                u"contents1 あ\n".encode('utf-8')
+        assert tmpdir.join('host1').read() == "host1\n"
+        assert not tmpdir.join('host2').check()
+        assert tmpdir.join('conf2').read() == ""
+        assert tmpdir.join('log').read() == "setup1\nconf1\nafter1\n"
+
+    def test_render_with_guards(self, tmpdir):
+        log = tmpdir.join('log')
+        pkg = alnair.Package('pkg1')
+        pkg.setup.run('echo 1 >> %s' % log, creates=str(tmpdir))
+        pkg.setup.run('echo 2 >> %s' % log, onlyif='true')
+        dist = alnair.Distribution('dummy', 'true')
+        actions = export.plan(dist, [pkg], 'testhost1', getpass.getuser())
+        script = export.render(actions, 'testhost1', ['pkg1'])
+        subprocess.check_call(['sh', '-c', script])
+        assert log.read() == "2\n"
+
+    def test_render_stops_on_error(self, tmpdir):
+        actions = [('command', 'false', 'sudo'),
+                ('put', str(tmpdir.join('conf1')), "data")]
+        script = export.render(actions, 'testhost1', ['pkg1'])
+        assert subprocess.call(['sh', '-c', script]) != 0
+        assert not tmpdir.join('conf1').check()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import json
+import subprocess
+import time
+
+import mock
+import pytest
+
+from alnair import facts
+from alnair.facts import FactsCache
+
+
+def test_parse():
+    output = '\n'.join([
+        'os=debian',
+        'arch=x86_64',
+        'kernel=Linux 4.9.0',
+        '[packages]',
+        'nginx',
+        'curl',
+        '[files]',
+        'd41d8cd98f00b204e9800998ecf8427e  /etc/empty',
+        'b1946ac92492d2347c6235b4d2611184  /etc/with space',
+        ])
+    result = facts.parse(output, ['/etc/with space', '/etc/empty',
+        '/etc/missing'])
+    assert result['os'] == 'debian'
+    assert result['arch'] == 'x86_64'
+    assert result['kernel'] == 'Linux 4.9.0'
+    assert result['packages'] == ['curl', 'nginx']
+    assert result['files'] == {
+            '/etc/empty': 'd41d8cd98f00b204e9800998ecf8427e',
+            '/etc/with space': 'b1946ac92492d2347c6235b4d2611184'}
+    assert result['probed'] == ['/etc/empty', '/etc/missing',
+            '/etc/with space']
+
+
+def test_script(tmpdir):
+    path = tmpdir.join('test file')
+    path.write('hello\n')
+    files = [str(path), str(tmpdir.join('missing'))]
+    output = subprocess.check_output(['sh', '-c', facts.script(files)])
+    result = facts.parse(output, files)
+    assert result['arch']
+    assert result['files'] == {str(path): 'b1946ac92492d2347c6235b4d2611184'}
+
+
+def test_gather_with_failure():
+    with contextlib.nested(
+            mock.patch('fabric.api.sudo', return_value=mock.Mock(failed=True)),
+            mock.patch('fabric.api.abort', side_effect=SystemExit(1)),
+            ) as (_, mock_abort):
+        with pytest.raises(SystemExit):
+            facts.gather(['/etc/a'])
+    assert mock_abort.call_args == mock.call(
+            u"cannot gather the facts of the host")
+
+
+def test_checksums(tmpdir):
+    path = tmpdir.join('test file')
+    path.write('hello\n')
+    files = [str(path), str(tmpdir.join('missing')), str(path)]
+
+    def sudo(cmd):
+        return subprocess.check_output(['sh', '-c', cmd])
+    with mock.patch('fabric.api.sudo', side_effect=sudo) as mock_sudo:
+        assert facts.checksums(files) == {
+                str(path): 'b1946ac92492d2347c6235b4d2611184'}
+        assert facts.checksums([]) == {}
+    assert mock_sudo.call_count == 1
+
+
+class TestFactsCache(object):
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return FactsCache(str(tmpdir.join('facts')), ttl=60)
+
+    def test_get(self, cache):
+        import fabric.api as fa
+        gathered = dict(packages=['nginx'], files={}, probed=['/etc/a'],
+                gathered=time.time())
+        with mock.patch('alnair.facts.gather', return_value=gathered) as \
+                mock_gather:
+            with fa.settings(host_string='testhost1'):
+                assert cache.get(['/etc/a']) is gathered
+                assert cache.get() is gathered
+                # not hashed yet
+                cache.get(['/etc/b'])
+        assert mock_gather.call_args_list == [
+                mock.call(set(['/etc/a'])), mock.call(set(['/etc/a', '/etc/b']))]
+        assert FactsCache(cache.directory, 60).load('testhost1') == \
+                json.loads(json.dumps(gathered))
+
+    @pytest.mark.parametrize(('age', 'ttl', 'expected'), [
+        (10, 60, True), (70, 60, False), (0, 0, False)])
+    def test_load(self, cache, age, ttl, expected):
+        saved = dict(packages=[], files={}, probed=[],
+                gathered=time.time() - age)
+        cache.save('test/host', saved)
+        assert (FactsCache(cache.directory, ttl).load('test/host') is not
+                None) is expected
+        assert FactsCache(cache.directory, ttl).load('nosuchhost') is None
+
+    def test_update(self, cache):
+        import fabric.api as fa
+        with fa.settings(host_string='testhost1'):
+            cache.update(packages=['nginx'])
+            assert cache.load('testhost1') is None
+            cache.save('testhost1', dict(packages=['curl'], files={},
+                probed=[], gathered=time.time()))
+            cache.update(packages=['nginx'], files={'/etc/a': 'abc'})
+        assert cache.load('testhost1') == dict(packages=['curl', 'nginx'],
+                files={'/etc/a': 'abc'}, probed=['/etc/a'],
+                gathered=mock.ANY)
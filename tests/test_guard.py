@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+
+import mock
+import pytest
+
+from alnair import guard
+
+
+@pytest.mark.parametrize(('kwargs', 'expected'), [
+    (dict(), ()),
+    (dict(onlyif='test -x /bin/sh', creates='/usr/bin/foo'),
+        (('creates', '/usr/bin/foo'), ('onlyif', 'test -x /bin/sh'))),
+    (dict(unless='true'), (('unless', 'true'),)),
+    ])
+def test_make(kwargs, expected):
+    assert guard.make(**kwargs) == expected
+
+
+def test_script(tmpdir):
+    exists = tmpdir.join('exists file')
+    exists.write('')
+    guards = [
+        ('creates', str(exists)),
+        ('creates', str(tmpdir.join('missing'))),
+        ('unless', 'true'),
+        ('unless', 'echo output; false'),
+        ('onlyif', 'false'),
+        ('onlyif', 'true'),
+        ]
+    output = subprocess.check_output(['sh', '-c', guard.script(guards)])
+    assert guard.parse(output, guards) == {
+            guards[0]: True, guards[1]: False,
+            guards[2]: True, guards[3]: False,
+            guards[4]: True, guards[5]: False,
+            }
+
+
+def test_parse_with_missing_lines():
+    guards = [('unless', 'a'), ('unless', 'b')]
+    assert guard.parse("1 1\r\nnoise\n", guards) == {guards[0]: False,
+            guards[1]: True}
+
+
+@pytest.mark.parametrize(('guards', 'expected'), [
+    ((), "ran\n"),
+    ((('unless', 'false'),), "ran\n"),
+    ((('unless', 'false'), ('onlyif', 'false')), ""),
+    ((('creates', '/'),), ""),
+    ])
+def test_shell_command(guards, expected):
+    cmd = guard.shell_command('echo ran', guards)
+    assert subprocess.check_output(['sh', '-c', cmd]) == expected
+
+
+def test_evaluate():
+    guards = [('creates', '/a'), ('unless', 'b')]
+    with mock.patch('fabric.api.sudo', return_value="0 0\n1 1\n") as sudo:
+        assert guard.evaluate(iter(guards)) == {guards[0]: False,
+                guards[1]: True}
+    sudo.assert_called_once_with(guard.script(guards))
+    with mock.patch('fabric.api.sudo') as sudo:
+        assert guard.evaluate([]) == {}
+    assert sudo.call_count == 0
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import alnair
+
+from alnair import inventory
+from alnair.inventory import Inventory
+
+TEST_INVENTORY = """\
+# comment
+db1.example.com distribution=archlinux
+
+[web]
+web[001-300].example.com distribution=debian  # trailing comment
+web-[a-c]
+
+[db]
+db1.example.com role=primary
+db[1-3].example.com
+"""
+
+
+@pytest.fixture
+def inv():
+    inv = Inventory()
+    inv.parse(TEST_INVENTORY.splitlines())
+    return inv
+
+
+@pytest.mark.parametrize(('pattern', 'expected'), [
+    ('host1', ('host1',)),
+    ('web[001-300].example.com', ('web', (1, 300, 3), '.example.com')),
+    ('db[1-3]', ('db', (1, 3, 0))),
+    ('node[0-15]', ('node', (0, 15, 0))),
+    ('web[1-010]', ('web', (1, 10, 3))),
+    ('rack[a-c]-[1-2]', ('rack', ('a', 'b', 'c'), '-', (1, 2, 0))),
+    ])
+def test_parse_pattern(pattern, expected):
+    assert inventory.parse_pattern(pattern) == expected
+
+
+@pytest.mark.parametrize(('pattern',), [('db[3-1]',), ('db[c-a]',)])
+def test_parse_pattern_with_invalid_range(pattern):
+    with pytest.raises(ValueError):
+        inventory.parse_pattern(pattern)
+
+
+@pytest.mark.parametrize(('pattern', 'expected'), [
+    ('host1', ['host1']),
+    ('web[08-11]', ['web08', 'web09', 'web10', 'web11']),
+    ('db[1-2]-[a-b]', ['db1-a', 'db1-b', 'db2-a', 'db2-b']),
+    ])
+def test_expand(pattern, expected):
+    assert list(inventory.expand(inventory.parse_pattern(pattern))) == \
+            expected
+
+
+def test_expand_is_lazy():
+    names = inventory.expand(inventory.parse_pattern('web[1-100000000]'))
+    assert next(names) == 'web1'
+    assert next(names) == 'web2'
+
+
+class TestInventory(object):
+    def test_groups(self, inv):
+        assert inv.groups == ['all', 'web', 'db']
+
+    def test_select_all(self, inv):
+        hosts = list(inv.select())
+        assert len(hosts) == 1 + 300 + 3 + 2
+        assert hosts[:3] == ['db1.example.com', 'web001.example.com',
+                'web002.example.com']
+        assert hosts[-3:] == ['web-c', 'db2.example.com', 'db3.example.com']
+
+    @pytest.mark.parametrize(('hosts', 'groups', 'expected'), [
+        (['web-b', 'db2.example.com'], None, ['web-b', 'db2.example.com']),
+        (['web[299-301].example.com'], None,
+            ['web299.example.com', 'web300.example.com']),
+        (['nosuchhost'], None, []),
+        (['web01*'], None, ['web%03d.example.com' % i for i in range(10, 20)]),
+        (['db*', 'web-?'], None, ['db1.example.com', 'web-a', 'web-b',
+            'web-c', 'db2.example.com', 'db3.example.com']),
+        (None, ['db'], ['db1.example.com', 'db2.example.com',
+            'db3.example.com']),
+        (None, ['w*', 'nosuchgroup'], ['web%03d.example.com' % i
+            for i in range(1, 301)] + ['web-a', 'web-b', 'web-c']),
+        (['db1.example.com'], ['web'], []),
+        (['db1.example.com'], ['db'], ['db1.example.com']),
+        (['*1.example.com'], ['db'], ['db1.example.com']),
+        ])
+    def test_select(self, inv, hosts, groups, expected):
+        assert list(inv.select(hosts, groups)) == expected
+
+    @pytest.mark.parametrize(('name', 'expected'), [
+        ('db1.example.com', {'distribution': 'archlinux', 'role': 'primary'}),
+        ('web120.example.com', {'distribution': 'debian'}),
+        ('web-a', {}),
+        ('nosuchhost', {}),
+        ])
+    def test_vars(self, inv, name, expected):
+        assert inv.vars(name) == expected
+
+    @pytest.mark.parametrize(('name', 'expected'), [
+        ('web001.example.com', True),
+        ('web300.example.com', True),
+        ('web301.example.com', False),
+        ('web1.example.com', False),
+        ('web-d', False),
+        ('db01.example.com', False),
+        ('db2.example.com', True),
+        ])
+    def test_contains(self, inv, name, expected):
+        assert (name in inv) is expected
+
+    def test_shared_vars(self):
+        inv = Inventory()
+        inv.add('host1', {'distribution': 'debian'})
+        inv.add('host2', {'distribution': 'debian'})
+        assert inv._vars[0] is inv._vars[1]
+
+    @pytest.mark.parametrize(('pattern', 'name', 'expected'), [
+        ('node[0-15]', 'node0', True),
+        ('node[0-15]', 'node10', True),
+        ('node[0-15]', 'node05', False),
+        ('web[1-010]', 'web001', True),
+        ('web[1-010]', 'web010', True),
+        ('web[1-010]', 'web1', False),
+        ])
+    def test_range_width(self, pattern, name, expected):
+        inv = Inventory()
+        inv.add(pattern, {'role': 'test'})
+        assert (name in inv) is expected
+        assert (name in inventory.expand(inventory.parse_pattern(pattern))) \
+                is expected
+        assert list(inv.select([name])) == ([name] if expected else [])
+        assert inv.vars(name) == ({'role': 'test'} if expected else {})
+
+    @pytest.mark.parametrize(('hosts', 'expected'), [
+        (['web-a', 'db2.example.com'], []),
+        (['web-a', 'wbe-b', 'web*'], ['wbe-b']),
+        (['db[2-5].example.com'], ['db4.example.com', 'db5.example.com']),
+        ])
+    def test_missing(self, inv, hosts, expected):
+        assert list(inv.missing(hosts)) == expected
+
+    def test_parse_with_range_line(self):
+        inv = Inventory()
+        inv.parse(['[web]', '[a-b]x[1-2]'])
+        assert inv.groups == ['web', 'all']
+        assert list(inv.select(groups=['web'])) == ['ax1', 'ax2', 'bx1',
+                'bx2']
+
+    def test_range_is_not_expanded(self):
+        inv = Inventory()
+        inv.add('web[1-100000000]', group='web')
+        assert 'web99999999' in inv
+        assert list(inv.select(['web99999999'])) == ['web99999999']
+
+    @pytest.mark.parametrize(('line',), [
+        ('[]',), ('host1 novalue',), ('host1 =value',), ('host[3-1]',),
+        ])
+    def test_parse_with_invalid_line(self, line):
+        inv = Inventory()
+        with pytest.raises(alnair.InventoryError) as exc_info:
+            inv.parse(['host0', line], 'test')
+        assert exc_info.value.message.startswith(u"test:2: ")
+
+    def test_load(self, tmpdir):
+        path = tmpdir.join('inventory')
+        path.write(TEST_INVENTORY)
+        inv = Inventory.load(str(path))
+        assert len(list(inv.select())) == 306
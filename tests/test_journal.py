@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+import pytest
+
+from alnair import journal
+from alnair.journal import Journal
+
+
+def test_new_run_id():
+    run_id = journal.new_run_id()
+    assert re.match(r'^\d{8}-\d{6}-[0-9a-f]{8}$', run_id)
+    assert journal.new_run_id() != run_id
+
+
+class TestJournal(object):
+    def test_step(self, tmpdir):
+        j = Journal('run1', str(tmpdir))
+        assert j.step('host1', 'command:echo') == 'command:echo'
+        assert j.step('host1', 'command:echo') == 'command:echo#2'
+        assert j.step('host2', 'command:echo') == 'command:echo'
+
+    def test_record_and_resume(self, tmpdir):
+        directory = str(tmpdir.join('runs'))
+        j = Journal('run1', directory)
+        assert not j.completed('host1', 'install:pkg1')
+        j.record('host1', 'install:pkg1')
+        j.record(None, 'command:echo')
+        assert j.completed('host1', 'install:pkg1')
+        with open(j.path, 'a') as f:
+            # killed while writing
+            f.write('{"host": "host1", "st')
+        resumed = Journal('run1', directory, resume=True)
+        assert resumed.completed('host1', 'install:pkg1')
+        assert resumed.completed(None, 'command:echo')
+        assert not resumed.completed('host2', 'install:pkg1')
+        assert not Journal('run2', directory).completed('host1',
+                'install:pkg1')
+
+    def test_resume_without_journal(self, tmpdir):
+        with pytest.raises(IOError):
+            Journal('nosuchrun', str(tmpdir), resume=True)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+import mock
+
+from alnair.lazy import LazyModule
+
+
+class TestLazyModule(object):
+    def test_is_not_imported_until_accessed(self):
+        with mock.patch.dict(sys.modules):
+            sys.modules.pop('colorsys', None)
+            module = LazyModule('colorsys')
+            assert 'colorsys' not in sys.modules
+            assert module.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+            assert 'colorsys' in sys.modules
+
+    def test_attribute_is_looked_up_each_time(self):
+        fa = LazyModule('fabric.api')
+        with mock.patch('fabric.api.sudo') as mock_sudo:
+            fa.sudo('testcmd')
+        assert mock_sudo.call_args == mock.call('testcmd')
+        import fabric.api
+        assert fa.sudo is fabric.api.sudo
+
+    def test_setattr(self):
+        fa = LazyModule('fabric.api')
+        import fabric.api
+        with mock.patch.object(fabric.api, 'env', mock.Mock()):
+            fa.env = 'testenv'
+            assert fabric.api.env == 'testenv'
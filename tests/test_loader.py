@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+import alnair
+
+from alnair import loader
+
+RECIPES = {
+    'web': """\
+# -*- coding: utf-8 -*-
+import alnair
+from alnair import Command, Package
+
+web = Package('web', 'web-extra')
+web.setup.run('echo web')
+web.setup.config('/etc/web.conf').contents(u"web あ").delta(4096).sudo(
+        'service web reload')
+with web.host('host1'):
+    web.setup.config('/etc/host1.conf').contents("host1")
+web.setup.after = Command().sudo('echo after')
+alnair.setup.config('/etc/global.conf').contents("global")
+""",
+    'db': """\
+from alnair import Package
+
+db = Package('db')
+db.setup.config('/etc/db.conf').contents("db")
+""",
+    'hook': """\
+from alnair import Command, Package
+
+hook = Package('hook')
+hook.setup.after = lambda: Command().sudo('echo hook')
+""",
+    'broken': """\
+broken = 1
+""",
+    }
+
+
+class TestLoader(object):
+    def setup_method(self, method):
+        reload(alnair)  # reset `alnair.setup` global variable
+
+    @pytest.fixture
+    def dist(self, tmpdir):
+        for name, source in RECIPES.iteritems():
+            tmpdir.join('testdist', '%s.py' % name).write(source,
+                    'wb', ensure=True)
+        dist = alnair.Distribution('testdist', processes=2)
+        dist.CONFIG_DIR = str(tmpdir)
+        return dist
+
+    def test_describe_and_restore(self):
+        import fabric.api as fa
+        pkg = alnair.Package('pkg1')
+        pkg.setup.sudo('echo 1').run('echo 2', creates='/a')
+        pkg.setup.config('/etc/a').contents("a").sudo('echo a').notify(
+                'reload')
+        pkg.setup.handler('reload').sudo('echo reload').resource('services')
+        with pkg.host('host1'):
+            pkg.setup.config('/etc/a').contents("host1").delta()
+        desc = loader.describe_setup(pkg.setup)
+        setup = alnair.Setup(alnair._Host())
+        loader.restore_setup(setup, desc)
+        assert setup._commands == [('echo 1', fa.sudo), ('echo 2', fa.run)]
+        assert setup._commands[1].guards == (('creates', '/a'),)
+        assert sorted(setup.config_all) == [(None, '/etc/a'),
+                ('host1', '/etc/a')]
+        config = setup.config_all[(None, '/etc/a')]
+        assert (config._contents, config._delta, config._commands) == (
+                "a", None, [('echo a', fa.sudo)])
+        assert config._notify == ('reload',)
+        assert setup._handlers['reload']._commands == [
+                ('echo reload', fa.sudo)]
+        assert setup._handlers['reload']._resource == 'services'
+        assert setup._resource is None
+        config = setup.config_all[('host1', '/etc/a')]
+        assert (config._contents, config._delta) == ("host1", True)
+        assert setup.after is None
+
+    def test_describe_after(self):
+        setup = alnair.Setup(alnair._Host())
+        setup.after = alnair.Command().sudo('echo after').resource('db')
+        assert loader.describe_setup(setup)['after'] == [
+                ('echo after', 'sudo', ())]
+        assert loader.describe_setup(setup)['after_resource'] == 'db'
+        setup.after = lambda: None
+        assert loader.describe_setup(setup)['after'] == loader.CALLABLE
+
+    def test_load_packages(self, dist):
+        import fabric.api as fa
+        packages = loader.load_packages(dist, ['web', 'db', 'hook',
+            'broken'], 2)
+        web, db, hook, broken = packages
+        assert web.name == ('web', 'web-extra')
+        assert web.setup._commands == [('echo web', fa.run)]
+        config = web.setup.config_all[(None, '/etc/web.conf')]
+        assert config._contents == u"web あ"
+        assert config._delta == 4096
+        assert config._commands == [('service web reload', fa.sudo)]
+        assert web.setup.config_all[('host1', '/etc/host1.conf')]._contents \
+                == "host1"
+        assert web.setup.after._commands == [('echo after', fa.sudo)]
+        assert db.setup.config_all[(None, '/etc/db.conf')]._contents == "db"
+        # left to the controller
+        assert hook is None
+        assert broken is None
+        assert alnair.setup.config_all[(None, '/etc/global.conf')] \
+                ._contents == "global"
+
+    def test_get_packages(self, dist):
+        with mock.patch('alnair.loader.load_packages',
+                wraps=loader.load_packages) as mock_load:
+            packages = dist.get_packages(['web', 'hook', 'db', 'web'])
+        mock_load.assert_called_once_with(dist, ['web', 'hook', 'db'], 2)
+        assert [pkg.name for pkg in packages] == [('web', 'web-extra'),
+                ('hook',), ('db',), ('web', 'web-extra')]
+        assert callable(packages[1].setup.after)
+
+    def test_get_packages_with_error(self, dist):
+        with pytest.raises(SystemExit):
+            dist.get_packages(['web', 'broken'])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import socket
+
+import mock
+
+from alnair import metrics
+from alnair.stats import Stats
+
+RUN = dict(seconds=1.5, hosts=2, failed_hosts=1, timestamp_seconds=100.0)
+
+
+def make_stats():
+    stats = Stats()
+    stats.add('uploads', 2, 'web1')
+    stats.add('put_seconds', 0.5, 'web1')
+    stats.add('uploads', 1, 'web2"')
+    return stats
+
+
+def test_run_metrics():
+    with mock.patch('time.time', return_value=110.0):
+        assert metrics.run_metrics(100.0, 3, 1) == dict(seconds=10.0, hosts=3,
+                failed_hosts=1, timestamp_seconds=110.0)
+
+
+def test_prometheus():
+    assert metrics.prometheus(make_stats(), RUN) == '\n'.join([
+        '# TYPE alnair_run_failed_hosts gauge',
+        'alnair_run_failed_hosts 1',
+        '# TYPE alnair_run_hosts gauge',
+        'alnair_run_hosts 2',
+        '# TYPE alnair_run_seconds gauge',
+        'alnair_run_seconds 1.5',
+        '# TYPE alnair_run_timestamp_seconds gauge',
+        'alnair_run_timestamp_seconds 100.0',
+        '# TYPE alnair_phase_seconds counter',
+        'alnair_phase_seconds{host="web1",phase="put"} 0.5',
+        '# TYPE alnair_uploads_total counter',
+        'alnair_uploads_total{host="web1"} 2',
+        'alnair_uploads_total{host="web2\\""} 1',
+        ]) + '\n'
+
+
+def test_prometheus_without_hosts():
+    stats = Stats()
+    stats.add('commands', 3)
+    assert metrics.prometheus(stats, {}) == '\n'.join([
+        '# TYPE alnair_commands_total counter',
+        'alnair_commands_total 3',
+        ]) + '\n'
+
+
+def test_write_textfile(tmpdir):
+    path = tmpdir.join('alnair.prom')
+    metrics.write_textfile(str(path), 'alnair_run_hosts 2\n')
+    assert path.read() == 'alnair_run_hosts 2\n'
+    assert tmpdir.listdir() == [path]
+
+
+def test_statsd():
+    assert metrics.statsd(make_stats(), RUN) == [
+        'alnair.run.failed_hosts:1|g',
+        'alnair.run.hosts:2|g',
+        'alnair.run.ms:1500|ms',
+        'alnair.host.web1.put.ms:500|ms',
+        'alnair.host.web1.uploads:2|c',
+        'alnair.host.web2".uploads:1|c',
+        'alnair.put.ms:500|ms',
+        'alnair.uploads:3|c',
+        ]
+
+
+def test_send_statsd():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    try:
+        lines = ['alnair.metric%d:%d|c' % (i, i) for i in range(100)]
+        # given as a list through the daemon
+        metrics.send_statsd([u'127.0.0.1', server.getsockname()[1]], lines)
+        received = []
+        while len(received) < len(lines):
+            packet = server.recv(65536)
+            assert len(packet) <= metrics.MAX_PACKET_SIZE
+            received.extend(packet.split('\n'))
+        assert received == lines
+    finally:
+        server.close()
+
+
+def test_send_statsd_with_error():
+    with mock.patch('socket.socket') as mock_socket:
+        sock = mock_socket.return_value
+        sock.sendto.side_effect = socket.error
+        metrics.send_statsd(('127.0.0.1', 8125), ['alnair.run.hosts:1|g'])
+    assert sock.setblocking.call_args == mock.call(False)
+    assert sock.close.call_count == 1
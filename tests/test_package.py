@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import threading
 
 import pytest
 
@@ -34,6 +36,30 @@ class TestCommand(object):
         cmd.sudo(cmd)
         assert cmd._commands == [(cmd, fa.sudo), (cmd, fa.sudo)]
 
+    def test_guards(self):
+        import fabric.api as fa
+        cmd = alnair.Command()
+        cmd.sudo('make install', creates='/usr/bin/foo').run('echo')
+        cmd.run('migrate', unless='check', onlyif='ready')
+        assert cmd._commands == [('make install', fa.sudo), ('echo', fa.run),
+                ('migrate', fa.run)]
+        assert [alnair.package.guards_of(c) for c in cmd._commands] == [
+                (('creates', '/usr/bin/foo'),), (),
+                (('unless', 'check'), ('onlyif', 'ready'))]
+
+    def test_notify(self):
+        cmd = alnair.Command()
+        assert cmd._notify == ()
+        assert cmd.notify('restart nginx') is cmd
+        cmd.notify('reload', 'flush')
+        assert cmd._notify == ('restart nginx', 'reload', 'flush')
+
+    def test_resource(self):
+        cmd = alnair.Command()
+        assert cmd._resource is None
+        assert cmd.resource('database') is cmd
+        assert cmd._resource == 'database'
+
 
 class TestConfig(object):
     @pytest.mark.randomize(('filename', str), ncalls=5)
@@ -41,6 +67,7 @@ class TestConfig(object):
         config = alnair.package.Config(filename=filename)
         assert config._filename == filename
         assert config._contents is None
+        assert config._delta is None
 
     @pytest.mark.randomize(('contents', str), ncalls=5)
     def test_set_contents(self, contents):
@@ -48,6 +75,13 @@ class TestConfig(object):
         assert config.contents(contents) is config
         assert config._contents == contents
 
+    @pytest.mark.parametrize(('block_size', 'expected'), [
+        (None, True), (0, True), (1024, 1024)])
+    def test_delta(self, block_size, expected):
+        config = alnair.package.Config('dummy')
+        assert config.delta(block_size) is config
+        assert config._delta == expected
+
 
 class TestSetup(object):
     def test_init(self):
@@ -55,6 +89,14 @@ class TestSetup(object):
         assert isinstance(setup._host, alnair.package.Host)
         assert setup.after is None
         assert setup._config == {}
+        assert setup._handlers == {}
+
+    def test_handler(self):
+        setup = alnair.package.Setup(alnair.package.Host())
+        handler = setup.handler('restart nginx')
+        assert isinstance(handler, alnair.Command)
+        assert setup.handler('restart nginx') is handler
+        assert setup._handlers == {'restart nginx': handler}
 
     @pytest.mark.randomize(('hostname', str), ('filename', str), ncalls=5)
     def test_config(self, hostname, filename):
@@ -148,3 +190,89 @@ class TestHost(object):
         with host:
             assert host.name == name
         assert host.name is None
+
+    def test_nested(self):
+        package = alnair.Package('dummy')
+        with package.host('host1'):
+            package.setup.config('a')
+            with package.host('host2'):
+                package.setup.config('b')
+            package.setup.config('c')
+        package.setup.config('d')
+        assert sorted(package.setup.config_all) == [(None, 'd'),
+                ('host1', 'a'), ('host1', 'c'), ('host2', 'b')]
+
+    def test_threads(self):
+        package = alnair.Package('dummy')
+        entered = [threading.Event() for _ in range(2)]
+        errors = []
+
+        def build(i):
+            try:
+                with package.host('host%d' % i):
+                    entered[i].set()
+                    # wait until the other thread has entered its host too
+                    entered[1 - i].wait(5)
+                    for name in ('a', 'b'):
+                        package.setup.config(name).contents(str(i))
+            except Exception as exc:
+                errors.append(exc)
+        threads = [threading.Thread(target=build, args=(i,))
+                for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert dict((key, config._contents) for key, config
+                in package.setup.config_all.iteritems()) == {
+                        ('host0', 'a'): '0', ('host0', 'b'): '0',
+                        ('host1', 'a'): '1', ('host1', 'b'): '1'}
+        assert package._host.name is None
+
+
+class TestSlots(object):
+    @pytest.mark.parametrize(('factory',), [
+        (lambda: alnair.Command(),),
+        (lambda: alnair.package.Config('dummy'),),
+        (lambda: alnair.package.Setup(alnair.package.Host()),),
+        (lambda: alnair.package.Host(),),
+        (lambda: alnair.Package('dummy'),),
+        ])
+    def test_no_instance_dict(self, factory):
+        obj = factory()
+        assert not hasattr(obj, '__dict__')
+        with pytest.raises(AttributeError):
+            obj.undefined = None
+
+    def test_interned(self):
+        pkg = alnair.Package('dummy')
+        configs = []
+        for hostname in ('host1', 'host2'):
+            with pkg.host(hostname):
+                configs.append(pkg.setup.config(''.join(['/etc/', 'conf']))
+                        .sudo(' '.join(['service', 'restart'])))
+        assert configs[0]._filename is configs[1]._filename
+        assert configs[0]._commands[0][0] is configs[1]._commands[0][0]
+        keys = [key for key in pkg.setup.config_all]
+        assert keys[0][1] is keys[1][1]
+
+    def test_shared_contents(self):
+        pkg1 = alnair.Package('pkg1')
+        pkg2 = alnair.Package('pkg2')
+        config1 = pkg1.setup.config('/etc/a').contents(''.join(['a', 'b']))
+        config2 = pkg2.setup.config('/etc/b').contents(''.join(['a', 'b']))
+        config3 = pkg2.setup.config('/etc/c').contents(u"ab")
+        assert config1._contents is config2._contents
+        assert type(config3._contents) is unicode
+        alnair.package.clear_contents()
+        assert alnair.package._contents == {}
+
+    def test_memory(self):
+        class DictConfig(alnair.package.Config):
+            pass
+
+        slotted = alnair.package.Config('/etc/conf')
+        unslotted = DictConfig('/etc/conf')
+        assert sys.getsizeof(slotted) < (sys.getsizeof(unslotted) +
+                sys.getsizeof(unslotted.__dict__)) / 2
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+import pytest
+
+from alnair import resource
+from alnair.resource import Limits
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ('install=20', ('install', 20)),
+    ('db.primary=1', ('db.primary', 1)),
+    ])
+def test_parse(value, expected):
+    assert resource.parse(value) == expected
+
+
+@pytest.mark.parametrize(('value',), [
+    ('install',), ('=1',), ('install=x',), ('install=0',), ('a b=1',),
+    ])
+def test_parse_with_invalid_value(value):
+    with pytest.raises(ValueError):
+        resource.parse(value)
+
+
+class TestLimits(object):
+    def test_acquire(self):
+        limits = Limits(dict(install=2))
+        assert 'install' in limits
+        assert 'upload' not in limits
+        semaphore = limits._semaphores['install']
+        with limits.acquire('install'):
+            assert semaphore.get_value() == 1
+            with limits.acquire('upload'):
+                pass
+        assert semaphore.get_value() == 2
+
+    def test_acquire_is_released_on_error(self):
+        limits = Limits(dict(install=1))
+        with pytest.raises(ValueError):
+            with limits.acquire('install'):
+                raise ValueError
+        assert limits._semaphores['install'].get_value() == 1
+
+    def test_acquire_is_shared_by_processes(self):
+        limits = Limits(dict(install=1))
+
+        def child(writer):
+            writer.send(limits._semaphores['install'].acquire(False))
+        reader, writer = multiprocessing.Pipe(False)
+        with limits.acquire('install'):
+            proc = multiprocessing.Process(target=child, args=(writer,))
+            proc.start()
+            assert reader.recv() is False
+            proc.join()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import pytest
+
+from alnair import runner
+from alnair.runner import HostResult, Runner
+
+
+@pytest.mark.parametrize(('value', 'total', 'expected'), [
+    ('0', 10, 0), ('3', 10, 3), (3, 10, 3), ('50%', 10, 5), ('25%', 10, 2),
+    ('100%', 3, 3), ('0%', 3, 0),
+    ])
+def test_parse_size(value, total, expected):
+    assert runner.parse_size(value, total) == expected
+
+
+@pytest.mark.parametrize(('value',), [
+    ('-1',), ('101%',), ('-1%',), ('a',), ('a%',),
+    ])
+def test_parse_size_with_invalid_value(value):
+    with pytest.raises(ValueError):
+        runner.parse_size(value, 10)
+
+
+def test_format_report():
+    results = [HostResult('host1', runner.OK, 1),
+               HostResult('host2', runner.FAILED, error='Traceback\nError\n'),
+               HostResult('host3', runner.SKIPPED)]
+    assert runner.format_report(results) == [
+        u"[host:host1] ok",
+        u"[host:host2] failed: Error",
+        u"[host:host3] skipped",
+        u"1 ok, 1 failed, 1 skipped",
+        ]
+
+
+class TestRunner(object):
+    def test_init(self):
+        r = Runner(['host1', 'host2'])
+        assert r.hosts == ['host1', 'host2']
+        assert r.parallel is False
+        assert r.batch_size == 1
+        assert r.max_failures == 0
+        assert r.host_timeout is None
+        assert r.run_timeout is None
+
+    @pytest.mark.parametrize(('kwargs',), [
+        (dict(host_timeout=1),), (dict(run_timeout=1),)])
+    def test_init_with_timeout(self, kwargs):
+        r = Runner(['host1', 'host2'], **kwargs)
+        assert r.parallel is True
+        assert r.batch_size == 1
+
+    @pytest.mark.parametrize(('batch_size', 'expected'), [
+        (None, [['h0'], ['h1'], ['h2'], ['h3'], ['h4']]),
+        ('2', [['h0', 'h1'], ['h2', 'h3'], ['h4']]),
+        ('0', [['h0'], ['h1'], ['h2'], ['h3'], ['h4']]),
+        ('40%', [['h0', 'h1'], ['h2', 'h3'], ['h4']]),
+        ('100%', [['h0', 'h1', 'h2', 'h3', 'h4']]),
+        ])
+    def test_windows(self, batch_size, expected):
+        hosts = ['h%d' % i for i in range(5)]
+        assert Runner(hosts, batch_size).windows() == expected
+
+    @pytest.mark.parametrize(('kwargs',), [
+        (dict(batch_size='x'),), (dict(max_failures='200%'),),
+        ])
+    def test_init_with_invalid_size(self, kwargs):
+        with pytest.raises(ValueError):
+            Runner(['host1'], **kwargs)
+
+    def test_run_serial(self):
+        import fabric.api as fa
+        called = []
+
+        def func(host):
+            called.append((host, fa.env.host_string))
+            return host.upper()
+        results = Runner(['host1', 'host2']).run(func)
+        assert called == [('host1', 'host1'), ('host2', 'host2')]
+        assert [(r.host, r.status, r.value) for r in results] == [
+            ('host1', runner.OK, 'HOST1'), ('host2', runner.OK, 'HOST2')]
+
+    def test_run_serial_with_failure(self):
+        def func(host):
+            raise SystemExit(1)
+        with pytest.raises(SystemExit):
+            Runner(['host1', 'host2']).run(func)
+
+    def test_run_parallel(self):
+        import fabric.api as fa
+
+        def func(host):
+            return (fa.env.host_string, os.getpid())
+        hosts = ['h%d' % i for i in range(5)]
+        results = Runner(hosts, '2').run(func)
+        assert [r.host for r in results] == hosts
+        assert all(r.ok for r in results)
+        assert [r.value[0] for r in results] == hosts
+        assert os.getpid() not in [r.value[1] for r in results]
+
+    @pytest.mark.parametrize(('max_failures', 'expected'), [
+        (None, ['ok', 'ok', 'failed', 'ok', 'skipped', 'skipped']),
+        ('1', ['ok', 'ok', 'failed', 'ok', 'failed', 'ok']),
+        ])
+    def test_run_parallel_with_failures(self, max_failures, expected):
+        def func(host):
+            if host == 'h2':
+                raise SystemExit(1)
+            if host == 'h4':
+                raise ValueError('test')
+            return host
+        hosts = ['h%d' % i for i in range(6)]
+        results = Runner(hosts, '2', max_failures).run(func)
+        assert [r.status for r in results] == expected
+        assert results[2].error == u"aborted with code 1"
+        if expected[4] == runner.FAILED:
+            assert 'ValueError: test' in results[4].error
+
+    def test_run_parallel_with_exited_child(self):
+        def func(host):
+            os._exit(3)
+        results = Runner(['host1'], '1').run(func)
+        assert results[0].status == runner.FAILED
+        assert results[0].error == u"exited with code 3"
+
+    def test_run_with_host_timeout(self):
+        def func(host):
+            if host == 'h1':
+                time.sleep(10)
+            return host
+        started = time.time()
+        results = Runner(['h0', 'h1', 'h2'], '3', '1',
+                host_timeout=0.2).run(func)
+        assert time.time() - started < 5
+        assert [r.status for r in results] == ['ok', 'failed', 'ok']
+        assert results[1].error == u"timed out after 0.2 seconds"
+
+    def test_run_with_host_timeout_releases_resources(self):
+        from alnair.resource import Limits
+        limits = Limits(dict(install=1))
+
+        def func(host):
+            with limits.acquire('install'):
+                time.sleep(10)
+        results = Runner(['h0'], '1', host_timeout=0.2).run(func)
+        assert results[0].status == runner.FAILED
+        assert limits._semaphores['install'].get_value() == 1
+
+    @pytest.mark.parametrize(('max_failures', 'expected'), [
+        (None, ['failed', 'skipped', 'skipped']),
+        ('100%', ['failed', 'ok', 'ok']),
+        ])
+    def test_run_with_host_timeout_one_by_one(self, max_failures, expected):
+        def func(host):
+            if host == 'h0':
+                time.sleep(10)
+            return host
+        results = Runner(['h0', 'h1', 'h2'], '1', max_failures,
+                host_timeout=0.2).run(func)
+        assert [r.status for r in results] == expected
+        assert results[0].error == u"timed out after 0.2 seconds"
+
+    def test_run_with_run_timeout(self):
+        def func(host):
+            time.sleep(10)
+        started = time.time()
+        results = Runner(['h0', 'h1', 'h2'], '2', '100%',
+                run_timeout=0.2).run(func)
+        assert time.time() - started < 5
+        assert [r.status for r in results] == ['failed', 'failed', 'skipped']
+        assert all(r.error == u"run timed out after 0.2 seconds"
+                for r in results)
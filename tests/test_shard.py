@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from alnair import shard
+from alnair.runner import FAILED, OK, SKIPPED, HostResult
+from alnair.stats import Stats
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ('1/1', (1, 1)),
+    ('2/4', (2, 4)),
+    ('4/4', (4, 4)),
+    ])
+def test_parse(value, expected):
+    assert shard.parse(value) == expected
+
+
+@pytest.mark.parametrize(('value',), [
+    ('1',), ('a/4',), ('0/4',), ('5/4',), ('1/0',), ('',),
+    ])
+def test_parse_with_invalid_value(value):
+    with pytest.raises(ValueError):
+        shard.parse(value)
+
+
+def test_owner():
+    hosts = ['web%03d' % i for i in xrange(1, 301)]
+    owners = [shard.owner(host, 4) for host in hosts]
+    assert owners == [shard.owner(host, 4) for host in hosts]
+    assert set(owners) == set([1, 2, 3, 4])
+    for i in xrange(1, 5):
+        assert 50 < owners.count(i) < 100
+
+
+def test_owner_with_added_shard():
+    hosts = ['web%03d' % i for i in xrange(1, 301)]
+    for host in hosts:
+        # a host moves to the added shard or stays in the same shard
+        assert shard.owner(host, 5) in (5, shard.owner(host, 4))
+
+
+def test_select():
+    hosts = ['web%03d' % i for i in xrange(1, 101)]
+    selected = [shard.select(hosts, i, 3) for i in xrange(1, 4)]
+    assert sorted(sum(selected, [])) == hosts
+    for s in selected:
+        assert s == sorted(s)
+    assert shard.select(hosts, 1, 1) == hosts
+
+
+def test_write_results(tmpdir):
+    path = tmpdir.join('results.json')
+    stats = Stats()
+    stats.add('uploads', 2, 'host1')
+    shard.write_results(str(path), [HostResult('host1', OK, value=stats),
+        HostResult('host2', FAILED, error=u"aborted")], stats, '1/2')
+    assert json.loads(path.read()) == dict(shard='1/2', stats=dict(
+        counters=dict(uploads=2), hosts=dict(host1=dict(uploads=2))),
+        results=[dict(host='host1', status=OK, error=None),
+            dict(host='host2', status=FAILED, error=u"aborted")])
+    assert tmpdir.listdir() == [path]
+
+
+def test_merge(tmpdir):
+    paths = []
+    for i, results in enumerate([[HostResult('host2', OK)],
+            [HostResult('host1', FAILED, error=u"aborted"),
+                HostResult('host3', SKIPPED)]], 1):
+        stats = Stats()
+        stats.add('uploads', i, results[0].host)
+        path = str(tmpdir.join('%d.json' % i))
+        shard.write_results(path, results, stats, '%d/3' % i)
+        paths.append(path)
+    results, stats, missing = shard.merge(paths)
+    assert [(r.host, r.status, r.error) for r in results] == [
+            ('host2', OK, None), ('host1', FAILED, u"aborted"),
+            ('host3', SKIPPED, None)]
+    assert stats['uploads'] == 3
+    assert stats.host('host1') == [('uploads', 2)]
+    assert missing == ['3/3']
+
+
+def test_merge_without_shard(tmpdir):
+    path = str(tmpdir.join('results.json'))
+    shard.write_results(path, [HostResult(None, OK)], Stats())
+    results, stats, missing = shard.merge([path])
+    assert [(r.host, r.status) for r in results] == [(None, OK)]
+    assert missing == []
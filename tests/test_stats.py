@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import mock
+import pytest
+
+from alnair.stats import Stats
+
+
+class TestStats(object):
+    def test_init(self):
+        stats = Stats()
+        assert stats._counters == {}
+        assert list(stats) == []
+
+    @pytest.mark.randomize(('value', int), ncalls=5)
+    def test_add(self, value):
+        stats = Stats()
+        stats.add('test')
+        stats.add('test', value)
+        assert stats['test'] == value + 1
+        assert stats['unknown'] == 0
+
+    def test_merge(self):
+        stats = Stats()
+        stats.add('a', 1)
+        other = Stats()
+        other.add('a', 2)
+        other.add('b', 3)
+        assert stats.merge(other) is stats
+        assert list(stats) == [('a', 3), ('b', 3)]
+        assert list(other) == [('a', 2), ('b', 3)]
+
+    def test_hosts(self):
+        stats = Stats()
+        stats.add('a', 1, 'host1')
+        stats.add('a', 2)
+        other = Stats()
+        other.add('a', 3, 'host1')
+        other.add('b', 4, 'host2')
+        stats.merge(other)
+        assert list(stats) == [('a', 6), ('b', 4)]
+        assert stats.hosts == ['host1', 'host2']
+        assert stats.host('host1') == [('a', 4)]
+        assert stats.host('host2') == [('b', 4)]
+        assert stats.host('nosuchhost') == []
+
+    def test_timer(self):
+        stats = Stats()
+        with mock.patch('time.time', side_effect=[10.0, 12.5]):
+            with stats.timer('install', 'host1'):
+                pass
+        with pytest.raises(ValueError):
+            with stats.timer('install'):
+                raise ValueError
+        assert 2.5 <= stats['install_seconds'] < 3
+        assert stats.host('host1') == [('install_seconds', 2.5)]
+
+    def test_as_dict(self):
+        stats = Stats()
+        stats.add('uploads', 2, 'host1')
+        stats.add('uploads', 1)
+        data = json.loads(json.dumps(stats.as_dict()))
+        assert data == dict(counters=dict(uploads=3),
+                hosts=dict(host1=dict(uploads=2)))
+        restored = Stats.from_dict(data)
+        assert restored['uploads'] == 3
+        assert restored.hosts == ['host1']
+        assert restored.host('host1') == [('uploads', 2)]
+
+    @pytest.mark.parametrize(('counters', 'expected'), [
+        ({}, []),
+        (dict(uploads=2, upload_bytes=100, sent_bytes=40),
+            [u"uploaded 2 file(s): 40 bytes sent for 100 bytes (60 bytes"
+             u" saved)"]),
+        (dict(unchanged=3), [u"3 file(s) unchanged"]),
+        ])
+    def test_summary(self, counters, expected):
+        stats = Stats()
+        for name, value in counters.iteritems():
+            stats.add(name, value)
+        assert stats.summary() == expected
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import hashlib
+import os
+import subprocess
+
+from io import BytesIO
+
+import mock
+import pytest
+
+from alnair import transfer
+
+
+class Result(str):
+    def __new__(cls, value, failed=False):
+        self = super(Result, cls).__new__(cls, value)
+        self.failed = failed
+        return self
+
+
+def run_script(script):
+    return subprocess.check_output(['sh', '-c', script])
+
+
+@contextlib.contextmanager
+def mock_fabric():
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            put=mock.DEFAULT, run=mock.DEFAULT) as mock_fa:
+        mock_fa['run'].return_value = Result('/tmp/alnair.XXXXXXXXXX')
+        yield mock_fa
+
+
+@pytest.mark.parametrize(('size', 'block_size', 'expected'), [
+    (0, None, transfer.DEFAULT_BLOCK_SIZE),
+    (100, None, transfer.DEFAULT_BLOCK_SIZE),
+    (transfer.DEFAULT_BLOCK_SIZE * transfer.MAX_BLOCKS * 2, None,
+        transfer.DEFAULT_BLOCK_SIZE * 2),
+    (100, 16, 16),
+    ])
+def test_block_size_for(size, block_size, expected):
+    assert transfer.block_size_for(size, block_size) == expected
+
+
+@pytest.mark.parametrize(('old', 'new', 'runs', 'literal'), [
+    ('aaaabbbbcccc', 'aaaabbbbcccc', [], ''),
+    ('aaaabbbbcccc', 'aaaaxxxxcccc', [(1, 1)], 'xxxx'),
+    ('aaaabbbbcccc', 'xxxxyyyycccc', [(0, 2)], 'xxxxyyyy'),
+    ('aaaabbbbcccc', 'xxxxbbbbyyyy', [(0, 1), (2, 1)], 'xxxxyyyy'),
+    ('aaaabbbb', 'aaaabbbbcc', [(2, 1)], 'cc'),
+    ('aaaabbbbcccc', 'aaaabb', [(1, 1)], 'bb'),
+    ('', 'aaaa', [(0, 1)], 'aaaa'),
+    ])
+def test_compute_delta(old, new, runs, literal):
+    checksums = transfer.block_checksums(old, 4)
+    assert transfer.compute_delta(new, 4, checksums) == (runs, literal)
+
+
+@pytest.mark.parametrize(('old', 'new'), [
+    ('aaaabbbbcccc', 'aaaaxxxxcccc'),
+    ('aaaabbbbcccc', 'xxxxbbbbyyyy'),
+    ('aaaabbbb', 'aaaabbbbccccdd'),
+    ('aaaabbbbcccc', 'aaaab'),
+    ('aaaabbbbcccc', 'aaaabbbb'),
+    ])
+def test_patch_script(tmpdir, old, new):
+    target = tmpdir.join('target')
+    target.write(old)
+    literal_file = tmpdir.join('literal')
+    checksums = run_script(transfer.CHECKSUM_SCRIPT % dict(
+        path=str(target), block_size=4, missing=transfer.REMOTE_MISSING))
+    checksums = [line.split()[0] for line in checksums.splitlines()]
+    assert checksums == transfer.block_checksums(old, 4)
+    runs, literal = transfer.compute_delta(new, 4, checksums)
+    literal_file.write(literal)
+    run_script(transfer.patch_script(str(target), str(literal_file), 4, runs,
+        len(new), hashlib.md5(new).hexdigest()))
+    assert target.read() == new
+    assert not literal_file.check()
+    assert tmpdir.listdir() == [target]
+
+
+def test_patch_script_with_checksum_mismatch(tmpdir):
+    target = tmpdir.join('target')
+    target.write('aaaabbbb')
+    literal_file = tmpdir.join('literal')
+    literal_file.write('xxxx')
+    script = transfer.patch_script(str(target), str(literal_file), 4,
+            [(1, 1)], 8, hashlib.md5('aaaayyyy').hexdigest())
+    assert subprocess.call(['sh', '-c', script]) != 0
+    assert target.read() == 'aaaabbbb'
+    assert tmpdir.listdir() == [target]
+
+
+def test_checksum_script_with_missing_file(tmpdir):
+    script = transfer.CHECKSUM_SCRIPT % dict(path=str(tmpdir.join('nosuch')),
+            block_size=4, missing=transfer.REMOTE_MISSING)
+    assert subprocess.call(['sh', '-c', script]) == transfer.REMOTE_MISSING
+
+
+def test_put_delta_with_missing_remote_file():
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            put=mock.DEFAULT) as mock_fa:
+        mock_fa['sudo'].return_value = Result('', failed=True)
+        assert transfer.put_delta('testdata', 'testfile') == (
+                len('testdata'), True)
+        assert mock_fa['sudo'].call_count == 1
+        assert mock_fa['put'].call_count == 1
+        sio, path = mock_fa['put'].call_args[0]
+        assert isinstance(sio, BytesIO)
+        assert sio.read() == 'testdata'
+        assert path == 'testfile'
+        assert mock_fa['put'].call_args[1] == dict(use_sudo=True)
+
+
+def test_put_delta_with_unchanged_remote_file():
+    data = 'a' * 10000
+    checksums = transfer.block_checksums(data, transfer.DEFAULT_BLOCK_SIZE)
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            put=mock.DEFAULT) as mock_fa:
+        mock_fa['sudo'].return_value = Result('\n'.join('%s  -' % c
+            for c in checksums))
+        assert transfer.put_delta(data, 'testfile') == (0, False)
+        assert mock_fa['sudo'].call_count == 1
+        assert mock_fa['put'].call_count == 0
+
+
+def test_put_delta_with_changed_blocks():
+    old = 'a' * 4 * 10
+    new = 'a' * 4 * 9 + 'b' * 4
+    with mock_fabric() as mock_fa:
+        mock_fa['sudo'].return_value = Result('\n'.join(
+            transfer.block_checksums(old, 4)))
+        assert transfer.put_delta(new, 'testfile', 4) == (4, True)
+        assert mock_fa['sudo'].call_count == 2
+        assert mock_fa['put'].call_count == 1
+        sio, path = mock_fa['put'].call_args[0]
+        assert sio.read() == 'bbbb'
+        assert path == '/tmp/alnair.XXXXXXXXXX'
+        assert mock_fa['run'].call_args[0][0].startswith('mktemp ')
+        script = mock_fa['sudo'].call_args[0][0]
+        assert 'seek=9 count=1' in script
+        assert hashlib.md5(new).hexdigest() in script
+
+
+def test_put_delta_with_truncated_file():
+    old = 'a' * 4 * 10
+    new = 'a' * 4 * 5
+    with mock_fabric() as mock_fa:
+        mock_fa['sudo'].return_value = Result('\n'.join(
+            transfer.block_checksums(old, 4)))
+        assert transfer.put_delta(new, 'testfile', 4) == (0, True)
+        assert mock_fa['sudo'].call_count == 2
+        assert hashlib.md5(new).hexdigest() in mock_fa['sudo'].call_args[0][0]
+
+
+def test_put_delta_with_failed_patch():
+    old = 'a' * 4 * 10
+    new = 'a' * 4 * 9 + 'b' * 4
+    with mock_fabric() as mock_fa:
+        mock_fa['sudo'].side_effect = [
+            Result('\n'.join(transfer.block_checksums(old, 4))),
+            Result('', failed=True),
+            ]
+        assert transfer.put_delta(new, 'testfile', 4) == (4 + len(new),
+                True)
+        assert mock_fa['put'].call_count == 2
+        sio, path = mock_fa['put'].call_args[0]
+        assert sio.read() == new
+        assert path == 'testfile'
+        assert mock_fa['put'].call_args[1] == dict(use_sudo=True)
+
+
+def test_put_delta_with_mostly_changed_blocks():
+    old = 'a' * 4 * 10
+    new = 'b' * 4 * 10
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            put=mock.DEFAULT) as mock_fa:
+        mock_fa['sudo'].return_value = Result('\n'.join(
+            transfer.block_checksums(old, 4)))
+        assert transfer.put_delta(new, 'testfile', 4) == (len(new), True)
+        assert mock_fa['sudo'].call_count == 1
+        assert mock_fa['put'].call_args[0][1] == 'testfile'
+        assert mock_fa['put'].call_args[1] == dict(use_sudo=True)
+
+
+@pytest.mark.parametrize(('codec', 'command'), [
+    ('gzip', ['gzip', '-dc']),
+    ])
+def test_compress(codec, command):
+    data = 'testdata' * 100
+    compressed = transfer.compress(data, codec)
+    assert len(compressed) < len(data)
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+    assert proc.communicate(compressed)[0] == data
+
+
+def test_compress_with_unknown_codec():
+    with pytest.raises(ValueError):
+        transfer.compress('testdata', 'unknown')
+
+
+@pytest.mark.parametrize(('output', 'expected'), [
+    ('/usr/bin/gzip', 'gzip'),
+    ('', None),
+    ('/usr/bin/zstd\n/bin/gzip', 'zstd' if transfer.zstandard else 'gzip'),
+    ])
+def test_remote_codec(output, expected):
+    with mock.patch('fabric.api.run') as mock_run:
+        mock_run.return_value = Result(output)
+        assert transfer.remote_codec() == expected
+
+
+def test_put():
+    with mock.patch.multiple('fabric.api', sudo=mock.DEFAULT,
+            put=mock.DEFAULT) as mock_fa:
+        assert transfer.put(u'testdata', 'testfile') == len('testdata')
+        assert mock_fa['sudo'].call_count == 0
+        sio, path = mock_fa['put'].call_args[0]
+        assert sio.read() == 'testdata'
+        assert path == 'testfile'
+
+
+def test_put_with_codec(tmpdir):
+    data = 'testdata' * 100
+    with mock_fabric() as mock_fa:
+        sent = transfer.put(data, str(tmpdir.join('testfile')), 'gzip')
+        sio, path = mock_fa['put'].call_args[0]
+        compressed = sio.read()
+        assert sent == len(compressed) < len(data)
+        assert path == '/tmp/alnair.XXXXXXXXXX'
+        command = mock_fa['sudo'].call_args[0][0]
+    tmpdir.join('upload').write(compressed, 'wb')
+    run_script(command.replace(path, str(tmpdir.join('upload'))))
+    assert tmpdir.join('testfile').read() == data
+    assert tmpdir.listdir() == [tmpdir.join('testfile')]
+
+
+def test_decompress_script_with_failure(tmpdir):
+    tmpdir.join('testfile').write('olddata')
+    tmpdir.join('upload').write('not compressed', 'wb')
+    script = transfer.decompress_script(str(tmpdir.join('testfile')),
+            str(tmpdir.join('upload')), 'gzip -dc')
+    assert subprocess.call(['sh', '-c', script],
+            stderr=open(os.devnull, 'w')) != 0
+    assert tmpdir.join('testfile').read() == 'olddata'
+    assert tmpdir.listdir() == [tmpdir.join('testfile')]
+
+
+def test_put_with_codec_and_incompressible_data():
+    data = os.urandom(5000)
+    with mock_fabric() as mock_fa:
+        assert len(transfer.compress(data, 'gzip')) >= len(data)
+        assert transfer.put(data, 'testfile', 'gzip') == len(data)
+        assert mock_fa['run'].call_count == 0
+        assert mock_fa['sudo'].call_count == 0
+        sio, path = mock_fa['put'].call_args[0]
+        assert sio.read() == data
+        assert path == 'testfile'
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import os
+import threading
+
+import mock
+import pytest
+
+import alnair
+
+from alnair import watch
+
+RECIPE = """\
+from alnair import Package
+
+pkg1 = Package('pkg1')
+pkg1.setup.config('test_conffile1').contents(%r)
+pkg1.setup.config('test_conffile2').contents(%r).sudo('testcmd')
+with pkg1.host('testhost1'):
+    pkg1.setup.config('test_conffile3').contents(%r)
+"""
+
+
+@pytest.fixture
+def recipes(tmpdir):
+    distdir = tmpdir.mkdir('recipes').mkdir('testdist')
+    distdir.join('pkg1.py').write(RECIPE % ('data1', 'data2', 'data3'))
+    return distdir
+
+
+def test_diff():
+    pkg = alnair.Package('pkg1')
+    pkg.setup.config('test_conffile1').contents("data1")
+    pkg.setup.config('test_conffile2').contents("data2")
+    old = watch.snapshot(pkg.setup)
+    assert watch.diff(old, old) == ([], False)
+    pkg.setup.config('test_conffile2').contents("changed")
+    pkg.setup.config('test_conffile2').run('testcmd')
+    with pkg.host('testhost1'):
+        pkg.setup.config('test_conffile3').contents("data3")
+    pkg.setup.sudo('testcmd')
+    assert watch.diff(old, watch.snapshot(pkg.setup)) == ([
+        (None, 'test_conffile2'), ('testhost1', 'test_conffile3')], True)
+
+
+@pytest.mark.parametrize(('use_inotify',), [(True,), (False,)])
+def test_watcher(recipes, use_inotify):
+    watcher = watch.Watcher(str(recipes), 0.05, use_inotify)
+    try:
+        if use_inotify and watcher.polling:
+            pytest.skip("inotify is not available")
+        assert watcher.wait(0.1) == []
+        timer = threading.Timer(0.2, lambda: (
+            recipes.join('pkg1.py').write("changed\n"),
+            recipes.join('pkg2.py').write(""),
+            recipes.join('README').write("")))
+        timer.start()
+        assert watcher.wait(5) == [str(recipes.join('pkg1.py')),
+                str(recipes.join('pkg2.py'))]
+        timer.join()
+    finally:
+        watcher.close()
+
+
+class TestWatch(object):
+    def setup_method(self, method):
+        self.orig_setup = alnair.setup
+        alnair.setup = alnair.Setup(alnair._Host())
+
+    def teardown_method(self, method):
+        alnair.setup = self.orig_setup
+
+    @pytest.mark.parametrize(('hosts', 'contents', 'expected'), [
+        (None, ('data1', 'data2', 'data3'), []),
+        (None, ('changed1', 'data2', 'data3'), [(None, 'test_conffile1')]),
+        (['testhost1', 'testhost2'], ('data1', 'data2', 'changed3'),
+            [('testhost1', 'test_conffile3')]),
+        (['testhost1', 'testhost2'], ('data1', 'changed2', 'data3'),
+            [('testhost1', 'test_conffile2'),
+             ('testhost2', 'test_conffile2')]),
+        ])
+    def test_changed(self, recipes, hosts, contents, expected):
+        import fabric.api as fa
+        w = watch.Watch('testdist', ['pkg1'], hosts)
+        w.dist.CONFIG_DIR = os.path.dirname(str(recipes))
+        w.start()
+        recipe = recipes.join('pkg1.py')
+        recipe.write(RECIPE % contents)
+        put = []
+        with contextlib.nested(
+                mock.patch('fabric.api.put', side_effect=lambda sio, path,
+                    **kwargs: put.append((fa.env.host_string, path))),
+                mock.patch('fabric.api.sudo', autospec=True),
+                fa.settings(host_string=None)) as (_, mock_sudo, _):
+            applied = w.changed([str(recipe), str(recipes.join('pkg2.py'))])
+            assert w.changed([str(recipe)]) == []
+        assert put == expected
+        assert [key for _, keys in applied for key in keys] == sorted(set(
+            ('testhost1' if p == 'test_conffile3' else None, p)
+            for _, p in expected))
+        assert mock_sudo.call_count == sum(1 for _, path in expected
+                if path == 'test_conffile2')
+
+    def test_changed_with_broken_recipe(self, recipes, capsys):
+        w = watch.Watch('testdist', ['pkg1'])
+        w.dist.CONFIG_DIR = os.path.dirname(str(recipes))
+        w.start()
+        recipe = recipes.join('pkg1.py')
+        recipe.write("syntax error\n")
+        assert w.changed([str(recipe)]) == []
+        assert 'SyntaxError' in capsys.readouterr()[0]